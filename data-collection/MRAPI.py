@@ -10,41 +10,596 @@ import ast
 import datetime
 import os
 import glob
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque, namedtuple
+import itertools
+import hashlib
+import base64
+import sqlite3
+import threading
+import zlib
+import gzip
+import re
+import logging
+from contextlib import contextmanager
+
+# folder of this module, every default path is resolved against it instead of the working directory
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the repository's data folder, the default home of the raw and cleaned files and of every store
+DATA_FOLDER = os.path.normpath(os.path.join(HERE, '..', 'data'))
+
+# rank tiers by match-history 'score_info.level' (3 divisions per tier, Eternity and One Above All are single levels)
+RANK_TIERS = ['Bronze', 'Silver', 'Gold', 'Platinum', 'Diamond', 'Grandmaster', 'Celestial', 'Eternity', 'One Above All']
+
+
+def rank_bucket(level):
+    """
+    Maps a match-history rank level to its tier name (e.g. 13 -> 'Diamond'), unknown or missing levels map to 'Unranked'.
+
+    level (int): The 'score_info.level' value from the match-history endpoint.
+    """
+    if level is None or pd.isna(level) or int(level) < 1:
+        return 'Unranked'
+    return RANK_TIERS[min((int(level) - 1) // 3, len(RANK_TIERS) - 1)]
+
+
+# python-repr tokens for parse_repr: plain single quoted strings, plain double quoted strings, strings with escapes, constants
+REPR_TOKENS = re.compile(r"'([^'\\\"]*)'|\"([^\"\\]*)\"|('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|\b(True|False|None)\b")
+REPR_CONSTANTS = {'True': 'true', 'False': 'false', 'None': 'null'}
+
+
+def repr_token_to_json(match):
+    group = match.lastindex
+    if group == 1:
+        return '"' + match.group(1) + '"'
+    if group == 2:
+        return match.group(0)
+    if group == 3:
+        return json.dumps(ast.literal_eval(match.group(3)))
+    return REPR_CONSTANTS[match.group(4)]
+
+
+def parse_repr(value):
+    """
+    Parses the python-repr strings pandas writes for nested columns (e.g. 'match_details.match_players') back into lists/dicts.
+    Same result as ast.literal_eval but several times faster: the repr is translated to JSON and parsed with json.loads.
+    When no string in the value holds a quote or a backslash (most matches) the translation is a few str.replace calls,
+    otherwise the strings are rewritten token by token. Anything json cannot read falls back to ast.literal_eval.
+
+    value (str): The python-repr string.
+    """
+    try:
+        if '"' not in value and '\\' not in value and '\x00' not in value:
+            # every single quote delimits a string, so the even parts are outside the strings
+            parts = value.split("'")
+            outside = '\x00'.join(parts[0::2]).replace('True', 'true').replace('False', 'false').replace('None', 'null')
+            parts[0::2] = outside.split('\x00')
+            return json.loads('"'.join(parts))
+        return json.loads(REPR_TOKENS.sub(repr_token_to_json, value))
+    except ValueError:
+        return ast.literal_eval(value)
+
+
+# module logger, silent unless the application (or configure_logging) adds a handler
+logger = logging.getLogger('MRAPI')
+logger.addHandler(logging.NullHandler())
+
+# fields passed through logging's extra={} that the formatters print after the message
+LOG_FIELDS = ['endpoint', 'url', 'status', 'latency_ms', 'bytes', 'stage', 'seconds']
+
+
+class StructuredFormatter(logging.Formatter):
+
+    """
+    Formats records as 'time level message key=value ...' or, with as_json, as one JSON object per line.
+    The key/values are the LOG_FIELDS passed with extra={...}.
+    """
+
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = {name: getattr(record, name) for name in LOG_FIELDS if hasattr(record, name)}
+        if self.as_json:
+            return json.dumps(dict({'time': self.formatTime(record), 'level': record.levelname, 'message': record.getMessage()}, **fields), default=str)
+        extra = ' '.join(f'{name}={value}' for name, value in fields.items())
+        return f'{self.formatTime(record)} {record.levelname} {record.getMessage()}' + (f' {extra}' if extra else '')
+
+
+def configure_logging(level='INFO', as_json=False, stream=None):
+    """
+    Turns on the MRAPI logs (they are silent by default).
+    'INFO' shows the progress of collection/cleaning runs, 'DEBUG' also every request, URL and parameter change.
+
+    level (str | int): The logging level.
+    as_json (bool): Write one JSON object per record instead of text (optional).
+    stream (file): Where to write the logs (optional, defaults to stderr).
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(StructuredFormatter(as_json=as_json))
+    for existing in [h for h in logger.handlers if isinstance(h, logging.StreamHandler)]:
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger
+
+
+class Metrics:
+
+    """
+    Thread safe run metrics for the client and the cleaner: counters, latency histograms and stage timings.
+    The client records per endpoint request latency, bytes received, status codes, retries and cache hits/misses,
+    get_total_data and DataCleaner.clean time their stages. summary() returns everything as a dict and export(path)
+    writes it as JSON at the end of a run.
+
+    Attributes:
+        buckets (list): Upper bounds (ms) of the latency histogram buckets, the last bucket is open ended.
+        counters (dict): name -> key -> count (e.g. 'status' -> 'match:200' -> 12).
+        histograms (dict): name -> key -> {'count', 'sum', 'min', 'max', 'buckets'}.
+        stages (dict): stage -> {'count', 'seconds'}.
+
+    Methods:
+        increment(name, key, value=1): Adds to a counter.
+        observe(name, key, value): Adds a value to a histogram.
+        stage(name): Context manager timing a stage.
+        summary(): Returns the metrics as a dict.
+        export(path): Writes the summary as JSON.
+    """
+
+    buckets = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+
+
+    def increment(self, name, key='total', value=1):
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+
+    def observe(self, name, key, value):
+        with self.lock:
+            histogram = self.histograms.get(name, {}).get(key)
+            if histogram is None:
+                histogram = self.histograms.setdefault(name, {})[key] = {'count': 0, 'sum': 0.0, 'min': value, 'max': value, 'buckets': [0] * (len(self.buckets) + 1)}
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['min'] = min(histogram['min'], value)
+            histogram['max'] = max(histogram['max'], value)
+            position = 0
+            while position < len(self.buckets) and value > self.buckets[position]:
+                position += 1
+            histogram['buckets'][position] += 1
+
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the wrapped block and adds it to the stage's total.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+                stage['count'] += 1
+                stage['seconds'] += seconds
+            logger.debug('Stage %s finished', name, extra={'stage': name, 'seconds': round(seconds, 4)})
+
+
+    def quantile(self, histogram, q):
+        """
+        Approximate quantile of a histogram (the upper bound of the bucket holding it, max for the open bucket).
+        """
+        target = q * histogram['count']
+        seen = 0
+        for position, count in enumerate(histogram['buckets']):
+            seen += count
+            if seen >= target and count:
+                return self.buckets[position] if position < len(self.buckets) else histogram['max']
+        return histogram['max']
+
+
+    def summary(self):
+        """
+        Returns the metrics as a JSON serializable dict.
+        """
+        with self.lock:
+            histograms = {}
+            for name, keys in self.histograms.items():
+                histograms[name] = {}
+                for key, histogram in keys.items():
+                    histograms[name][key] = {
+                        'count': histogram['count'],
+                        'mean': round(histogram['sum'] / histogram['count'], 3),
+                        'min': round(histogram['min'], 3),
+                        'max': round(histogram['max'], 3),
+                        'p50': self.quantile(histogram, 0.5),
+                        'p95': self.quantile(histogram, 0.95),
+                        'buckets': dict(zip([f'<={bound}' for bound in self.buckets] + [f'>{self.buckets[-1]}'], histogram['buckets']))
+                    }
+            return {
+                'elapsed_seconds': round(time.time() - self.started, 3),
+                'counters': {name: dict(keys) for name, keys in self.counters.items()},
+                'histograms': histograms,
+                'stages': {name: {'count': stage['count'], 'seconds': round(stage['seconds'], 4)} for name, stage in self.stages.items()}
+            }
+
+
+    def export(self, path):
+        """
+        Writes the summary as JSON (through a temporary file so it is never half written).
+
+        path (str): The JSON file to write.
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+        os.replace(tmp_path, path)
+        return path
+
+
+class MRAPIError(Exception):
+
+    """
+    Raised when the MRAPI answers with an error (after the retries, for transient errors).
+
+    Attributes:
+        status_code (int): The HTTP status code (None when the request itself failed, e.g. a connection error).
+        url (str): The requested URL.
+        text (str): The response body.
+    """
+
+    def __init__(self, message, status_code=None, url=None, text=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.url = url
+        self.text = text
+
+
+class RateLimitError(MRAPIError):
+
+    """
+    Raised when requests are still rate limited (429) after the retries.
+    """
+
+
+class QuotaExceededError(MRAPIError):
+
+    """
+    Raised when every API key has used its quota for the current period.
+    """
+
+
+class RateGovernor:
+
+    """
+    Rate governance for the MRAPIClient: decides which API key sends the next request and when.
+
+    - Every key has a token bucket (rate requests/sec, burst tokens), requests wait for a token of their key.
+    - A 429 blocks its key until the Retry-After time (or a jittered backoff without the header), the other keys keep going.
+    - Transient errors (5xx, connection errors) are retried after a jittered exponential backoff (full jitter).
+    - The number of requests in flight is adapted AIMD style: +1 per limit successful requests, halved on a 429,
+      so concurrent fetches push up to the API limit without repeatedly tripping it.
+    - With several keys the requests are spread round robin, each key counting its requests against an optional quota
+      per period; a key whose quota is used is skipped until the period resets.
+
+    Attributes:
+        keys (list): The API keys.
+        rate (float): Requests/sec per key (None = no client side limit, only the 429s slow down).
+        burst (int): Token bucket size per key.
+        quota (int): Requests per key per quota_period (None = no quota).
+        quota_period (int): Length of the quota period in seconds.
+        max_retries (int): Retries for 429/5xx/connection errors before the error is raised.
+        backoff_base (float): First backoff in seconds, doubled per attempt.
+        backoff_max (float): Largest backoff in seconds.
+        min_concurrency (int): Lowest number of requests in flight the AIMD can go down to.
+        max_concurrency (int): Highest number of requests in flight (the client's max_workers).
+        limit (float): Current number of requests allowed in flight.
+        state (dict): key -> token bucket, quota and 429 accounting.
+
+    Methods:
+        acquire(): Waits for a key that can send a request and returns it.
+        release(key, status_code, retry_after=None): Records the outcome of a request sent with acquire's key.
+        backoff(attempt): Jittered exponential backoff for a retry.
+        stats(): Per key usage and the current concurrency limit.
+    """
+
+    retry_statuses = [429, 500, 502, 503, 504]
+
+    def __init__(self, keys, rate=None, burst=1, quota=None, quota_period=24 * 60 * 60, max_retries=5, backoff_base=0.5, backoff_max=60, min_concurrency=1, max_concurrency=1, seed=None):
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        if not self.keys:
+            raise ValueError("At least one API key is needed.")
+        self.rate = rate
+        self.burst = max(int(burst), 1)
+        self.quota = quota
+        self.quota_period = quota_period
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.min_concurrency = max(int(min_concurrency), 1)
+        self.max_concurrency = max(int(max_concurrency), self.min_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.next_key = 0
+        self.random = random.Random(seed)
+        self.condition = threading.Condition()
+
+        now = time.monotonic()
+        self.state = {
+            key: {
+                'tokens': float(self.burst),
+                'refilled': now,
+                'blocked_until': 0.0,
+                'used': 0,
+                'period_start': time.time(),
+                'rate_limited': 0,
+                'errors': 0
+            } for key in self.keys
+        }
+
+
+    def set_max_concurrency(self, max_concurrency):
+        """
+        Raises (or lowers) the concurrency ceiling, e.g. when the client's thread pool grows.
+        A higher ceiling also raises the limit to it, so the new workers are used from the first batch instead of after
+        the additive increase has slowly climbed there (a 429 still halves it).
+        """
+        with self.condition:
+            max_concurrency = max(int(max_concurrency), self.min_concurrency)
+            if max_concurrency > self.max_concurrency:
+                self.limit = float(max_concurrency)
+            self.max_concurrency = max_concurrency
+            self.limit = min(max(self.limit, self.min_concurrency), self.max_concurrency)
+            self.condition.notify_all()
+
+
+    def refill(self, state, now):
+        if self.rate is None:
+            state['tokens'] = float(self.burst)
+        else:
+            state['tokens'] = min(float(self.burst), state['tokens'] + (now - state['refilled']) * self.rate)
+        state['refilled'] = now
+
+        if self.quota is not None and time.time() - state['period_start'] >= self.quota_period:
+            state['used'] = 0
+            state['period_start'] = time.time()
+
+
+    def acquire(self):
+        """
+        Waits until the concurrency limit allows another request and a key has a token, takes the token and returns the key.
+        Keys are tried round robin starting after the last key used.
+
+        Raises:
+            QuotaExceededError: When every key has used its quota for the period.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+
+                if self.in_flight < int(self.limit):
+                    exhausted = 0
+                    for offset in range(len(self.keys)):
+                        key = self.keys[(self.next_key + offset) % len(self.keys)]
+                        state = self.state[key]
+                        self.refill(state, now)
+
+                        if self.quota is not None and state['used'] >= self.quota:
+                            exhausted += 1
+                            continue
+                        if state['blocked_until'] > now:
+                            wait = min(wait or float('inf'), state['blocked_until'] - now)
+                            continue
+                        if state['tokens'] < 1:
+                            wait = min(wait or float('inf'), (1 - state['tokens']) / self.rate)
+                            continue
+
+                        state['tokens'] -= 1
+                        state['used'] += 1
+                        self.in_flight += 1
+                        self.next_key = (self.keys.index(key) + 1) % len(self.keys)
+                        return key
+
+                    if exhausted == len(self.keys):
+                        raise QuotaExceededError(f"Every API key used its quota of {self.quota} requests for this period.")
+
+                # wait for a token/unblock, or for a request in flight to finish
+                self.condition.wait(timeout=wait)
+
+
+    def release(self, key, status_code, retry_after=None):
+        """
+        Records the outcome of a request and adapts the concurrency limit.
+
+        key (str): The key returned by acquire.
+        status_code (int): The response status (None for a connection error).
+        retry_after (float): Seconds from the Retry-After header of a 429 (optional).
+        """
+        with self.condition:
+            self.in_flight -= 1
+            state = self.state[key]
+
+            if status_code == 429:
+                state['rate_limited'] += 1
+                delay = retry_after if retry_after is not None else self.backoff(state['rate_limited'])
+                state['blocked_until'] = max(state['blocked_until'], time.monotonic() + delay)
+                # multiplicative decrease
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+            elif status_code is None or status_code >= 500:
+                state['errors'] += 1
+            else:
+                # additive increase, about +1 per 'limit' successful requests
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+    def backoff(self, attempt):
+        """
+        Full jitter exponential backoff: a random time between 0 and min(backoff_max, backoff_base * 2 ** attempt).
+        """
+        return self.random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+    def stats(self):
+        with self.condition:
+            return {
+                'concurrency_limit': round(self.limit, 2),
+                'keys': {f'key_{index}': {name: state[name] for name in ['used', 'rate_limited', 'errors']} for index, state in enumerate(self.state[key] for key in self.keys)}
+            }
+
+
+def parse_retry_after(value):
+    """
+    Returns the seconds of a Retry-After header (a number of seconds or an HTTP date), None if missing or unreadable.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max((parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestSpec(namedtuple('RequestSpec', ['api_version', 'endpoint', 'uid', 'params'])):
+
+    """
+    An immutable description of a single MRAPI request, built per call by MRAPIClient.request_spec.
+    The query params of a request live in its spec instead of on the client, so nothing set for one request leaks into
+    the next one and specs can be built and sent from any thread.
+
+    Attributes:
+        api_version (str): The version of the API to use (e.g., "v1", "v2").
+        endpoint (str): The endpoint (e.g., "match", "match-history").
+        uid (str): The match_uid/player_uid of the request (None for heroes).
+        params (tuple): The query params as (name, value) pairs, in the order the API documents them.
+
+    Methods:
+        url(base_url): Returns the full URL of the request.
+        with_params(**params): Returns a copy with some query params changed (None leaves a param as it is).
+    """
+
+    __slots__ = ()
+
+    # order of the query params in the URL, kept stable so equal requests give equal URLs (and cache keys)
+    param_order = ["season", "page", "limit", "skip", "gamemode", "timestamp"]
+
+    def __new__(cls, api_version, endpoint, uid=None, params=()):
+        params = dict(params)
+        order = {name: index for index, name in enumerate(cls.param_order)}
+        params = tuple(sorted(params.items(), key=lambda item: order.get(item[0], len(order))))
+        return super().__new__(cls, api_version, endpoint, uid, params)
+
+
+    def url(self, base_url):
+        """
+        Returns the full URL of the request.
+
+        base_url (str): The API root, e.g. "https://marvelrivalsapi.com/api/".
+        """
+        url = f"{base_url}{self.api_version}/"
+
+        # heroes does not take any parameters or uid
+        if self.endpoint == "heroes":
+            return url + "heroes"
+
+        # structure of match-history is different, the query is before the final endpoint
+        # e.g. https://marvelrivalsapi.com/api/v2/player/:query/match-history
+        if self.endpoint == "match-history":
+            url += f"player/{self.uid}/match-history"
+        elif self.uid:
+            url += f"{self.endpoint}/{self.uid}"
+        else:
+            return url
+
+        if self.params:
+            url += "?" + "&".join(f"{name}={value}" for name, value in self.params)
+        return url
+
+
+    def with_params(self, **params):
+        """
+        Returns a copy of the spec with some query params changed, e.g. spec.with_params(page=2).
+        """
+        merged = dict(self.params)
+        merged.update({name: value for name, value in params.items() if value is not None})
+        return RequestSpec(self.api_version, self.endpoint, self.uid, merged)
+
 
 class MRAPIClient:
 
     """
-    A client for the MRAPI (My Rival API) to fetch player and team data.
-    This class provides methods to interact with the MRAPI endpoints for retrieving player and team information. 
+    A client for the MRAPI (My Rival API) to fetch player, match, match-history and hero data.
+    This class provides methods to interact with the MRAPI endpoints ('player', 'match', 'match-history' and 'heroes')
+    and to collect the match histories of players into the raw 'match_data_*' / 'match_history_*' files.
     You can find documentation for the MRAPI at https://docs.marvelrivalsapi.com/
 
     Attributes:
         api_key (str): The API key for authenticating with the MRAPI.
         request_params (dict): Parameters for the API requests. (e.g., season, page, limit, etc.) all set to default values
         request_params_boolean (dict): Boolean flags for enabling/disabling request parameters.  (all set to False by default)
+        request_count (int): Number of requests sent to the API so far (cache hits are not counted).
+        max_workers (int): Number of concurrent requests used when fetching many matches (1 = sequential, the default).
+        session (requests.Session): Keep-alive session shared by every request, its connection pool is sized to max_workers.
+        cache (ResponseCache): Optional persistent response cache checked before every request (None = no caching).
+        output_format (str): Format of the raw match/match-history output: 'csv' (default), 'parquet' or 'both'.
+        store (ParquetStore): The columnar dataset used when output_format includes parquet (defaults to '{data_folder}/parquet').
+        metrics (Metrics): Request latency/bytes/status/cache metrics and get_total_data stage timings (export with metrics.export(path)).
+        governor (RateGovernor): Picks the API key of every request, applies the rate limits and retries 429/5xx responses.
+        data_folder (str): Folder the raw CSV files and the default manifest are written to (defaults to the repository's 'data' folder).
+
+    Logging goes through the 'MRAPI' logger and is silent by default, see configure_logging.
 
     Methods:
-        get_player_data(player_id): Fetches data for a specific player using their player ID.
-        get_team_data(): Fetches data for a specific team using their team ID.
-        build_url(api_version, endpoint, request_uid=None): Constructs the URL for the API request.
-        get_data(api_version, endpoint, request_uid=None, season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None): Fetches data from the MRAPI using the specified API version and endpoint.
-        set_request_params(season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None): Sets the request parameters for the MRAPI client.
-        set_request_uid(request_uid): Sets the request UID for the MRAPI client.
-        get_total_data(): Fetches total data from the MRAPI using the specified API version and endpoint.
+        set_request_params(season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None): Sets the default request parameters for the MRAPI client.
+        set_request_uid(request_uid): Sets the default request UID for the MRAPI client.
+        set_request_endpoint(endpoint): Sets the default endpoint for the MRAPI client.
+        request_spec(api_version, endpoint=None, request_uid=None, **params): Builds the immutable RequestSpec of one request from the defaults plus per-call params.
+        build_url(api_version, endpoint=None, request_uid=None, **params): Constructs the URL for the API request.
+        get_data(api_version, endpoint=None, request_uid=None, season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None): Fetches data from the MRAPI using the specified API version and endpoint.
+        fetch(spec): Sends the request of a RequestSpec.
+        fetch_url(url, endpoint=None): Sends a GET request for an already built URL (cache, rate governor and retries included).
+        get_many(api_version, endpoint, request_uids, max_workers=None, **params): Fetches several UIDs from one endpoint concurrently, in input order.
+        get_total_data(max_workers=None, incremental=False, manifest=None, journal=None, player_uid=None): Collects the match history of one player and saves the raw files.
+        pipeline_matches(player_uid, watermark=0, ...): Pages through a player's match history and fetches its matches as a pipeline.
+        collect_many(player_uids): Collects a batch of players together, matches shared by several players are fetched once.
+        save_raw(match_df, history_df, suffix, data_folder=None): Writes the raw match and match-history data (CSV and/or parquet).
+        build_session(pool_size=1), reserve_connections(concurrency): Size the keep-alive connection pool (and the governor) for concurrent requests.
+
+    Requests are described by immutable RequestSpecs, the client state (request_params, request_uid, endpoint) only holds
+    the defaults and is never changed by a request, so one client can be shared by several threads.
 
     TODO:
-        - Implement the randomizer for the player data to get a random player from the match data.
-        - Implement the player data request for each player in the match data from the 'player' endpoint.
-        - Add support for other endpoints (e.g., heroes, match-history).
-        - Implement error handling for API requests.
         - Add more detailed documentation for each method.
         - Add support for different API versions (v1, v2).
-        - Implement a caching mechanism to reduce API calls.
         
     """
 
-    def __init__(self, api_key):
-        self.api_key = api_key
+    def __init__(self, api_key, max_workers=1, cache=None, output_format='csv', store=None, metrics=None, governor=None, data_folder=DATA_FOLDER):
+        # several keys can be given as a list, the governor spreads the requests over them
+        self.api_keys = [api_key] if isinstance(api_key, str) else list(api_key)
+        self.api_key = self.api_keys[0]
         self.base_url = "https://marvelrivalsapi.com/api/"
         self.request_uid = None
         self.api_versions = ["v1", "v2"] # defaults to v1 
@@ -54,6 +609,32 @@ class MRAPIClient:
             "x-api-key": self.api_key
         }
 
+        # one keep-alive session for every request so we are not opening a new TLS connection per match
+        self.max_workers = max_workers
+        self.pool_size = 0
+        self.session = None
+        self.build_session(max_workers)
+
+        # persistent response cache (see ResponseCache), matches are immutable so re-runs should not refetch them
+        self.cache = cache
+
+        # raw output format, parquet keeps the nested match_players/ban_pick_info as real lists instead of python-repr strings
+        if output_format not in ['csv', 'parquet', 'both']:
+            raise ValueError("Invalid output format. Use 'csv', 'parquet' or 'both'.")
+        self.output_format = output_format
+        self.store = store if store is not None or output_format == 'csv' else ParquetStore(os.path.join(data_folder, 'parquet'))
+        self.data_folder = data_folder
+
+        # number of requests actually sent to the API (cache hits are not counted), used for request budgets
+        self.request_count = 0
+        self.counter_lock = threading.Lock()
+
+        # run metrics (see Metrics), share one instance with the DataCleaner to export a single summary
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # rate governance (see RateGovernor), by default no client side rate limit but 429/5xx are retried
+        self.governor = governor if governor is not None else RateGovernor(self.api_keys, max_concurrency=max_workers)
+
         # parameters for api/v2/Match, api/v1 has less params than listed here
         # check documentation for details on the default values
         # if request_params_boolean is false, the request param is not included in the request
@@ -77,45 +658,78 @@ class MRAPIClient:
             "timestamp": False
         }
 
+    def build_session(self, pool_size=1):
+        """
+        Builds the keep-alive requests session used by the MRAPI client.
+        The connection pool is sized to the number of workers so concurrent fetches reuse open connections.
+
+        pool_size (int): The max number of pooled connections to the API host.
+        """
+        pool_size = max(int(pool_size or 1), 1)
+        session = requests.Session()
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        if self.session is not None:
+            self.session.close()
+        self.session = session
+        self.pool_size = pool_size
+        return session
+
+
+    def reserve_connections(self, concurrency):
+        """
+        Grows the connection pool and the governor concurrency so concurrency requests can be in flight at once.
+
+        concurrency (int): The number of requests that will run at the same time.
+        """
+        if concurrency > self.pool_size:
+            self.build_session(concurrency)
+        if concurrency > self.governor.max_concurrency:
+            self.governor.set_max_concurrency(concurrency)
+
+
     # used to update request params
     def set_request_params(self, season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None):
         """
-        Sets the request parameters for the MRAPI client.
-        This method sets the base URL and headers for the API requests
+        Sets the default request parameters for the MRAPI client, used by every request built afterwards.
+        Params given to get_data/request_spec only apply to that one request and do not change these defaults.
         """
         if season is not None:
-            print(f'\nSetting season... {season}')
+            logger.debug('Setting season... %s', season)
             self.request_params["season"] = season
             self.request_params_boolean["season"] = True
         if page is not None:
-            print(f'\nSetting page... {page}')
+            logger.debug('Setting page... %s', page)
             self.request_params["page"] = page
             self.request_params_boolean["page"] = True
         if limit is not None:
-            print(f'\nSetting limit... {limit}')
+            logger.debug('Setting limit... %s', limit)
             self.request_params["limit"] = limit
             self.request_params_boolean["limit"] = True
         if skip is not None:
-            print(f'\nSetting skip... {skip}')
+            logger.debug('Setting skip... %s', skip)
             self.request_params["skip"] = skip
             self.request_params_boolean["skip"] = True
         if gamemode is not None:
-            print(f'\nSetting gamemode... {gamemode}')
+            logger.debug('Setting gamemode... %s', gamemode)
             self.request_params["gamemode"] = gamemode
             self.request_params_boolean["gamemode"] = True
         if timestamp is not None:
-            print(f'\nSetting timestamp... {timestamp}')
+            logger.debug('Setting timestamp... %s', timestamp)
             self.request_params["timestamp"] = timestamp
             self.request_params_boolean["timestamp"] = True
 
 
     def set_request_uid(self, request_uid):
         """
-        Sets the request UID for the MRAPI client.
+        Sets the default request UID for the MRAPI client (used when a request does not name its own).
         
         request_uid (str): The unique identifier for the request (e.g. match_uid, player_uid).
         """
-        print(f'Setting request UID... {request_uid}')
+        logger.debug('Setting request UID... %s', request_uid)
         self.request_uid = request_uid
 
 
@@ -125,120 +739,202 @@ class MRAPIClient:
         
         endpoint (str): The specific endpoint to access (e.g., "Player", "Match").
         """
-        print(f'Setting endpoint... {endpoint}')
+        logger.debug('Setting endpoint... %s', endpoint)
 
         if endpoint not in self.endpoints:
             raise ValueError(f"Invalid endpoint. Use one of the following: {self.endpoints}.")
         self.endpoint = endpoint
 
 
-    # Builds the URL for the MRAPI client, only handles matchs and players for now
-    def build_url(self, api_version, endpoint=None, request_uid=None):
+    def request_spec(self, api_version, endpoint=None, request_uid=None, season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None):
         """
-        Builds the URL for the MRAPI client.
-        This method constructs the URL for the API requests using the base URL and request parameters.
-
+        Builds the immutable RequestSpec of one request without touching the client state.
+        The query params are the client defaults (the params switched on with set_request_params) overridden by the ones
+        given here, which only apply to this request.
 
         api_version (str): The version of the API to use (e.g., "v1", "v2").
-        endpoint (str): The specific endpoint to access (e.g., "Player", "Match").
+        endpoint (str): The specific endpoint to access (optional, defaults to the client endpoint).
+        request_uid (str): The match_uid/player_uid of the request (optional, defaults to the client request UID).
+        season, page, limit, skip, gamemode, timestamp: Query params for this request only (optional).
 
+        Returns:
+            RequestSpec: The request.
         """
-        print('\nBuilding URL START...\n')
+        endpoint = endpoint if endpoint is not None else self.endpoint
+        request_uid = request_uid if request_uid is not None else self.request_uid
 
-        # set the UID if not previously set
-        if request_uid is not None:
-            print(f'Updating request UID... {request_uid}')
-            self.set_request_uid(request_uid)
-        
-        # set the endpoint if not previously set
-        if endpoint is not None:
-            print(f'Updating endpoint... {endpoint}')
-            self.set_request_endpoint(endpoint)
-
-        # check for valid enteries 
-        if api_version not in ["v1", "v2"]:
+        # check for valid enteries
+        if api_version not in self.api_versions:
             raise ValueError("Invalid API version. Use 'v1' or 'v2'.")
-        
+
         if endpoint not in self.endpoints:
             raise ValueError(f"Invalid endpoint. Use one of the following: {self.endpoints}.")
-        
-        # build base url
-        url = f"{self.base_url}{api_version}/"
-        print(f'Building base URL... check: {url}')
-
-        # This check if for when heroes is used as the endpoint, it does not require any parameters or uid
-        if endpoint in ["match", "player"] and self.request_uid:
-            url += f"{endpoint}/{self.request_uid}"
-            print(f'Building URL with UID... check: {url}')
-
-            query_params = []
-            for param, value in self.request_params.items():
-                if self.request_params_boolean.get(param, True):
-                    query_params.append(f"{param}={value}")
-            
-            if query_params:
-                url += "?" + "&".join(query_params)
-                print(f'Adding query params... check: {url}')
 
-        # structure of match-history is different, the query is before the final endpoint
-        # e.g. https://marvelrivalsapi.com/api/v2/player/:query/match-history
-        if endpoint == "match-history":
+        params = {param: value for param, value in self.request_params.items() if self.request_params_boolean.get(param, True)}
+        overrides = {"season": season, "page": page, "limit": limit, "skip": skip, "gamemode": gamemode, "timestamp": timestamp}
+        params.update({param: value for param, value in overrides.items() if value is not None})
 
-            url += f"player/{self.request_uid}/match-history"
-            print(f'Building match-history URL... check: {url}')
+        return RequestSpec(api_version, endpoint, request_uid, params)
 
-            query_params = []
-            for param, value in self.request_params.items():
-                if self.request_params_boolean.get(param, True):
-                    query_params.append(f"{param}={value}")
-            
-            if query_params:
-                url += "?" + "&".join(query_params)
-                print(f'Adding query params... check: {url}')
 
-            print(f'Returning url... check: {url}')
+    def build_url(self, api_version, endpoint=None, request_uid=None, **params):
+        """
+        Builds the URL for the MRAPI client.
+        This method constructs the URL for the API requests using the base URL and request parameters.
+        It does not change the client state (see request_spec), so it is safe to call from worker threads.
 
+        api_version (str): The version of the API to use (e.g., "v1", "v2").
+        endpoint (str): The specific endpoint to access (e.g., "Player", "Match").
+        request_uid (str): The match_uid/player_uid of the request (optional, defaults to the client request UID).
+        params: Query params for this URL only, e.g. page=2 (optional).
+        """
+        url = self.request_spec(api_version, endpoint, request_uid, **params).url(self.base_url)
+        logger.debug('Built URL... check: %s', url)
         return url
-    
 
-    def get_data(self, api_version, endpoint=None, request_uid=None, season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None):
+
+    def get_data(self, api_version, endpoint=None, request_uid=None, season=None, page=None, limit=None, skip=None, gamemode=None, timestamp=None, max_workers=None):
         """
         Fetches data from the MRAPI using the specified API version and endpoint.
+        The params given here only apply to this call, use set_request_params to change the defaults of every request.
         
         api_version (str): The version of the API to use (e.g., "v1", "v2").
         endpoint (str): The specific endpoint to access (e.g., "Player", "Match").
-        request_uid (str): The unique identifier for the request (e.g. match_uid, player_uid).
+        request_uid (str | list): The unique identifier for the request (e.g. match_uid, player_uid). 
+            A list of UIDs is fetched concurrently (see get_many) and a list of responses is returned in the same order.
         season (int): The season to filter matches by (optional).
         page (int): The page number for pagination (optional).
         limit (int): The number of matches to return per page (optional).
         skip (int): The number of matches to skip (for pagination) (optional).
         gamemode (int): The gamemode to filter matches by (optional).
         timestamp (int): The timestamp to filter matches by (optional).
+        max_workers (int): Number of concurrent requests when request_uid is a list (optional, defaults to self.max_workers).
         
         Returns:
             dict: The JSON response from the MRAPI.
         """
 
-        print('Fetching data from MRAPI...')
-        self.set_request_params(season, page, limit, skip, gamemode, timestamp)
+        logger.debug('Fetching data from MRAPI...')
+        params = {"season": season, "page": page, "limit": limit, "skip": skip, "gamemode": gamemode, "timestamp": timestamp}
 
-        url = self.build_url(api_version, endpoint, request_uid)
-        
-        headers = {
-            "x-api-key": self.api_key,
-        }
-        
-        response = requests.get(url, headers=headers)
-        print(f'response status code: {response.status_code}')
-        print(f'response text: {response.text}')
-
-        if response.status_code == 200:
-            print('Data fetched successfully!')
-            print(f'response data: {response.json()}')
-            return response.json()
-        
-        else:
-            raise Exception(f"Error fetching data: {response.status_code} - {response.text}")
+        if isinstance(request_uid, (list, tuple)):
+            return self.get_many(api_version, endpoint, request_uid, max_workers=max_workers, **params)
+
+        return self.fetch(self.request_spec(api_version, endpoint, request_uid, **params))
+
+
+    def fetch(self, spec):
+        """
+        Sends the request of a RequestSpec (see fetch_url).
+
+        spec (RequestSpec): The request, see request_spec.
+
+        Returns:
+            dict: The JSON response from the MRAPI.
+        """
+        return self.fetch_url(spec.url(self.base_url), spec.endpoint)
+
+
+    def fetch_url(self, url, endpoint=None):
+        """
+        Sends a GET request for an already built URL through the shared session.
+        This does not touch any of the client state, so it is safe to call from worker threads.
+        If a cache is set, a fresh cached response is returned instead and successful responses are stored.
+        The governor picks the API key and the send time, 429/5xx responses and connection errors are retried up to
+        governor.max_retries times before an MRAPIError (RateLimitError for a 429) is raised.
+
+        url (str): The full URL returned by build_url.
+        endpoint (str): The endpoint the URL was built for, used to pick the cache policy (optional).
+
+        Returns:
+            dict: The JSON response from the MRAPI.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(url, endpoint)
+            if cached is not None:
+                self.metrics.increment('cache_hits', endpoint)
+                logger.debug('Cache hit...', extra={'endpoint': endpoint, 'url': url})
+                return cached
+            self.metrics.increment('cache_misses', endpoint)
+
+        attempt = 0
+        while True:
+            key = self.governor.acquire()
+            with self.counter_lock:
+                self.request_count += 1
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers={"x-api-key": key})
+            except requests.RequestException as e:
+                self.governor.release(key, None)
+                self.metrics.increment('status', f'{endpoint}:connection_error')
+                if attempt >= self.governor.max_retries:
+                    raise MRAPIError(f"Error fetching data: {e}", url=url) from e
+                attempt += 1
+                self.metrics.increment('retries', endpoint)
+                logger.warning('Connection error, retry %s/%s: %s', attempt, self.governor.max_retries, e, extra={'endpoint': endpoint, 'url': url})
+                time.sleep(self.governor.backoff(attempt))
+                continue
+            latency_ms = (time.perf_counter() - start) * 1000
+
+            # the body is only read and parsed once, the logs get its size instead of the full text
+            content = response.content
+            status_code = response.status_code
+            retry_after = parse_retry_after(response.headers.get('Retry-After')) if status_code == 429 else None
+            self.governor.release(key, status_code, retry_after)
+            self.metrics.observe('latency_ms', endpoint, latency_ms)
+            self.metrics.increment('bytes', endpoint, len(content))
+            self.metrics.increment('status', f'{endpoint}:{status_code}')
+            logger.debug('Request finished', extra={'endpoint': endpoint, 'url': url, 'status': status_code, 'latency_ms': round(latency_ms, 1), 'bytes': len(content)})
+
+            if status_code == 200:
+                data = json.loads(content)
+                if self.cache is not None:
+                    self.cache.set(url, endpoint, content)
+                return data
+
+            if status_code in self.governor.retry_statuses and attempt < self.governor.max_retries:
+                attempt += 1
+                self.metrics.increment('retries', endpoint)
+                logger.warning('Error fetching data: %s, retry %s/%s', status_code, attempt, self.governor.max_retries, extra={'endpoint': endpoint, 'url': url, 'status': status_code})
+                # a 429 blocks its key in the governor (acquire waits or moves on to another key), other errors back off here
+                if status_code != 429:
+                    time.sleep(self.governor.backoff(attempt))
+                continue
+
+            logger.warning('Error fetching data: %s', status_code, extra={'endpoint': endpoint, 'url': url, 'status': status_code})
+            error = RateLimitError if status_code == 429 else MRAPIError
+            raise error(f"Error fetching data: {status_code} - {response.text}", status_code=status_code, url=url, text=response.text)
+
+
+    def get_many(self, api_version, endpoint, request_uids, max_workers=None, **params):
+        """
+        Fetches the data for several UIDs from the same endpoint.
+        One RequestSpec is built per UID and the requests run on the thread pool.
+        Results are returned in the same order as request_uids no matter which request finishes first.
+
+        api_version (str): The version of the API to use (e.g., "v1", "v2").
+        endpoint (str): The specific endpoint to access (e.g., "match", "player").
+        request_uids (list): The unique identifiers to fetch (e.g. match_uids).
+        max_workers (int): Max number of requests in flight at once (optional, defaults to self.max_workers).
+        params: Query params for these requests only (optional, see request_spec).
+
+        Returns:
+            list: The JSON responses from the MRAPI, one per UID.
+        """
+        workers = max_workers or self.max_workers
+        specs = [self.request_spec(api_version, endpoint, request_uid, **params) for request_uid in request_uids]
+
+        if workers <= 1 or len(specs) <= 1:
+            return [self.fetch(spec) for spec in specs]
+
+        # grow the connection pool so the extra workers are not discarding connections
+        self.reserve_connections(workers)
+
+        logger.info('Fetching %s %s requests with %s workers...', len(specs), endpoint, workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.fetch, specs))
 
 
     """
@@ -276,91 +972,2915 @@ class MRAPIClient:
         
     """
     
-    def get_total_data(self):
+    def get_total_data(self, max_workers=None, incremental=False, manifest=None, journal=None, prefetch=2, page_limit=None, player_uid=None):
         """
         Fetches total data from the MRAPI using the specified API version and endpoint.
         
         This method will gather the data how we need it for the analysis files.
+        Steps 1 and 2 run as a pipeline (see pipeline_matches): the matches of a history page are fetched while the next
+        pages are still being requested.
+
+        max_workers (int): Number of match requests to run concurrently in Step 2 (optional, defaults to self.max_workers).
+        incremental (bool): Only collect games newer than the player's watermark and skip match_uids already on disk (optional).
+        manifest (CollectionManifest): Manifest used in incremental mode (optional, defaults to 'manifest.json' in the data folder).
+        journal (ResponseJournal): Stream every raw response to this journal as it arrives instead of keeping them in memory and
+            writing CSVs at the end (optional). Matches already in the journal are skipped, so a crashed run can simply be rerun.
+        prefetch (int): Number of match-history pages requested ahead (optional, defaults to 2).
+        page_limit (int): Matches per match-history page, a larger limit cuts the number of pages (optional, API default otherwise).
+        player_uid (str): The player to collect (optional, defaults to the client request UID). For a batch of players see collect_many.
 
         Returns:
             dict: The JSON response from the MRAPI.
         """
         # Step 1: Request multiple pages from 'match-history' endpoint for a player
-        player_uid = self.request_uid
-        all_matches = []
-        page = 1
-        while True:
-            print(f'Fetching match history for player {player_uid}... page: {page}')
-            match_history = self.get_data(api_version="v2", endpoint="match-history", request_uid=player_uid, page=page)
-            normalized_match_history = json_normalize(match_history['match_history'])
-    
-            print(f'Normalizing json data...')
-            if normalized_match_history is None or len(normalized_match_history) == 0:
-                print(f'No more matches found for player {player_uid}...')
-                break
-            matches = normalized_match_history['match_uid'].to_list()
-            print(f'Found {len(matches)} matches on page {page}...')
-            print(f'Adding {len(matches)} matches to all_matches ({len(all_matches)})... ')
-            all_matches.append(normalized_match_history)
-            page += 1
-
-        # Extract match_uids
-        all_matches = pd.concat(all_matches)
-        matches_list = all_matches['match_uid'].to_list()
-
-        # Verify the matches are unique
-        matches_list = list(set(matches_list))
-        print(f'\nFound {len(matches_list)} match_uids for player {player_uid}...\n')
-
-        # Step 2: Request the match data for each match_uid from the 'match' endpoint
-        match_data = []
-        for match_uid in matches_list:
-
-            print(f'Fetching match data for match_uid {match_uid}...')
-            match = self.get_data(api_version="v1", endpoint="match", request_uid=match_uid)
-            print(f'Normalizing json data...')
-            normalized_match = json_normalize(match)
-            print(f'Adding match data for match_uid {match_uid}...')
-            match_data.append(normalized_match)
-
-        # Step 2.1: Randomly sample a player from the match data (optional)
-        """ sampled_player_uid = random.choice(match_data[0]["players"])["player_uid"]
-        sampled_player_matches = []
-        page = 1
-        while True:
-            sampled_history = self.get_data(api_version="v2", endpoint="match-history", request_uid=sampled_player_uid, page=page)
-            sampled_matches = sampled_history.get("matches", [])
-            if not sampled_matches:
-                break
-            sampled_player_matches.extend(sampled_matches)
-            page += 1 """
+        player_uid = player_uid if player_uid is not None else self.request_uid
 
-        # Step 2.2: Request the player data for each player in the match data (optional)
-        """ player_data = []
-        for match in match_data:
-            for player in match["players"]:
-                player_uid = player["player_uid"]
-            player_info = self.get_data(api_version="v2", endpoint="player", request_uid=player_uid)
-            player_data.append(player_info) """
+        # in incremental mode only ask for the games played after the last collected one
+        watermark = 0
+        if incremental:
+            if manifest is None:
+                manifest = CollectionManifest(os.path.join(self.data_folder, 'manifest.json'), self.data_folder)
+            manifest.scan()
+            watermark = manifest.get_watermark(player_uid)
+            logger.info('Incremental mode, %s match_uids already collected, watermark for player %s: %s', len(manifest.matches), player_uid, watermark)
 
-        # Step 3: Create a dataframe from the match data and player data
-        print('\nCreating dataframes from match data...')
-        match_df = pd.concat(match_data)
-        #player_df = pd.DataFrame(player_data)
+        # match_uids already on disk (incremental) or in the journal are not fetched again
+        already_collected = set(manifest.matches) if incremental else set()
+        if journal is not None:
+            already_collected |= journal.uids("match")
 
-        print(f'Creating dataframe for player match history...')
-        
-        # Save raw dataframes to CSV
-        print('\nSaving raw dataframes to CSV...')
-        current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        match_df.to_csv(f"../data/match_data_{self.request_params['season']}_{self.request_uid}_{current_date}.csv", index=False)
-        all_matches.to_csv(f"../data/match_history_{self.request_params['season']}_{self.request_uid}_{current_date}.csv", index=False)
-        #player_df.to_csv("player_data.csv", index=False)
+        def journal_match(match_uid, match):
+            journal.append("match", match_uid, match)
 
+        # Step 2: Request the match data for each match_uid from the 'match' endpoint, as soon as its history page arrives
+        with self.metrics.stage('match_fetch'):
+            history_pages, history_rows, matches_list, matches = self.pipeline_matches(
+                player_uid,
+                watermark=watermark,
+                skip=already_collected.__contains__,
+                max_workers=max_workers,
+                prefetch=prefetch,
+                page_limit=page_limit,
+                on_match=journal_match if journal is not None else None
+            )
 
-        print('\nDataframes saved to CSV, check the current directory in folder "data".')
-        # Step 4: Use the DataCleaner class to clean the data (assuming DataCleaner is implemented elsewhere)
-        cleaner = DataCleaner()
+        if journal is not None:
+            for page, match_history in enumerate(history_pages, start=1):
+                journal.append("match-history", f'{player_uid}:{page}', match_history)
+            journal.flush()
+
+        if not history_rows:
+            logger.info('No new matches found for player %s...', player_uid)
+            return None
+
+        all_matches = json_normalize(history_rows)
+        logger.info('Found %s new match_uids for player %s...', len(matches_list), player_uid)
+
+        if not matches_list or journal is not None:
+            # only move the watermark once the matches are safely on disk
+            if incremental:
+                manifest.add_matches(matches_list)
+                manifest.set_watermark(player_uid, all_matches['match_time_stamp'].max())
+                manifest.save()
+            return matches_list if journal is not None else None
+
+        with self.metrics.stage('normalize'):
+            match_data = []
+            for match_uid, match in zip(matches_list, matches):
+
+                logger.debug('Normalizing json data...')
+                normalized_match = json_normalize(match)
+                logger.debug('Adding match data for match_uid %s...', match_uid)
+                match_data.append(normalized_match)
+
+        # Step 2.1: Randomly sample players from the match data (optional)
+        # This is done at scale by PlayerCrawler, which snowballs from the players in these matches, e.g.
+        # PlayerCrawler(self, policy='random').crawl([player_uid])
+
+        # Step 2.2: Request the player data for each player in the match data (optional)
+        # This is done once per player for a whole cleaned table by RankEnricher (cached per player with a TTL), e.g.
+        # RankEnricher(self).enrich(players_df) adds the SR delta of every (player, match) row
+
+        # Step 3: Create a dataframe from the match data and player data
+        logger.info('Creating dataframes from match data...')
+        with self.metrics.stage('dataframes'):
+            match_df = pd.concat(match_data)
+        #player_df = pd.DataFrame(player_data)
+
+        logger.debug('Creating dataframe for player match history...')
+        
+        # Save raw dataframes to CSV (and/or the parquet dataset)
+        logger.info('Saving raw dataframes...')
+        with self.metrics.stage('save'):
+            current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            self.save_raw(match_df, all_matches, f"{self.request_params['season']}_{player_uid}_{current_date}")
+        #player_df.to_csv("player_data.csv", index=False)
+
+        # only move the watermark once the data is safely on disk
+        if incremental:
+            manifest.add_matches(matches_list)
+            manifest.set_watermark(player_uid, all_matches['match_time_stamp'].max())
+            manifest.save()
+
+
+        logger.info('Dataframes saved to CSV, check the current directory in folder "data".')
+        # Step 4 (cleaning the raw files) is a separate step, see DataCleaner.clean
+
+
+    def pipeline_matches(self, player_uid, watermark=0, skip=None, max_workers=None, prefetch=2, page_limit=None, on_match=None, submit_match=None):
+        """
+        Pages through a player's match history and fetches the matches as a producer/consumer pipeline.
+        Up to prefetch history pages are requested ahead on their own threads, and the matches of a page are queued on
+        the match workers as soon as that page arrives, so the history and the match fetches overlap and a player takes
+        about as long as the slowest of the two streams instead of the sum of every request.
+        Match_uids are de-duplicated as they arrive (first occurrence wins, the match-history order is kept).
+        Once a page comes back empty (or entirely at/below the watermark) the pages requested past it are dropped.
+
+        player_uid (str): The player.
+        watermark (int): Only matches after this timestamp (optional, 0 = all).
+        skip (callable): Returns True for match_uids that should not be fetched, e.g. already collected (optional).
+        max_workers (int): Number of concurrent match requests (optional, defaults to self.max_workers).
+        prefetch (int): Number of history pages requested ahead (optional, defaults to 2).
+        page_limit (int): Matches per history page, a larger limit means fewer pages (optional, the API default otherwise).
+        on_match (callable): Called with (match_uid, response) for every match, in order, as soon as it is fetched.
+            The responses are then not kept, e.g. to write them straight to a journal (optional).
+        submit_match (callable): Called with a match_uid, returns the future of its fetch. Used by collect_many to share
+            the match workers, and each fetch, between several players (optional, the matches get their own pool otherwise).
+
+        Returns:
+            tuple: (history_pages, history_rows, match_uids, matches): the raw match-history responses, the history entries
+            after the watermark, the match_uids fetched and their responses in the same order (None with on_match).
+        """
+        workers = max(max_workers or self.max_workers, 1)
+        prefetch = max(int(prefetch or 1), 1)
+
+        # the connection pool and the governor have to allow the history and the match requests at the same time
+        if submit_match is None:
+            self.reserve_connections(workers + prefetch)
+
+        history_pages = []
+        history_rows = []
+        match_uids = []
+        matches = None if on_match is not None else []
+        seen = set()
+        pending_pages = deque()
+        pending_matches = deque()
+        next_page = 1
+        finished = False
+
+        def drain(block=False):
+            # hand the fetched matches over in order, only the finished prefix unless block
+            while pending_matches and (block or pending_matches[0][1].done()):
+                match_uid, future = pending_matches.popleft()
+                if on_match is not None:
+                    on_match(match_uid, future.result())
+                else:
+                    matches.append(future.result())
+
+        history_spec = self.request_spec("v2", "match-history", player_uid, limit=page_limit, timestamp=watermark or None)
+        history_pool = ThreadPoolExecutor(max_workers=prefetch)
+        match_pool = None
+        if submit_match is None:
+            match_pool = ThreadPoolExecutor(max_workers=workers)
+            submit_match = lambda match_uid: match_pool.submit(self.fetch, self.request_spec("v1", "match", match_uid))
+        try:
+            while True:
+                while not finished and len(pending_pages) < prefetch:
+                    pending_pages.append((next_page, history_pool.submit(self.fetch, history_spec.with_params(page=next_page))))
+                    next_page += 1
+                if not pending_pages:
+                    break
+
+                page, future = pending_pages.popleft()
+                match_history = future.result()
+                self.metrics.increment('history_pages', 'fetched')
+                page_matches = match_history.get('match_history') or []
+                if not page_matches:
+                    logger.info('No more matches found for player %s...', player_uid)
+                    finished = True
+                    break
+                history_pages.append(match_history)
+
+                if watermark:
+                    # the history is newest first, once a page is entirely at/below the watermark we have caught up
+                    page_matches = [match for match in page_matches if (match.get('match_time_stamp') or 0) > watermark]
+                    if not page_matches:
+                        logger.info('Reached the watermark for player %s...', player_uid)
+                        finished = True
+                        break
+                history_rows.extend(page_matches)
+
+                new_matches = 0
+                for match in page_matches:
+                    match_uid = match.get('match_uid')
+                    if match_uid is None or match_uid in seen:
+                        continue
+                    seen.add(match_uid)
+                    if skip is not None and skip(match_uid):
+                        continue
+                    pending_matches.append((match_uid, submit_match(match_uid)))
+                    match_uids.append(match_uid)
+                    new_matches += 1
+                logger.info('Found %s matches on page %s, %s new match requests queued...', len(page_matches), page, new_matches)
+                drain()
+
+            # pages requested past the end of the history
+            for _, future in pending_pages:
+                if not future.cancel():
+                    self.metrics.increment('history_pages', 'past_the_end')
+            pending_pages.clear()
+
+            drain(block=True)
+        finally:
+            history_pool.shutdown(wait=True, cancel_futures=True)
+            if match_pool is not None:
+                match_pool.shutdown(wait=True, cancel_futures=True)
+
+        return history_pages, history_rows, match_uids, matches
+
+
+    def collect_many(self, player_uids, max_workers=None, player_workers=None, prefetch=2, page_limit=None, incremental=False, manifest=None, journal=None, suffix=None):
+        """
+        Collects the match histories of a batch of players together (Steps 1 and 2 of get_total_data for every player).
+        Up to player_workers histories are paged through at once (see pipeline_matches), and all of them share one pool of
+        match workers and one registry of fetches: a match that shows up in the history of several players of the batch
+        is only requested once. Which players' histories each match came from is kept as its provenance.
+
+        The raw output is one 'match_data_{season}_batch_{batch id}_{date}' file (the batch id is a hash of the player_uids)
+        with one row per match, and a match-history file with one row per (player, match) and a 'collected_for' column
+        naming the player whose history it is.
+        In journal mode the matches are appended to the journal as they arrive and the history pages once a player is done.
+
+        player_uids (list): The players of the batch (duplicates are collected once).
+        max_workers (int): Number of concurrent match requests shared by the batch (optional, defaults to self.max_workers).
+        player_workers (int): Number of player histories paged through at once (optional, defaults to up to 4).
+        prefetch (int): Number of history pages requested ahead per player (optional, defaults to 2).
+        page_limit (int): Matches per match-history page (optional, the API default otherwise).
+        incremental (bool): Only collect games newer than each player's watermark and skip match_uids already on disk (optional).
+        manifest (CollectionManifest): Manifest used in incremental mode (optional, defaults to 'manifest.json' in the data folder).
+        journal (ResponseJournal): Stream the raw responses to this journal instead of writing the raw files (optional).
+        suffix (str): Unique identifier of the raw files (optional, defaults to '{season}_batch_{batch id}_{date}').
+
+        Returns:
+            dict: {'match_uids': the matches fetched, in first seen order, 'provenance': {match_uid: [player_uid, ...]},
+            'players': {player_uid: number of new matches in its history}}.
+        """
+        player_uids = list(dict.fromkeys(str(player_uid) for player_uid in player_uids))
+        workers = max(max_workers or self.max_workers, 1)
+        prefetch = max(int(prefetch or 1), 1)
+        player_workers = max(player_workers or min(len(player_uids), 4), 1)
+
+        if incremental:
+            if manifest is None:
+                manifest = CollectionManifest(os.path.join(self.data_folder, 'manifest.json'), self.data_folder)
+            manifest.scan()
+            logger.info('Incremental mode, %s match_uids already collected...', len(manifest.matches))
+
+        already_collected = set(manifest.matches) if incremental else set()
+        if journal is not None:
+            already_collected |= journal.uids("match")
+
+        # every history page and match request of the batch can be in flight at the same time
+        self.reserve_connections(workers + player_workers * prefetch)
+
+        # match_uid -> future of its single fetch, shared by every player whose history has the match
+        registry = {}
+        provenance = {}
+        registry_lock = threading.Lock()
+        journal_lock = threading.Lock()
+
+        def fetch_match(match_uid):
+            match = self.fetch(self.request_spec("v1", "match", match_uid))
+            if journal is None:
+                return match
+            # in journal mode the response is written as soon as it arrives and not kept in the registry
+            with journal_lock:
+                journal.append("match", match_uid, match)
+            return None
+
+        match_pool = ThreadPoolExecutor(max_workers=workers)
+
+        def submit_match(player_uid, match_uid):
+            with registry_lock:
+                provenance.setdefault(match_uid, []).append(player_uid)
+                future = registry.get(match_uid)
+                if future is None:
+                    future = match_pool.submit(fetch_match, match_uid)
+                    registry[match_uid] = future
+                else:
+                    self.metrics.increment('shared_matches', 'batch')
+            return future
+
+        def collect_player(player_uid):
+            watermark = manifest.get_watermark(player_uid) if incremental else 0
+            history_pages, history_rows, match_uids, _ = self.pipeline_matches(
+                player_uid,
+                watermark=watermark,
+                skip=already_collected.__contains__,
+                prefetch=prefetch,
+                page_limit=page_limit,
+                on_match=lambda match_uid, match: None,
+                submit_match=lambda match_uid: submit_match(player_uid, match_uid)
+            )
+            logger.info('Found %s new match_uids for player %s...', len(match_uids), player_uid)
+            return history_pages, history_rows, match_uids
+
+        logger.info('Collecting %s players, %s at a time, with %s match workers...', len(player_uids), player_workers, workers)
+        try:
+            with self.metrics.stage('match_fetch'):
+                with ThreadPoolExecutor(max_workers=player_workers) as player_pool:
+                    results = dict(zip(player_uids, player_pool.map(collect_player, player_uids)))
+                matches_list = list(registry)
+                matches = [registry[match_uid].result() for match_uid in matches_list]
+        finally:
+            match_pool.shutdown(wait=True, cancel_futures=True)
+
+        logger.info('Fetched %s matches for %s players, %s shared fetches saved...',
+                    len(matches_list), len(player_uids), sum(len(players) for players in provenance.values()) - len(matches_list))
+
+        history_frames = []
+        for player_uid, (history_pages, history_rows, match_uids) in results.items():
+            if journal is not None:
+                for page, match_history in enumerate(history_pages, start=1):
+                    journal.append("match-history", f'{player_uid}:{page}', match_history)
+            if history_rows:
+                history_frames.append(json_normalize(history_rows).assign(collected_for=player_uid))
+        if journal is not None:
+            journal.flush()
+
+        if matches_list and journal is None:
+            with self.metrics.stage('normalize'):
+                match_df = pd.concat([json_normalize(match) for match in matches])
+            with self.metrics.stage('save'):
+                if suffix is None:
+                    current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+                    batch_id = hashlib.sha1(','.join(player_uids).encode('utf-8')).hexdigest()[:10]
+                    suffix = f"{self.request_params['season']}_batch_{batch_id}_{current_date}"
+                self.save_raw(match_df, pd.concat(history_frames), suffix)
+
+        # only move the watermarks once the matches are safely on disk
+        if incremental:
+            manifest.add_matches(matches_list)
+            for player_uid, (history_pages, history_rows, match_uids) in results.items():
+                if history_rows:
+                    manifest.set_watermark(player_uid, max(row.get('match_time_stamp') or 0 for row in history_rows))
+            manifest.save()
+
+        return {
+            'match_uids': matches_list,
+            'provenance': provenance,
+            'players': {player_uid: len(result[2]) for player_uid, result in results.items()}
+        }
+
+
+    def save_raw(self, match_df, history_df, suffix, data_folder=None):
+        """
+        Saves the raw match and match-history dataframes in the client's output format.
+        CSV files are named 'match_data_{suffix}.csv' / 'match_history_{suffix}.csv', parquet parts go to the
+        'match_data' / 'match_history' tables of the store, partitioned by season and collection date.
+
+        match_df (DataFrame): One row per match (json_normalize of the match responses).
+        history_df (DataFrame): The match-history rows.
+        suffix (str): Unique identifier of this output, e.g. '{season}_{player_uid}_{date}'.
+        data_folder (str): Folder the CSV files are written to (optional, defaults to self.data_folder).
+        """
+        data_folder = data_folder or self.data_folder
+        if self.output_format in ['csv', 'both']:
+            os.makedirs(data_folder, exist_ok=True)
+            match_df.to_csv(os.path.join(data_folder, f"match_data_{suffix}.csv"), index=False)
+            history_df.to_csv(os.path.join(data_folder, f"match_history_{suffix}.csv"), index=False)
+
+        if self.output_format in ['parquet', 'both']:
+            season = self.request_params['season']
+            self.store.write('match_data', match_df, suffix, season=season)
+            self.store.write('match_history', history_df, suffix, season=season)
+
+
+class ResponseCache:
+
+    """
+    A persistent on-disk cache for MRAPI responses.
+    Responses are stored zlib compressed in a single sqlite file, keyed by the URL built by MRAPIClient.build_url.
+    Each endpoint has its own policy: 'match' payloads never change so they are kept forever, everything else expires after a TTL.
+    When the file grows past max_bytes the least recently used responses are evicted first.
+    Hits do not write to the file: their access times are buffered and written flush_every hits at a time (and before
+    an eviction or on close), and the stored size is kept as a running total instead of being summed on every write.
+
+    Attributes:
+        path (str): Path to the sqlite file holding the cached responses.
+        max_bytes (int): Size limit for the stored (compressed) responses.
+        flush_every (int): Number of hits whose access times are buffered before they are written.
+        policies (dict): Per endpoint cache policy.
+            ttl (int | None): Seconds a response stays fresh (None = never expires).
+            ignore_params (bool): Drop the query string from the key, e.g. page/limit do not change a match payload.
+        bypass (bool): Skip the cache completely, nothing is read or written.
+        refresh (bool): Ignore cached responses but store the new ones (forces a refetch of everything).
+        hits (int): Number of requests answered from the cache.
+        misses (int): Number of requests that had to go to the API (including expired entries).
+        evictions (int): Number of responses removed to stay under max_bytes.
+        total_bytes (int): Running total of the stored (compressed) response sizes.
+
+    Methods:
+        get(url, endpoint=None): Returns the cached JSON response for the URL, or None on a miss.
+        set(url, endpoint, content): Stores the raw response body for the URL.
+        flush_access(): Writes the buffered access times.
+        close(): Writes the buffered access times and closes the sqlite file.
+        stats(): Returns the hit/miss counters and the current size of the cache.
+        clear(endpoint=None): Removes every cached response (or only the ones for an endpoint).
+    """
+
+    def __init__(self, path=os.path.join(DATA_FOLDER, 'mrapi_cache.sqlite'), max_bytes=512 * 1024 * 1024, policies=None, flush_every=256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.policies = {
+            "match": {"ttl": None, "ignore_params": True},              # finished matches never change
+            "match-history": {"ttl": 60 * 60, "ignore_params": False},  # new games show up all the time
+            "player": {"ttl": 24 * 60 * 60, "ignore_params": False},    # rank/profile changes daily at most
+            "heroes": {"ttl": 7 * 24 * 60 * 60, "ignore_params": False} # only changes with patches
+        }
+        if policies:
+            for endpoint, policy in policies.items():
+                self.policies.setdefault(endpoint, {}).update(policy)
+
+        self.bypass = False
+        self.refresh = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # the client calls the cache from its worker threads, so one connection guarded by a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, endpoint TEXT, body BLOB, size INTEGER, created_at REAL, last_access REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.conn.commit()
+
+        # key -> last access time of the hits not written yet, and the running size of the stored responses
+        self.pending_access = {}
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+    def build_key(self, url, endpoint=None):
+        """
+        Builds the cache key for a URL using the endpoint policy.
+
+        url (str): The full URL returned by build_url.
+        endpoint (str): The endpoint the URL was built for (optional).
+        """
+        policy = self.policies.get(endpoint, {})
+        if policy.get("ignore_params"):
+            return url.split("?", 1)[0]
+        return url
+
+
+    def get(self, url, endpoint=None):
+        """
+        Returns the cached JSON response for the URL, or None if it is missing or expired.
+
+        url (str): The full URL returned by build_url.
+        endpoint (str): The endpoint the URL was built for, selects the TTL (optional).
+        """
+        if self.bypass:
+            return None
+
+        key = self.build_key(url, endpoint)
+        now = time.time()
+
+        with self.lock:
+            if self.refresh:
+                self.misses += 1
+                return None
+
+            row = self.conn.execute("SELECT body, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            ttl = self.policies.get(endpoint, {}).get("ttl")
+
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                self.misses += 1
+                return None
+
+            self.pending_access[key] = now
+            if len(self.pending_access) >= self.flush_every:
+                self.flush_access()
+            self.hits += 1
+
+        return json.loads(zlib.decompress(row[0]))
+
+
+    def set(self, url, endpoint, content):
+        """
+        Stores a raw response body and evicts the least recently used responses if the cache is over max_bytes.
+
+        url (str): The full URL returned by build_url.
+        endpoint (str): The endpoint the URL was built for.
+        content (bytes | str): The raw response body.
+        """
+        if self.bypass:
+            return
+
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+
+        key = self.build_key(url, endpoint)
+        body = zlib.compress(content)
+        now = time.time()
+
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.total_bytes += len(body) - (previous[0] if previous else 0)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, body, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, body, len(body), now, now)
+            )
+            self.evict()
+            self.conn.commit()
+
+
+    def evict(self):
+        """
+        Removes the least recently used responses until the cache fits in max_bytes.
+        Expects the caller to hold the lock.
+        """
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        # the buffered hits decide the least recently used order too
+        self.flush_access(commit=False)
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC")
+        expired = []
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            expired.append((key,))
+            self.total_bytes -= size
+
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", expired)
+        self.evictions += len(expired)
+
+
+    def flush_access(self, commit=True):
+        """
+        Writes the buffered access times of the hits in one statement.
+        Expects the caller to hold the lock (see close for the public entry point).
+        """
+        if not self.pending_access:
+            return
+        self.conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?", [(now, key) for key, now in self.pending_access.items()])
+        self.pending_access = {}
+        if commit:
+            self.conn.commit()
+
+
+    def close(self):
+        """
+        Writes the buffered access times and closes the sqlite file.
+        """
+        with self.lock:
+            self.flush_access()
+            self.conn.close()
+
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the current size of the cache.
+        """
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            size = self.total_bytes
+
+        requests_seen = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests_seen if requests_seen else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size
+        }
+
+
+    def clear(self, endpoint=None):
+        """
+        Removes every cached response, or only the ones for the given endpoint.
+
+        endpoint (str): The endpoint to clear (optional).
+        """
+        with self.lock:
+            if endpoint is None:
+                self.conn.execute("DELETE FROM responses")
+                self.total_bytes = 0
+            else:
+                self.total_bytes -= self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses WHERE endpoint = ?", (endpoint,)).fetchone()[0]
+                self.conn.execute("DELETE FROM responses WHERE endpoint = ?", (endpoint,))
+            self.pending_access = {}
+            self.conn.commit()
+
+
+class CollectionManifest:
+
+    """
+    Keeps track of what has already been collected so get_total_data can run incrementally.
+    The manifest holds every match_uid already saved to the data folder and a high-water timestamp per player
+    (the newest match_time_stamp collected from their match-history). It is stored as a small JSON file next to the data.
+
+    Attributes:
+        path (str): Path to the manifest JSON file.
+        data_folder (str): Folder holding the 'match_data*.csv' files to scan for match_uids.
+        matches (set): The match_uids already collected.
+        watermarks (dict): Newest collected match_time_stamp per player_uid.
+        scanned_files (set): The match_data files already absorbed into the manifest.
+
+    Methods:
+        scan(): Adds the match_uids from any match_data file in the data folder that has not been scanned yet.
+        get_watermark(player_uid): Returns the player's high-water timestamp (0 if the player was never collected).
+        set_watermark(player_uid, timestamp): Moves the player's watermark forward.
+        add_matches(match_uids): Marks match_uids as collected.
+        save(): Writes the manifest to disk.
+    """
+
+    def __init__(self, path=os.path.join(DATA_FOLDER, 'manifest.json'), data_folder=DATA_FOLDER):
+        self.path = path
+        self.data_folder = data_folder
+        self.matches = set()
+        self.watermarks = {}
+        self.scanned_files = set()
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            self.matches = set(manifest.get('matches', []))
+            self.watermarks = manifest.get('watermarks', {})
+            self.scanned_files = set(manifest.get('scanned_files', []))
+
+
+    def scan(self):
+        """
+        Adds the match_uids from any 'match_data*.csv' file in the data folder that has not been scanned yet.
+        Only the match_uid column is read, so this stays cheap as the data folder grows.
+        """
+        csv_files = sorted(glob.glob(os.path.join(self.data_folder, 'match_data*.csv')))
+        for csv_file in csv_files:
+            name = os.path.basename(csv_file)
+            if name in self.scanned_files:
+                continue
+            logger.info('Scanning %s for collected match_uids...', name)
+            match_uids = pd.read_csv(csv_file, usecols=['match_details.match_uid'])['match_details.match_uid']
+            self.matches.update(match_uids.dropna().astype(str))
+            self.scanned_files.add(name)
+
+
+    def get_watermark(self, player_uid):
+        """
+        Returns the newest match_time_stamp collected for the player (0 if the player was never collected).
+
+        player_uid (str): The player UID.
+        """
+        return int(self.watermarks.get(str(player_uid), 0))
+
+
+    def set_watermark(self, player_uid, timestamp):
+        """
+        Moves the player's watermark forward, it never moves back.
+
+        player_uid (str): The player UID.
+        timestamp (int): The newest match_time_stamp collected for the player.
+        """
+        if pd.isna(timestamp):
+            return
+        self.watermarks[str(player_uid)] = max(self.get_watermark(player_uid), int(timestamp))
+
+
+    def add_matches(self, match_uids):
+        """
+        Marks match_uids as collected.
+
+        match_uids (list): The match_uids saved to disk.
+        """
+        self.matches.update(str(match_uid) for match_uid in match_uids)
+
+
+    def save(self):
+        """
+        Writes the manifest to disk, through a temporary file so a crash never leaves a half written manifest.
+        """
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        manifest = {
+            'matches': sorted(self.matches),
+            'watermarks': self.watermarks,
+            'scanned_files': sorted(self.scanned_files)
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.path)
+
+
+class PlayerCrawler:
+
+    """
+    A snowball crawler that grows the dataset from one or more seed players (Step 2.1 of get_total_data at scale).
+    Every crawled player's recent match-history is fetched, the new matches are downloaded, and the other players in those
+    matches (match_details.match_players) are pushed onto a de-duplicated frontier to be crawled next.
+
+    The order the frontier is crawled in is set by the policy:
+        'bfs':    breadth first, players are crawled in the order they were found.
+        'random': a random player from the frontier, this spreads the crawl out the fastest.
+        'rank':   rank stratified, the next player comes from the rank tier with the fewest collected matches so far.
+                  A discovered player is put in the tier of the match they were found in (matchmaking keeps lobbies close in rank).
+
+    The crawl stops when the frontier is empty or one of the global budgets is hit (max_matches, max_requests, max_wall_time).
+    A budget only pauses the crawl: a player cut short is put back at the front of the frontier with the history page to
+    continue from and the match_uids that were not fetched yet, so a resumed crawl (with a larger budget) collects them.
+    A player whose requests fail (MRAPIError) is logged and skipped, only an exhausted quota ends the crawl.
+    Collected matches are flushed to 'match_data_*' / 'match_history_*' part files together with a checkpoint of the frontier,
+    so a stopped crawl can be resumed by creating a new crawler with the same checkpoint_path and calling crawl() again.
+
+    Attributes:
+        client (MRAPIClient): The client used for every request.
+        policy (str): The frontier policy ('bfs', 'random' or 'rank').
+        max_matches (int): Stop after this many matches have been collected (None = no limit).
+        max_requests (int): Stop after this many requests have been sent to the API (None = no limit).
+        max_wall_time (float): Stop after this many seconds (None = no limit).
+        history_pages (int): Number of match-history pages fetched per player.
+        players_per_match (int): Number of players sampled from each new match into the frontier (None = all of them).
+        flush_every (int): Flush the collected matches and checkpoint after this many crawled players.
+        checkpoint_path (str): Path of the JSON checkpoint (None = no checkpointing).
+        data_folder (str): Folder the part files are written to.
+        manifest (CollectionManifest): Optional manifest, matches already on disk are skipped and new ones are added to it.
+        frontier (deque): The players waiting to be crawled, as dicts with player_uid, depth and bucket (and page / pending
+            for a player cut short by a budget: the next history page and match_uid -> bucket of the matches not fetched yet).
+        seen_players (set): Every player ever pushed onto the frontier.
+        visited_matches (set): Every match_uid already collected by the crawl (or already in the manifest).
+        bucket_counts (dict): Number of collected matches per rank tier.
+
+    Methods:
+        crawl(seed_player_uids=None): Runs the crawl until the frontier is empty or a budget is hit.
+        push(player_uid, depth=0, bucket='Unranked'): Adds a player to the frontier if they were never seen before.
+        pop(): Removes and returns the next player to crawl according to the policy.
+        save_checkpoint(): Writes the frontier state to checkpoint_path.
+        load_checkpoint(): Restores the frontier state from checkpoint_path.
+    """
+
+    def __init__(self, client, policy='bfs', max_matches=5000, max_requests=None, max_wall_time=None, history_pages=1,
+                 players_per_match=None, flush_every=10, checkpoint_path=os.path.join(DATA_FOLDER, 'crawler_checkpoint.json'),
+                 data_folder=DATA_FOLDER, manifest=None, seed=None):
+        if policy not in ['bfs', 'random', 'rank']:
+            raise ValueError("Invalid policy. Use 'bfs', 'random' or 'rank'.")
+
+        self.client = client
+        self.policy = policy
+        self.max_matches = max_matches
+        self.max_requests = max_requests
+        self.max_wall_time = max_wall_time
+        self.history_pages = history_pages
+        self.players_per_match = players_per_match
+        self.flush_every = flush_every
+        self.checkpoint_path = checkpoint_path
+        self.data_folder = data_folder
+        self.manifest = manifest
+        self.random = random.Random(seed)
+
+        self.frontier = deque()
+        self.seen_players = set()
+        self.visited_matches = set()
+        self.bucket_counts = {}
+        self.matches_collected = 0
+        self.requests_sent = 0
+        self.elapsed = 0.0
+        self.part = 0
+
+        # matches/history collected since the last flush
+        self.match_buffer = []
+        self.history_buffer = []
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            self.load_checkpoint()
+
+
+    def push(self, player_uid, depth=0, bucket='Unranked'):
+        """
+        Adds a player to the frontier if they were never seen before.
+
+        player_uid (str): The player UID.
+        depth (int): Number of hops from a seed player.
+        bucket (str): Rank tier the player was found in (used by the 'rank' policy).
+        """
+        player_uid = str(player_uid)
+        if player_uid in self.seen_players:
+            return False
+        self.seen_players.add(player_uid)
+        self.frontier.append({'player_uid': player_uid, 'depth': depth, 'bucket': bucket})
+        return True
+
+
+    def pop(self):
+        """
+        Removes and returns the next player to crawl according to the policy.
+        """
+        if self.policy == 'bfs':
+            return self.frontier.popleft()
+
+        if self.policy == 'random':
+            index = self.random.randrange(len(self.frontier))
+        else:
+            # rank: take the oldest entry of the least represented tier that still has players waiting
+            buckets = {entry['bucket'] for entry in self.frontier}
+            bucket = min(buckets, key=lambda b: (self.bucket_counts.get(b, 0), b))
+            index = next(i for i, entry in enumerate(self.frontier) if entry['bucket'] == bucket)
+            entry = self.frontier[index]
+            del self.frontier[index]
+            return entry
+
+        # swap with the last entry so removal is O(1), the order does not matter for random picks
+        self.frontier[index], self.frontier[-1] = self.frontier[-1], self.frontier[index]
+        return self.frontier.pop()
+
+
+    def budget_left(self):
+        """
+        Returns False once any of the global budgets has been used up.
+        """
+        if self.max_matches is not None and self.matches_collected >= self.max_matches:
+            logger.info('Match budget reached (%s)...', self.matches_collected)
+            return False
+        if self.max_requests is not None and self.requests_sent >= self.max_requests:
+            logger.info('Request budget reached (%s)...', self.requests_sent)
+            return False
+        if self.max_wall_time is not None and self.elapsed >= self.max_wall_time:
+            logger.info('Wall time budget reached (%.0fs)...', self.elapsed)
+            return False
+        return True
+
+
+    def crawl(self, seed_player_uids=None):
+        """
+        Runs the crawl until the frontier is empty or a budget is hit.
+
+        seed_player_uids (list): Player UIDs to start from, ignored if they were already seen (e.g. when resuming).
+
+        Returns:
+            int: The number of matches collected so far (including previous runs restored from the checkpoint).
+        """
+        for player_uid in seed_player_uids or []:
+            self.push(player_uid)
+
+        if self.manifest is not None:
+            self.manifest.scan()
+
+        start = time.time() - self.elapsed
+        crawled = 0
+        while self.frontier and self.budget_left():
+            entry = self.pop()
+            logger.info('Crawling player %s (depth %s, %s, frontier: %s)...', entry["player_uid"], entry["depth"], entry["bucket"], len(self.frontier))
+            try:
+                self.crawl_player(entry)
+            except QuotaExceededError:
+                # no key can send another request this period, the frontier is checkpointed below
+                logger.warning('API quota used up, stopping the crawl...')
+                break
+            except MRAPIError as e:
+                logger.warning('Skipping player %s: %s', entry["player_uid"], e)
+
+            crawled += 1
+            self.elapsed = time.time() - start
+            if crawled % self.flush_every == 0:
+                self.flush()
+
+        self.elapsed = time.time() - start
+        self.flush()
+        logger.info('Crawl finished: %s matches, %s requests, %s players left in the frontier.', self.matches_collected, self.requests_sent, len(self.frontier))
+        return self.matches_collected
+
+
+    def send(self, fetch):
+        """
+        Runs a fetch function on the client and adds the requests it sent to the request budget.
+        """
+        before = self.client.request_count
+        try:
+            return fetch()
+        finally:
+            self.requests_sent += self.client.request_count - before
+
+
+    def crawl_player(self, entry):
+        """
+        Fetches the player's match-history, downloads the matches not collected yet and pushes their players onto the frontier.
+
+        entry (dict): The frontier entry of the player.
+        """
+        player_uid = entry['player_uid']
+
+        # matches of a previous visit that a budget cut, match_uid -> rank tier
+        buckets = dict(entry.get('pending') or {})
+
+        history = []
+        next_page = None
+        for page in range(entry.get('page', 1), self.history_pages + 1):
+            if not self.budget_left():
+                next_page = page
+                break
+            match_history = self.send(lambda: self.client.get_data(api_version="v2", endpoint="match-history", request_uid=player_uid, page=page))
+            normalized_match_history = json_normalize(match_history['match_history'])
+            if len(normalized_match_history) == 0:
+                break
+            history.append(normalized_match_history)
+
+        if history:
+            history = pd.concat(history)
+            self.history_buffer.append(history)
+
+            # the rank tier of each match comes from the crawled player's own rank at the time
+            levels = history.get('match_player.score_info.level', pd.Series(None, index=history.index))
+            buckets.update(zip(history['match_uid'], levels.map(rank_bucket)))
+
+        # a match is only marked visited once it is fetched, so the ones cut by the budgets are still collected after a resume
+        new_matches = []
+        for match_uid in buckets:
+            if match_uid in self.visited_matches:
+                continue
+            if self.manifest is not None and match_uid in self.manifest.matches:
+                self.visited_matches.add(match_uid)
+                continue
+            new_matches.append(match_uid)
+
+        # never go over the match or request budget
+        cut = new_matches
+        if self.max_matches is not None:
+            new_matches = new_matches[:max(self.max_matches - self.matches_collected, 0)]
+        if self.max_requests is not None:
+            new_matches = new_matches[:max(self.max_requests - self.requests_sent, 0)]
+        cut = cut[len(new_matches):]
+
+        # the budget only pauses the crawl, the player is crawled again first with what is left
+        if cut or next_page is not None:
+            resume = {'player_uid': player_uid, 'depth': entry['depth'], 'bucket': entry['bucket']}
+            if next_page is not None:
+                resume['page'] = next_page
+            if cut:
+                resume['pending'] = {match_uid: buckets[match_uid] for match_uid in cut}
+            self.frontier.appendleft(resume)
+
+        if not new_matches:
+            return
+
+        matches = self.send(lambda: self.client.get_many("v1", "match", new_matches))
+
+        for match_uid, match in zip(new_matches, matches):
+            self.visited_matches.add(match_uid)
+            self.match_buffer.append(json_normalize(match))
+            bucket = buckets[match_uid]
+            self.bucket_counts[bucket] = self.bucket_counts.get(bucket, 0) + 1
+            self.matches_collected += 1
+
+            players = [str(player['player_uid']) for player in match.get('match_details', {}).get('match_players', [])]
+            players = [uid for uid in players if uid not in self.seen_players]
+            if self.players_per_match is not None and len(players) > self.players_per_match:
+                players = self.random.sample(players, self.players_per_match)
+            for uid in players:
+                self.push(uid, depth=entry['depth'] + 1, bucket=bucket)
+
+
+    def flush(self):
+        """
+        Writes the buffered matches and match-history to a new part file, then checkpoints the frontier.
+        The data is written before the checkpoint so a crash can never mark matches as visited that are not on disk.
+        """
+        if self.match_buffer:
+            self.part += 1
+            season = self.client.request_params['season']
+            current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            suffix = f"{season}_crawl_{current_date}_{self.part:04d}"
+
+            logger.info('Saving %s crawled matches to part %s...', len(self.match_buffer), self.part)
+            self.client.save_raw(pd.concat(self.match_buffer), pd.concat(self.history_buffer), suffix, data_folder=self.data_folder)
+
+            if self.manifest is not None:
+                for match in self.match_buffer:
+                    self.manifest.add_matches(match['match_details.match_uid'])
+                self.manifest.save()
+
+        self.match_buffer = []
+        self.history_buffer = []
+        self.save_checkpoint()
+
+
+    def save_checkpoint(self):
+        """
+        Writes the frontier state to checkpoint_path (through a temporary file so it is never half written).
+        """
+        if not self.checkpoint_path:
+            return
+        if os.path.dirname(self.checkpoint_path):
+            os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+
+        checkpoint = {
+            'policy': self.policy,
+            'frontier': list(self.frontier),
+            'seen_players': sorted(self.seen_players),
+            'visited_matches': sorted(self.visited_matches),
+            'bucket_counts': self.bucket_counts,
+            'matches_collected': self.matches_collected,
+            'requests_sent': self.requests_sent,
+            'elapsed': self.elapsed,
+            'part': self.part
+        }
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+    def load_checkpoint(self):
+        """
+        Restores the frontier state from checkpoint_path.
+        """
+        logger.info('Resuming crawl from %s...', self.checkpoint_path)
+        with open(self.checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+
+        self.frontier = deque(checkpoint['frontier'])
+        self.seen_players = set(checkpoint['seen_players'])
+        self.visited_matches = set(checkpoint['visited_matches'])
+        self.bucket_counts = checkpoint['bucket_counts']
+        self.matches_collected = checkpoint['matches_collected']
+        self.requests_sent = checkpoint['requests_sent']
+        self.elapsed = checkpoint['elapsed']
+        self.part = checkpoint['part']
+
+
+class RankEnricher:
+
+    """
+    Step 2.2 of get_total_data: the SR (rank score) change of every player in every collected match, a richer target than is_win.
+    The 'player' endpoint returns a player's rank_history (match_time_stamp, level_progression.from/to and
+    score_progression.add_score/total_score per ranked match). Instead of one request per player per match, the distinct
+    player_uids of a whole table are fetched once each on a bounded thread pool, and the rank histories are kept in a
+    small per player cache so a player is only fetched again after ttl seconds.
+
+    The rank changes are then joined onto the cleaned per player table with a single merge_asof per batch: a (player, match)
+    row gets the first rank_history entry of the player at or after the match start time (embedded in the match_uid)
+    within max_match_seconds and before the player's next match in the table started, as the history has timestamps
+    but no match_uids.
+
+    Attributes:
+        client (MRAPIClient): The client used for the 'player' requests.
+        path (str): Path of the JSON file holding the cached rank histories.
+        ttl (int): Seconds a cached player stays fresh.
+        max_workers (int): Number of concurrent 'player' requests (defaults to the client max_workers).
+        api_version (str): The API version of the 'player' endpoint.
+        max_match_seconds (int): Longest time between a match start and its rank_history entry.
+        players (dict): player_uid -> {'fetched': unix time, 'history': [[match_time_stamp, add_score, total_score, level_from, level_to], ...]}.
+
+    Methods:
+        refresh(player_uids): Fetches the players that are missing or stale (at most once each) and saves the cache.
+        rank_changes(player_uids=None): The cached rank histories as one dataframe.
+        enrich(players_df, refresh=True): Adds sr_delta, sr_total, rank_level_from and rank_level_to to a per player table.
+        save(): Writes the cache to disk.
+    """
+
+    def __init__(self, client, path=os.path.join(DATA_FOLDER, 'player_ranks.json'), ttl=24 * 60 * 60, max_workers=None, api_version='v1', max_match_seconds=60 * 60):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.api_version = api_version
+        self.max_match_seconds = max_match_seconds
+        self.players = {}
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.players = json.load(f)
+
+
+    def parse_history(self, player):
+        """
+        Returns the compact [match_time_stamp, add_score, total_score, level_from, level_to] rows of a player response.
+        """
+        history = []
+        for entry in player.get('rank_history') or []:
+            score = entry.get('score_progression') or {}
+            level = entry.get('level_progression') or {}
+            if entry.get('match_time_stamp') is None:
+                continue
+            history.append([int(entry['match_time_stamp']), score.get('add_score'), score.get('total_score'), level.get('from'), level.get('to')])
+        return history
+
+
+    def stale(self, player_uids, now=None):
+        """
+        Returns the player_uids (de-duplicated, in order) that are not cached or were fetched more than ttl seconds ago.
+        """
+        now = time.time() if now is None else now
+        stale = []
+        for player_uid in dict.fromkeys(str(player_uid) for player_uid in player_uids):
+            cached = self.players.get(player_uid)
+            if cached is None or now - cached['fetched'] > self.ttl:
+                stale.append(player_uid)
+        return stale
+
+
+    def refresh(self, player_uids):
+        """
+        Fetches every missing or stale player once, max_workers at a time, and saves the cache.
+        A player that fails is logged and skipped (it is tried again on the next refresh), the others are kept.
+
+        player_uids (iterable): The players, duplicates are fetched once.
+
+        Returns:
+            dict: The number of players requested, fetched and failed.
+        """
+        stale = self.stale(player_uids)
+        workers = max(self.max_workers or self.client.max_workers, 1)
+        summary = {'requested': len(stale), 'fetched': 0, 'failed': 0}
+        if not stale:
+            return summary
+
+        logger.info('Fetching the rank history of %s players with %s workers...', len(stale), workers)
+        self.client.reserve_connections(workers)
+
+        def fetch(player_uid):
+            try:
+                return self.client.fetch(self.client.request_spec(self.api_version, 'player', player_uid))
+            except MRAPIError as e:
+                logger.warning('Could not fetch player %s: %s', player_uid, e)
+                return None
+
+        with self.client.metrics.stage('player_fetch'):
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for player_uid, player in zip(stale, executor.map(fetch, stale)):
+                    if player is None:
+                        summary['failed'] += 1
+                        continue
+                    self.players[player_uid] = {'fetched': time.time(), 'history': self.parse_history(player)}
+                    summary['fetched'] += 1
+
+        self.save()
+        logger.info('Rank histories: %s', summary)
+        return summary
+
+
+    def rank_changes(self, player_uids=None):
+        """
+        Returns the cached rank histories as one dataframe (player_uid, match_time_stamp, sr_delta, sr_total,
+        rank_level_from, rank_level_to), sorted by match_time_stamp.
+
+        player_uids (iterable): Only these players (optional, defaults to every cached player).
+        """
+        player_uids = self.players if player_uids is None else dict.fromkeys(str(player_uid) for player_uid in player_uids)
+        owners = []
+        rows = []
+        for player_uid in player_uids:
+            history = self.players.get(player_uid, {}).get('history', [])
+            owners.extend([player_uid] * len(history))
+            rows.extend(history)
+
+        changes = pd.DataFrame(rows, columns=['match_time_stamp', 'sr_delta', 'sr_total', 'rank_level_from', 'rank_level_to'])
+        changes.insert(0, 'player_uid', pd.to_numeric(pd.Series(owners, dtype=object), errors='coerce').fillna(-1).astype('int64'))
+        changes['match_time_stamp'] = changes['match_time_stamp'].astype('int64')
+        for column in ['sr_delta', 'sr_total']:
+            changes[column] = pd.to_numeric(changes[column], errors='coerce').astype('float64')
+        for column in ['rank_level_from', 'rank_level_to']:
+            changes[column] = pd.to_numeric(changes[column], errors='coerce').astype('Int64')
+        return changes.sort_values('match_time_stamp', kind='stable').reset_index(drop=True)
+
+
+    def enrich(self, players_df, refresh=True):
+        """
+        Adds the rank change of every (player, match) row to a cleaned per player table (or the per hero one):
+        sr_delta (score_progression.add_score), sr_total, rank_level_from and rank_level_to, NaN when the match is not
+        in the player's rank history (e.g. a quick play match).
+
+        players_df (DataFrame): Rows with player_uid and match_uid (or the match_uid_* columns of CompactSchema).
+        refresh (bool): Fetch the missing/stale players first (optional, defaults to True).
+
+        Returns:
+            DataFrame: players_df with the four columns added, in the same row order.
+        """
+        if refresh:
+            self.refresh(players_df['player_uid'].dropna().astype('int64').unique())
+
+        if 'match_uid_time' in players_df.columns:
+            match_start = players_df['match_uid_time']
+        else:
+            match_start = players_df['match_uid'].astype(str).str.split('_').str[1]
+
+        rows = pd.DataFrame({
+            'position': np.arange(len(players_df)),
+            'player_uid': pd.to_numeric(players_df['player_uid'], errors='coerce').fillna(-1).astype('int64').to_numpy(),
+            'match_start': pd.to_numeric(match_start, errors='coerce').fillna(-1).astype('int64').to_numpy()
+        })
+        changes = self.rank_changes(rows['player_uid'].unique().astype(str))
+
+        merged = pd.merge_asof(
+            rows.sort_values('match_start', kind='stable'),
+            changes,
+            left_on='match_start',
+            right_on='match_time_stamp',
+            by='player_uid',
+            direction='forward',
+            tolerance=self.max_match_seconds
+        ).sort_values('position')
+
+        # an entry stamped after the player's next match started belongs to that match (this one was not ranked)
+        starts = rows[['player_uid', 'match_start']].drop_duplicates().sort_values(['player_uid', 'match_start'])
+        starts['next_start'] = starts.groupby('player_uid')['match_start'].shift(-1)
+        next_start = merged[['player_uid', 'match_start']].merge(starts, how='left', on=['player_uid', 'match_start'])['next_start']
+        merged.loc[merged['match_time_stamp'].to_numpy() > next_start.to_numpy(), ['sr_delta', 'sr_total', 'rank_level_from', 'rank_level_to']] = np.nan
+
+        enriched = players_df.copy()
+        for column in ['sr_delta', 'sr_total']:
+            enriched[column] = merged[column].to_numpy()
+        for column in ['rank_level_from', 'rank_level_to']:
+            enriched[column] = pd.array(merged[column].to_numpy(), dtype='Int64')
+        logger.info('Rank changes found for %s of %s rows...', int(merged["sr_delta"].notna().sum()), len(enriched))
+        return enriched
+
+
+    def save(self):
+        """
+        Writes the cache to disk, through a temporary file so a crash never leaves a half written cache.
+        """
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.players, f)
+        os.replace(tmp_path, self.path)
+
+
+class SamplingPlanner:
+
+    """
+    Plans which matches to fetch from the cheap match-history metadata, so the API quota is only spent on 'match'
+    requests that fill a stratum quota (e.g. mostly Diamond to Grandmaster competitive games plus a smaller quickplay control group).
+
+    A match-history entry is put in the stratum (game_mode_id, match_season, rank_bucket) of the history row (the rank of
+    the player whose history it is, matchmaking keeps lobbies close in rank). Quotas are keyed 'mode:season:bucket' with
+    '*' matching anything, e.g. {'2:*:Diamond': 500, '2:*:Grandmaster': 500, '1:*:*': 100}, and a match counts towards
+    the most specific quota it matches (ties go to the first one); matches outside every quota are never fetched.
+    Each quota keeps a reservoir (Algorithm R) of at most quota - fetched candidate match_uids, so however many history
+    pages are offered the planned matches are a uniform sample of the candidates seen and exactly the missing number of
+    matches is requested. The plan (reservoirs, counters and fetched match_uids) is saved to path so sampling can continue
+    across sessions.
+
+    Attributes:
+        quotas (dict): Number of matches wanted per stratum key.
+        path (str): Path of the JSON plan (None = not saved).
+        manifest (CollectionManifest): Optional manifest, matches already on disk are never offered.
+        strata (dict): Per quota key: {'fetched': int, 'offered': int, 'seen': int (reservoir counter), 'pending': [match_uids]}.
+        matches (set): Every match_uid fetched through the plan.
+        candidates (set): Every match_uid ever offered (a match seen in several histories is only offered once).
+
+    Methods:
+        stratum(history): The quota key of every row of a normalized match-history dataframe (None = no quota).
+        offer(history): Offers the rows of a normalized match-history dataframe to the reservoirs.
+        plan(): The match_uids to fetch to reach the quotas.
+        mark_fetched(match_uids): Counts fetched matches towards their quotas.
+        complete(): True when every quota is reached.
+        progress(): A dataframe with the quota, fetched, pending and offered matches per stratum.
+        collect(client, player_uids, history_pages=1): Pages the players' histories until every reservoir is full, then fetches the plan.
+        save(): Writes the plan to path.
+    """
+
+    def __init__(self, quotas, path=os.path.join(DATA_FOLDER, 'sampling_plan.json'), manifest=None, seed=None):
+        self.quotas = dict(quotas)
+        self.path = path
+        self.manifest = manifest
+        self.random = random.Random(seed)
+        self.rules = []
+        for key in self.quotas:
+            rule = key.split(':')
+            if len(rule) != 3:
+                raise ValueError(f"Invalid stratum '{key}'. Use 'mode:season:bucket' with '*' for any value.")
+            self.rules.append((key, rule))
+        # most specific first, the stable sort keeps the given order between equally specific quotas
+        self.rules.sort(key=lambda item: item[1].count('*'))
+
+        self.strata = {key: {'fetched': 0, 'offered': 0, 'seen': 0, 'pending': []} for key in self.quotas}
+        self.matches = set()
+        self.candidates = set()
+        self.queued = set()
+
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            for key, stratum in state['strata'].items():
+                if key in self.strata:
+                    self.strata[key] = stratum
+            self.matches = set(state['matches'])
+            self.candidates = set(state['candidates'])
+            self.queued = {match_uid for stratum in self.strata.values() for match_uid in stratum['pending']}
+
+
+    def stratum(self, history):
+        """
+        Returns the quota key of every row of a normalized match-history dataframe (None where no quota matches).
+
+        history (DataFrame): The json_normalize'd 'match_history' list of the match-history endpoint.
+        """
+        missing = pd.Series(None, index=history.index, dtype=object)
+        modes = pd.to_numeric(history.get('game_mode_id', missing), errors='coerce').astype('Int64').astype(str)
+        seasons = pd.to_numeric(history.get('match_season', missing), errors='coerce').astype('Int64').astype(str)
+        buckets = history.get('match_player.score_info.level', missing).map(rank_bucket).astype(str)
+
+        keys = pd.Series(None, index=history.index, dtype=object)
+        for key, (mode, season, bucket) in self.rules:
+            matched = keys.isna()
+            if mode != '*':
+                matched &= modes == mode
+            if season != '*':
+                matched &= seasons == season
+            if bucket != '*':
+                matched &= buckets == bucket
+            keys[matched] = key
+        return keys
+
+
+    def offer(self, history):
+        """
+        Offers the rows of a normalized match-history dataframe to the reservoirs of their strata.
+        Matches already offered to this plan or in the manifest are skipped.
+
+        history (DataFrame): The json_normalize'd 'match_history' list of the match-history endpoint.
+
+        Returns:
+            int: Number of new candidate matches offered.
+        """
+        if len(history) == 0:
+            return 0
+
+        candidates = pd.DataFrame({'match_uid': history['match_uid'].astype(str), 'stratum': self.stratum(history)})
+        candidates = candidates[candidates['stratum'].notna()].drop_duplicates('match_uid')
+        candidates = candidates[~candidates['match_uid'].isin(self.candidates)]
+        if self.manifest is not None:
+            candidates = candidates[~candidates['match_uid'].isin(self.manifest.matches)]
+        self.candidates.update(candidates['match_uid'])
+
+        for key, match_uids in candidates.groupby('stratum', sort=False)['match_uid']:
+            stratum = self.strata[key]
+            capacity = self.quotas[key] - stratum['fetched']
+            stratum['offered'] += len(match_uids)
+            for match_uid in match_uids:
+                # reservoir sampling: every candidate of the stratum ends up pending with the same probability
+                stratum['seen'] += 1
+                if capacity <= 0:
+                    continue
+                if len(stratum['pending']) < capacity:
+                    stratum['pending'].append(match_uid)
+                    self.queued.add(match_uid)
+                    continue
+                index = self.random.randrange(stratum['seen'])
+                if index < capacity:
+                    self.queued.discard(stratum['pending'][index])
+                    stratum['pending'][index] = match_uid
+                    self.queued.add(match_uid)
+        return len(candidates)
+
+
+    def plan(self):
+        """
+        Returns the match_uids to fetch to reach the quotas, stratum by stratum.
+        """
+        return [match_uid for stratum in self.strata.values() for match_uid in stratum['pending']]
+
+
+    def mark_fetched(self, match_uids):
+        """
+        Counts fetched matches towards their quotas and removes them from the reservoirs.
+
+        match_uids (iterable): The fetched match_uids (only the planned ones are counted).
+        """
+        fetched = set(match_uids) & self.queued
+        for stratum in self.strata.values():
+            done = [match_uid for match_uid in stratum['pending'] if match_uid in fetched]
+            if done:
+                stratum['fetched'] += len(done)
+                stratum['pending'] = [match_uid for match_uid in stratum['pending'] if match_uid not in fetched]
+                # a new reservoir starts for the remaining capacity
+                stratum['seen'] = len(stratum['pending'])
+        self.matches |= fetched
+        self.queued -= fetched
+
+
+    def full(self):
+        """
+        True when every quota is reached or has enough pending candidates to be reached.
+        """
+        return all(stratum['fetched'] + len(stratum['pending']) >= self.quotas[key] for key, stratum in self.strata.items())
+
+
+    def complete(self):
+        """
+        True when every quota is reached.
+        """
+        return all(stratum['fetched'] >= self.quotas[key] for key, stratum in self.strata.items())
+
+
+    def progress(self):
+        """
+        Returns a dataframe with the quota, fetched, pending and offered matches and the fill ratio per stratum.
+        """
+        progress = pd.DataFrame([
+            {'stratum': key, 'quota': self.quotas[key], 'fetched': stratum['fetched'], 'pending': len(stratum['pending']), 'offered': stratum['offered']}
+            for key, stratum in self.strata.items()
+        ])
+        progress['filled'] = (progress['fetched'] / progress['quota'].where(progress['quota'] > 0)).fillna(1.0).round(3)
+        return progress
+
+
+    def collect(self, client, player_uids, history_pages=1, data_folder=None):
+        """
+        Pages through the players' match-history (cheap) until every reservoir is full, then fetches only the planned
+        matches (expensive) and saves them to 'match_data_*' / 'match_history_*' files. Paging more history before a
+        reservoir is full makes the sample more uniform, every history page after that would only cost quota.
+
+        client (MRAPIClient): The client used for the requests.
+        player_uids (list): The players whose histories are offered, in order.
+        history_pages (int): Max number of match-history pages per player.
+        data_folder (str): Folder the raw files are written to (optional, defaults to the client data_folder).
+
+        Returns:
+            DataFrame: The progress per stratum after the fetch.
+        """
+        if self.manifest is not None:
+            self.manifest.scan()
+
+        histories = []
+        for player_uid in player_uids:
+            if self.full():
+                break
+            for page in range(1, history_pages + 1):
+                match_history = client.get_data(api_version="v2", endpoint="match-history", request_uid=player_uid, page=page)
+                normalized_match_history = json_normalize(match_history['match_history'])
+                if len(normalized_match_history) == 0:
+                    break
+                histories.append(normalized_match_history)
+                self.offer(normalized_match_history)
+                if self.full():
+                    break
+            logger.info('Offered the history of player %s: %s', player_uid, ', '.join(f"{key} {stratum['fetched'] + len(stratum['pending'])}/{self.quotas[key]}" for key, stratum in self.strata.items()))
+
+        # the reservoirs are kept even if a match request fails below
+        self.save()
+        planned = self.plan()
+        if planned:
+            logger.info('Fetching %s planned matches...', len(planned))
+            matches = client.get_many("v1", "match", planned)
+            match_df = pd.concat([json_normalize(match) for match in matches])
+            history_df = pd.concat(histories) if histories else pd.DataFrame(columns=['match_uid'])
+            history_df = history_df[history_df['match_uid'].isin(planned)].drop_duplicates('match_uid')
+
+            season = client.request_params['season']
+            current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            client.save_raw(match_df, history_df, f"{season}_sample_{current_date}_{len(self.matches):06d}", data_folder=data_folder)
+            self.mark_fetched(planned)
+
+            if self.manifest is not None:
+                self.manifest.add_matches(planned)
+                self.manifest.save()
+
+        self.save()
+        progress = self.progress()
+        logger.info('Sampling progress:\n%s', progress.to_string(index=False))
+        return progress
+
+
+    def save(self):
+        """
+        Writes the plan to path, through a temporary file so a crash never leaves a half written plan.
+        """
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'quotas': self.quotas, 'strata': self.strata, 'matches': sorted(self.matches), 'candidates': sorted(self.candidates)}, f)
+        os.replace(tmp_path, self.path)
+
+
+class ResponseJournal:
+
+    """
+    An append-only, gzip compressed JSONL journal of raw MRAPI responses.
+    Every response is written as one JSON line ({"endpoint", "uid", "fetched_at", "response"}) as soon as it arrives,
+    so a long crawl no longer has to hold everything in memory until the end, and a crash only loses what was not flushed yet.
+
+    Each flush writes the pending lines as their own gzip member, so the file is always a valid multi-member gzip file
+    (zcat works on it) and a torn write can only ever damage the last member. When an existing journal is opened, it is
+    scanned member by member and anything after the last complete member is truncated before appending resumes.
+
+    Only the writer (mode='a') recovers and truncates. Readers should open the journal with mode='r': the file is then
+    never written to, and a member that is still being written by a live writer simply ends the read.
+
+    Attributes:
+        path (str): Path to the journal file (e.g. '../data/mrapi_journal.jsonl.gz').
+        mode (str): 'a' to append to the journal (the default), 'r' to only read it.
+        flush_every (int): Number of records buffered before they are written out as a new member.
+        fsync (bool): fsync the file after every flush so the records survive a power loss, not just a crash.
+        records (int): Number of complete records in the journal.
+
+    Methods:
+        append(endpoint, uid, response): Adds a raw response to the journal.
+        flush(): Writes the buffered records to disk.
+        read(endpoint=None): Lazily yields the records in the journal (optionally only the ones for one endpoint).
+        uids(endpoint): Returns the set of UIDs already journaled for an endpoint.
+        close(): Flushes and closes the journal.
+    """
+
+    def __init__(self, path=os.path.join(DATA_FOLDER, 'mrapi_journal.jsonl.gz'), flush_every=1, fsync=True, mode='a'):
+        if mode not in ('a', 'r'):
+            raise ValueError(f"Unknown journal mode '{mode}', expected 'a' or 'r'.")
+
+        self.path = path
+        self.mode = mode
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.records = 0
+        self.pending = []
+        self.index = {}
+        self.lock = threading.Lock()
+        self.file = None
+        self.indexed = False
+
+        if mode == 'r':
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Journal {path} does not exist.")
+            return
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if os.path.exists(path):
+            self.recover()
+        self.indexed = True
+        self.file = open(path, 'ab')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def members(self, chunk_size=1024 * 1024):
+        """
+        Yields the decompressed content and end offset of every complete gzip member in the journal.
+        The file is read in chunks, a truncated or corrupt last member is silently skipped.
+        """
+        with open(self.path, 'rb') as f:
+            offset = 0
+            member_size = 0
+            decompressor = zlib.decompressobj(31)
+            content = []
+            chunk = f.read(chunk_size)
+            while chunk:
+                try:
+                    content.append(decompressor.decompress(chunk))
+                except zlib.error:
+                    return
+
+                if not decompressor.eof:
+                    member_size += len(chunk)
+                    chunk = f.read(chunk_size)
+                    continue
+
+                # a member ended inside this chunk, the rest of the chunk belongs to the next member
+                offset += member_size + len(chunk) - len(decompressor.unused_data)
+                yield b''.join(content), offset
+
+                chunk = decompressor.unused_data or f.read(chunk_size)
+                decompressor = zlib.decompressobj(31)
+                member_size = 0
+                content = []
+
+
+    def scan(self):
+        """
+        Indexes the complete records in the journal and returns the offset right after the last complete member.
+        """
+        end = 0
+        for content, end in self.members():
+            for line in content.splitlines():
+                record = json.loads(line)
+                self.index.setdefault(record['endpoint'], set()).add(record['uid'])
+                self.records += 1
+        self.indexed = True
+        return end
+
+
+    def recover(self):
+        """
+        Indexes the existing journal and truncates anything after the last complete record. Only used by the writer.
+        """
+        end = self.scan()
+        size = os.path.getsize(self.path)
+        if size > end:
+            logger.warning('Journal %s has an incomplete tail (%s bytes), resuming from the last complete record...', self.path, size - end)
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        logger.info('Resuming journal %s with %s records...', self.path, self.records)
+
+
+    def append(self, endpoint, uid, response):
+        """
+        Adds a raw response to the journal, it is written out once flush_every records are buffered.
+
+        endpoint (str): The endpoint the response came from.
+        uid (str): The UID the response was requested for (e.g. match_uid, or player_uid:page for match-history).
+        response (dict): The JSON response from the MRAPI.
+        """
+        if self.mode == 'r':
+            raise ValueError(f"Journal {self.path} was opened read-only.")
+
+        line = json.dumps({"endpoint": endpoint, "uid": str(uid), "fetched_at": time.time(), "response": response})
+        with self.lock:
+            self.pending.append(line.encode('utf-8') + b'\n')
+            self.index.setdefault(endpoint, set()).add(str(uid))
+            if len(self.pending) >= self.flush_every:
+                self.write_pending()
+
+
+    def flush(self):
+        """
+        Writes the buffered records to disk.
+        """
+        with self.lock:
+            self.write_pending()
+
+
+    def write_pending(self):
+        """
+        Writes the buffered records as one gzip member. Expects the caller to hold the lock.
+        """
+        if not self.pending:
+            return
+        self.file.write(gzip.compress(b''.join(self.pending)))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.records += len(self.pending)
+        self.pending = []
+
+
+    def read(self, endpoint=None):
+        """
+        Lazily yields the records in the journal, one member in memory at a time.
+
+        endpoint (str): Only yield the records for this endpoint (optional).
+        """
+        if self.mode == 'a':
+            self.flush()
+        for content, _ in self.members():
+            for line in content.splitlines():
+                record = json.loads(line)
+                if endpoint is None or record['endpoint'] == endpoint:
+                    yield record
+
+
+    def uids(self, endpoint):
+        """
+        Returns the set of UIDs already journaled for an endpoint.
+
+        endpoint (str): The endpoint (e.g. 'match').
+        """
+        with self.lock:
+            # a reader only indexes the journal when it is first asked for
+            if not self.indexed:
+                self.scan()
+            return set(self.index.get(endpoint, set()))
+
+
+    def close(self):
+        """
+        Flushes and closes the journal.
+        """
+        if self.file is not None and not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class ParquetStore:
+
+    """
+    A columnar (parquet) dataset for the collected and cleaned data, readable by pandas/pyarrow without any parsing.
+    Each table is a folder of parquet parts, hive partitioned by season and collection date:
+        {root}/{table}/season={season}/collected={YYYY-MM-DD}/{suffix}-{part}.parquet
+
+    Nested fields (match_players, player_heroes, badges, ban_pick_info) are stored as native list/struct columns instead of
+    python-repr strings, whole number columns keep their nullable Int64 type and the low cardinality strings
+    (role, attack_type, primary_attack_type, game_mode_name) are stored dictionary encoded and read back as categoricals.
+    The notebooks can load only the columns (and partitions) they need, e.g.
+
+        store = ParquetStore('data/parquet')
+        df = store.read('cleaned_match_data', columns=['hero_id_x', 'role', 'is_win'], season=2)
+
+    pyarrow is only needed by this class, it is imported when the store is first used.
+
+    Attributes:
+        root (str): Root folder of the dataset.
+        nested_types (dict): Explicit arrow types for the nested columns of the raw match table.
+        categorical_columns (list): Columns stored as categoricals.
+
+    Methods:
+        write(table, df, suffix, season=None, collected=None, append=False): Writes a dataframe as a new part of a table.
+        read(table, columns=None, season=None, collected=None): Reads a table (or some of its columns/partitions) into pandas.
+        read_arrow(table, columns=None, season=None, collected=None): Same as read but returns the pyarrow Table (zero-copy).
+        iter_batches(table, columns=None, season=None, collected=None, batch_size=1000): Lazily yields record batches.
+        export_csv(table, path, columns=None, season=None, collected=None): Writes a table back out as CSV.
+    """
+
+    categorical_columns = ['role', 'attack_type', 'primary_attack_type', 'match_details.game_mode.game_mode_name']
+
+    def __init__(self, root=os.path.join(DATA_FOLDER, 'parquet')):
+        self.root = root
+        self._pa = None
+        self._nested_types = None
+
+
+    @property
+    def pa(self):
+        if self._pa is None:
+            try:
+                import pyarrow
+                import pyarrow.dataset
+                import pyarrow.parquet
+            except ImportError as e:
+                raise ImportError("The parquet output needs pyarrow, install it with 'pip install pyarrow'.") from e
+            self._pa = pyarrow
+        return self._pa
+
+
+    @property
+    def nested_types(self):
+        """
+        Explicit arrow types for the nested columns of the raw match table.
+        Inferring them breaks on 'ban_pick_info.votes', which is always an empty dict and parquet cannot store an empty
+        struct, so the known fields are listed here (unknown keys are dropped, missing keys become null).
+        """
+        if self._nested_types is None:
+            pa = self.pa
+            hero = pa.struct([
+                ('hero_id', pa.int64()), ('play_time', pa.float64()), ('kills', pa.int64()), ('deaths', pa.int64()),
+                ('assists', pa.int64()), ('session_hit_rate', pa.float64()), ('hero_icon', pa.string())
+            ])
+            badge = pa.struct([('id', pa.int64()), ('name', pa.string()), ('count', pa.int64())])
+            player = pa.struct([
+                ('player_uid', pa.int64()), ('nick_name', pa.string()), ('player_icon', pa.int64()), ('camp', pa.int64()),
+                ('cur_hero_id', pa.int64()), ('cur_hero_icon', pa.string()), ('is_win', pa.int64()), ('kills', pa.int64()),
+                ('deaths', pa.int64()), ('assists', pa.int64()), ('total_hero_damage', pa.float64()),
+                ('total_hero_heal', pa.float64()), ('total_damage_taken', pa.float64()),
+                ('badges', pa.list_(badge)), ('player_heroes', pa.list_(hero))
+            ])
+            ban_pick = pa.struct([
+                ('round_idx', pa.int64()), ('is_pick', pa.int64()), ('battle_side', pa.int64()), ('hero_id', pa.int64()),
+                ('conf_id', pa.int64()), ('is_one_side', pa.bool_()), ('vote_type', pa.int64()), ('effect_battle_side', pa.int64())
+            ])
+            self._nested_types = {
+                'match_details.match_players': pa.list_(player),
+                'match_details.dynamic_fields.ban_pick_info': pa.list_(ban_pick)
+            }
+        return self._nested_types
+
+
+    def to_arrow(self, df):
+        """
+        Converts a dataframe to an arrow table with the store's column types.
+        Nested columns that are still python-repr strings (e.g. read back from a CSV file) are parsed first.
+        """
+        pa = self.pa
+        arrays = []
+        names = []
+        for column in df.columns:
+            values = df[column]
+            if column in self.nested_types:
+                values = [parse_repr(x) if isinstance(x, str) else (x if isinstance(x, list) else None) for x in values]
+                array = pa.array(values, type=self.nested_types[column])
+            else:
+                if column in self.categorical_columns and not isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.astype('category')
+                array = pa.Array.from_pandas(values)
+            arrays.append(array)
+            names.append(str(column))
+        return pa.Table.from_arrays(arrays, names=names)
+
+
+    def partition_path(self, table, season=None, collected=None):
+        season = 'unknown' if season is None else season
+        collected = collected or datetime.datetime.now().strftime("%Y-%m-%d")
+        return os.path.join(self.root, table, f'season={season}', f'collected={collected}')
+
+
+    def write(self, table, df, suffix, season=None, collected=None, append=False):
+        """
+        Writes a dataframe as a new part of a table.
+
+        table (str): The table name (e.g. 'match_data', 'cleaned_team_stats').
+        df (DataFrame): The data to write.
+        suffix (str): Unique identifier of the output, the part files are named after it.
+        season (int): Season partition (optional, 'unknown' if not given).
+        collected (str): Collection date partition as YYYY-MM-DD (optional, defaults to today).
+        append (bool): Add another part for this suffix instead of replacing its existing parts.
+
+        Returns:
+            str: The path of the written part.
+        """
+        folder = self.partition_path(table, season, collected)
+        os.makedirs(folder, exist_ok=True)
+
+        existing = sorted(glob.glob(os.path.join(folder, f'{glob.escape(suffix)}-*.parquet')))
+        if not append:
+            for path in existing:
+                os.remove(path)
+            existing = []
+
+        path = os.path.join(folder, f'{suffix}-{len(existing):05d}.parquet')
+        self.pa.parquet.write_table(self.to_arrow(df), path)
+        return path
+
+
+    def dataset(self, table):
+        path = os.path.join(self.root, table)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"No '{table}' table found in {self.root}.")
+        return self.pa.dataset.dataset(path, format='parquet', partitioning='hive')
+
+
+    def partition_filter(self, season=None, collected=None):
+        ds = self.pa.dataset
+        expression = None
+        for field, value in [('season', season), ('collected', collected)]:
+            if value is None:
+                continue
+            condition = ds.field(field) == value
+            expression = condition if expression is None else expression & condition
+        return expression
+
+
+    def read_arrow(self, table, columns=None, season=None, collected=None):
+        """
+        Reads a table into a pyarrow Table, only the requested columns and partitions are loaded.
+        """
+        return self.dataset(table).to_table(columns=columns, filter=self.partition_filter(season, collected))
+
+
+    def read(self, table, columns=None, season=None, collected=None):
+        """
+        Reads a table into a pandas dataframe, only the requested columns and partitions are loaded.
+        Whole number columns come back as Int64 and the dictionary encoded columns as categoricals.
+
+        table (str): The table name.
+        columns (list): Columns to load (optional, defaults to all of them, including the season/collected partitions).
+        season (int): Only load this season (optional).
+        collected (str): Only load this collection date (optional).
+        """
+        arrow_table = self.read_arrow(table, columns, season, collected)
+        pandas_types = {self.pa.int64(): pd.Int64Dtype(), self.pa.int32(): pd.Int64Dtype()}
+        return arrow_table.to_pandas(types_mapper=pandas_types.get)
+
+
+    def iter_batches(self, table, columns=None, season=None, collected=None, batch_size=1000):
+        """
+        Lazily yields the table as pyarrow record batches of at most batch_size rows.
+        """
+        scanner = self.dataset(table).scanner(columns=columns, filter=self.partition_filter(season, collected), batch_size=batch_size)
+        yield from scanner.to_batches()
+
+
+    def export_csv(self, table, path, columns=None, season=None, collected=None):
+        """
+        Writes a table back out as CSV, nested columns are written as python-repr strings like the CSV outputs always were.
+
+        table (str): The table name.
+        path (str): The CSV file to write.
+        columns (list): Columns to export (optional).
+        season (int): Only export this season (optional).
+        collected (str): Only export this collection date (optional).
+        """
+        arrow_table = self.read_arrow(table, columns, season, collected)
+        df = arrow_table.to_pandas()
+        for name in arrow_table.column_names:
+            if self.pa.types.is_list(arrow_table.schema.field(name).type) or self.pa.types.is_struct(arrow_table.schema.field(name).type):
+                df[name] = [None if x is None else str(x) for x in arrow_table.column(name).to_pylist()]
+        df.to_csv(path, index=False)
+        return path
+
+
+class CompactSchema:
+
+    """
+    Compact in-memory dtypes for the cleaned tables, so the whole multi-season corpus fits in RAM:
+        - match_uid (e.g. '5517602_1744662520_1290198_11001_12') is split into five integer columns: match_uid_seq,
+          match_uid_time (the unix time embedded in the uid), match_uid_map (map id * 1000 + instance, e.g. map 1290),
+          match_uid_part4 and match_uid_part5. join_match_uid rebuilds the exact strings, the split is only used when
+          every uid of the frame comes back unchanged (otherwise match_uid is kept, as a categorical).
+        - text columns that repeat (role, attack_type, primary_attack_type, player names, ...) become categoricals.
+        - integer columns are downcast to the smallest type holding their values, nullable ones stay nullable.
+          float64 columns are only cast to float32 with float32=True, as that changes the values.
+
+    A compacted frame can be expanded back to the original columns (expand), the CSV text of an expanded frame is the
+    same as the original one. Frames compacted separately (e.g. chunk by chunk) are concatenated with concat, which
+    keeps the categoricals instead of falling back to object columns.
+
+    The schema is only applied when the cleaned outputs are loaded (DataCleaner.load_outputs, DatasetCompactor.load): the
+    cleaner still writes its CSV files and parquet tables in the original layout (a plain match_uid column and the
+    pandas dtypes), so the files stay readable by the notebooks and every chunk of a run keeps the same parquet schema.
+
+    Attributes:
+        decompose (bool): Split match_uid into its integer parts.
+        float32 (bool): Downcast float64 columns to float32 (lossy).
+        max_category_ratio (float): Text columns with at most this many distinct values per row become categoricals.
+
+    Methods:
+        compact(df): Returns the compact copy of a dataframe.
+        expand(df): Returns the dataframe with the original match_uid column back.
+        concat(frames): Concatenates compacted frames, keeping the categoricals.
+        read_csv(path, chunksize=100000, usecols=None): Reads a CSV file chunk by chunk straight into the compact dtypes.
+        split_match_uid(match_uids): The integer parts of the match_uids (None if they do not round trip).
+        join_match_uid(df): Rebuilds the match_uid strings from their parts.
+    """
+
+    match_uid_parts = ['match_uid_seq', 'match_uid_time', 'match_uid_map', 'match_uid_part4', 'match_uid_part5']
+
+    def __init__(self, decompose=True, float32=False, max_category_ratio=0.5):
+        self.decompose = decompose
+        self.float32 = float32
+        self.max_category_ratio = max_category_ratio
+
+
+    def split_match_uid(self, match_uids):
+        """
+        Returns the integer parts of the match_uids as a dataframe (one column per part), or None when a uid does not
+        have five numeric parts or would not be rebuilt exactly (e.g. leading zeros).
+
+        match_uids (Series): The match_uid strings.
+        """
+        match_uids = match_uids.astype(str)
+        if not match_uids.str.fullmatch(r'\d+(?:_\d+){4}').all():
+            return None
+
+        parts = match_uids.str.split('_', expand=True)
+        parts.columns = self.match_uid_parts
+        parts = parts.apply(lambda part: pd.to_numeric(part, downcast='unsigned'))
+        if not self.join_match_uid(parts).equals(match_uids.reset_index(drop=True).set_axis(parts.index)):
+            return None
+        return parts
+
+
+    def join_match_uid(self, df):
+        """
+        Rebuilds the match_uid strings from the match_uid_* columns.
+        """
+        parts = [df[part].astype(str) for part in self.match_uid_parts]
+        return parts[0].str.cat(parts[1:], sep='_')
+
+
+    def compact(self, df):
+        """
+        Returns the compact copy of a dataframe (see the class description).
+
+        df (DataFrame): A cleaned (or raw) table.
+        """
+        columns = {}
+        for column in df.columns:
+            values = df[column]
+
+            if column == 'match_uid' and self.decompose:
+                parts = self.split_match_uid(values)
+                if parts is not None:
+                    for part in self.match_uid_parts:
+                        columns[part] = parts[part].set_axis(df.index)
+                    continue
+
+            if pd.api.types.is_bool_dtype(values) or isinstance(values.dtype, pd.CategoricalDtype):
+                columns[column] = values
+            elif pd.api.types.is_integer_dtype(values):
+                columns[column] = pd.to_numeric(values, downcast='unsigned' if values.min() >= 0 else 'integer') if len(values.dropna()) else values
+            elif pd.api.types.is_float_dtype(values):
+                columns[column] = values.astype('float32') if self.float32 and values.dtype == 'float64' else values
+            elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+                if column == 'match_uid' or values.nunique() <= max(len(values) * self.max_category_ratio, 1):
+                    columns[column] = values.astype('category')
+                else:
+                    columns[column] = values
+            else:
+                columns[column] = values
+
+        return pd.DataFrame(columns, index=df.index)
+
+
+    def expand(self, df):
+        """
+        Returns the dataframe with the match_uid_* columns joined back into match_uid (at the same position).
+        """
+        if not set(self.match_uid_parts).issubset(df.columns):
+            return df
+        position = list(df.columns).index(self.match_uid_parts[0])
+        expanded = df.drop(columns=self.match_uid_parts)
+        expanded.insert(position, 'match_uid', self.join_match_uid(df))
+        return expanded
+
+
+    def concat(self, frames):
+        """
+        Concatenates compacted frames: categoricals are unioned instead of falling back to object columns, and frames
+        whose match_uid could not be split are concatenated with the others by expanding them all.
+        """
+        frames = [frame for frame in frames if frame is not None]
+        if not frames:
+            return pd.DataFrame()
+        if len({tuple(frame.columns) for frame in frames}) > 1:
+            frames = [self.expand(frame) for frame in frames]
+
+        from pandas.api.types import union_categoricals
+
+        columns = {}
+        for column in frames[0].columns:
+            parts = [frame[column] for frame in frames]
+            if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+                columns[column] = pd.Series(union_categoricals(parts), name=column)
+            else:
+                columns[column] = pd.concat(parts, ignore_index=True)
+        return pd.DataFrame(columns)
+
+
+    def read_csv(self, path, chunksize=100000, usecols=None):
+        """
+        Reads a CSV file chunk by chunk, compacting each chunk, so the full width object columns of the whole file are
+        never in memory at once.
+
+        path (str): The CSV file.
+        chunksize (int): Number of rows read at a time.
+        usecols (list): Only read these columns (optional).
+        """
+        dtype = {'match_uid': str}
+        return self.concat(self.compact(chunk) for chunk in pd.read_csv(path, chunksize=chunksize, usecols=usecols, dtype=dtype))
+
+
+class HeroDimension:
+
+    """
+    A compact hero dimension for the cleaner: hero id -> name, integer coded role and attack type.
+    'hero_info.csv' carries skins, abilities, transformations and image urls (about 250 KB) while the cleaner only needs the
+    role and attack type, so this keeps just those in a small JSON file and looks them up by indexing arrays with
+    hero_id - offset (hero ids are a dense range, 1011 to 1052 at the time of writing) instead of merging dataframes.
+
+    The dimension is refreshed from the 'heroes' endpoint through an MRAPIClient and only rewritten when its contents change,
+    which is detected with a hash of the compact rows stored as the version. Without a saved dimension it is built once
+    from 'hero_info.csv'.
+
+    Attributes:
+        path (str): Path of the JSON file holding the dimension (defaults to 'hero_dimension.json' in DATA_FOLDER).
+        hero_info_path (str): 'hero_info.csv' used to build the dimension when there is no saved one (defaults to the one next to this module).
+        version (str): sha1 of the compact rows, changes whenever a hero, role or attack type changes.
+        roles (list): Role names, indexed by the role codes.
+        attack_types (list): Attack type names (without the ' Heroes' suffix), indexed by the attack type codes.
+        offset (int): Smallest hero id, array position 0.
+        names (ndarray): Hero names by position.
+        role_codes (ndarray): Role code by position, -1 for no role.
+        attack_codes (ndarray): Attack type code by position, -1 for no attack type.
+        present (ndarray): Whether a hero exists at a position.
+
+    Methods:
+        load(): Loads the saved dimension, or builds it from 'hero_info.csv'.
+        build(heroes): Builds the arrays from hero dicts (id, name, role, attack_type).
+        refresh(client): Fetches the 'heroes' endpoint and rebuilds and saves the dimension if it changed.
+        lookup(hero_ids): Vectorized lookup of the role and attack type codes of hero ids.
+    """
+
+    def __init__(self, path=os.path.join(DATA_FOLDER, 'hero_dimension.json'), hero_info_path=os.path.join(HERE, 'hero_info.csv')):
+        self.path = path
+        self.hero_info_path = hero_info_path
+        self.version = None
+        self.updated = None
+        self.roles = []
+        self.attack_types = []
+        self.offset = 0
+        self.names = np.empty(0, dtype=object)
+        self.role_codes = np.empty(0, dtype=np.int8)
+        self.attack_codes = np.empty(0, dtype=np.int8)
+        self.present = np.empty(0, dtype=bool)
+
+
+    @classmethod
+    def from_frame(cls, heroes):
+        """
+        Builds a dimension (not saved anywhere) from a hero info dataframe with id, name, attack_type and role columns.
+        """
+        dimension = cls(path=None)
+        dimension.build(heroes[['id', 'name', 'attack_type', 'role']].to_dict('records'))
+        return dimension
+
+
+    def load(self):
+        """
+        Loads the saved dimension, building (and saving) it from 'hero_info.csv' the first time.
+        """
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            self.roles = saved['roles']
+            self.attack_types = saved['attack_types']
+            self.set_rows(saved['heroes'])
+            self.version = saved['version']
+            self.updated = saved.get('updated')
+            return self
+
+        if not os.path.exists(self.hero_info_path):
+            raise FileNotFoundError(f"No hero dimension at {self.path} and no {self.hero_info_path} to build it from.")
+
+        logger.info('Building the hero dimension from %s...', self.hero_info_path)
+        self.build(pd.read_csv(self.hero_info_path, usecols=['id', 'name', 'attack_type', 'role']).to_dict('records'))
+        if self.path is not None:
+            self.save()
+        return self
+
+
+    def compact_rows(self, heroes):
+        """
+        Reduces hero dicts (from the 'heroes' endpoint or hero_info.csv) to sorted [id, name, role, attack_type] rows.
+        The first row of a hero id wins, like the first match of the old merge.
+        """
+        rows = {}
+        for hero in heroes:
+            try:
+                hero_id = int(hero.get('id'))
+            except (TypeError, ValueError):
+                continue
+            if hero_id in rows:
+                continue
+
+            attack_type = hero.get('attack_type')
+            attack_type = attack_type.replace(' Heroes', '') if isinstance(attack_type, str) else None
+            role = hero.get('role') if isinstance(hero.get('role'), str) else None
+            name = hero.get('name') if isinstance(hero.get('name'), str) else None
+            rows[hero_id] = [hero_id, name, role, attack_type]
+        return [rows[hero_id] for hero_id in sorted(rows)]
+
+
+    def build(self, heroes):
+        """
+        Builds the dimension from hero dicts (id, name, role, attack_type).
+
+        heroes (list): The hero dicts, e.g. the 'heroes' endpoint response or the rows of hero_info.csv.
+
+        Returns:
+            str: The version (hash) of the new contents.
+        """
+        rows = self.compact_rows(heroes)
+        if not rows:
+            raise ValueError("No heroes to build the hero dimension from.")
+
+        self.roles = sorted({row[2] for row in rows if row[2] is not None})
+        self.attack_types = sorted({row[3] for row in rows if row[3] is not None})
+        role_index = {role: code for code, role in enumerate(self.roles)}
+        attack_index = {attack_type: code for code, attack_type in enumerate(self.attack_types)}
+
+        self.set_rows([[hero_id, name, role_index.get(role, -1), attack_index.get(attack_type, -1)] for hero_id, name, role, attack_type in rows])
+        self.version = self.hash_rows(rows)
+        self.updated = datetime.datetime.now().isoformat(timespec='seconds')
+        return self.version
+
+
+    def hash_rows(self, rows):
+        return hashlib.sha1(json.dumps(rows, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+    def set_rows(self, heroes):
+        """
+        Fills the lookup arrays from [id, name, role_code, attack_code] rows.
+        """
+        ids = [row[0] for row in heroes]
+        self.offset = min(ids)
+        size = max(ids) - self.offset + 1
+
+        self.names = np.full(size, None, dtype=object)
+        self.role_codes = np.full(size, -1, dtype=np.int8)
+        self.attack_codes = np.full(size, -1, dtype=np.int8)
+        self.present = np.zeros(size, dtype=bool)
+        for hero_id, name, role_code, attack_code in heroes:
+            position = hero_id - self.offset
+            self.names[position] = name
+            self.role_codes[position] = role_code
+            self.attack_codes[position] = attack_code
+            self.present[position] = True
+
+
+    def rows(self):
+        """
+        Returns the dimension as [id, name, role_code, attack_code] rows.
+        """
+        positions = np.flatnonzero(self.present)
+        return [[int(position + self.offset), self.names[position], int(self.role_codes[position]), int(self.attack_codes[position])] for position in positions]
+
+
+    def save(self):
+        """
+        Writes the dimension (through a temporary file so it is never half written).
+        """
+        saved = {
+            'version': self.version,
+            'updated': self.updated,
+            'roles': self.roles,
+            'attack_types': self.attack_types,
+            'heroes': self.rows()
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.path)
+
+
+    def refresh(self, client, api_version='v1'):
+        """
+        Fetches the 'heroes' endpoint and rebuilds the dimension, saving it only when the contents changed.
+
+        client (MRAPIClient): The client used for the request (its cache keeps the heroes response for a week).
+        api_version (str): The version of the API to use (optional, defaults to 'v1').
+
+        Returns:
+            bool: True if the dimension changed.
+        """
+        heroes = client.get_data(api_version, 'heroes')
+        if isinstance(heroes, dict):
+            heroes = heroes.get('heroes') or heroes.get('data') or []
+
+        rows = self.compact_rows(heroes)
+        if rows and self.hash_rows(rows) == self.version:
+            logger.info('Hero dimension is up to date (version %s)...', self.version[:12])
+            return False
+
+        self.build(heroes)
+        logger.info('Hero dimension updated to version %s (%s heroes)...', self.version[:12], len(rows))
+        if self.path is not None:
+            self.save()
+        return True
+
+
+    def lookup(self, hero_ids):
+        """
+        Looks up hero ids by direct array indexing.
+
+        hero_ids (array-like): Hero ids (missing values allowed).
+
+        Returns:
+            tuple: (present, role_codes, attack_codes) arrays, the codes are -1 where the hero is unknown.
+        """
+        hero_ids = np.asarray(hero_ids, dtype=np.float64)
+        positions = hero_ids - self.offset
+        in_range = (positions >= 0) & (positions < len(self.present))
+        positions = np.where(in_range, positions, 0).astype(np.int64)
+
+        present = in_range & self.present[positions]
+        role_codes = np.where(present, self.role_codes[positions], -1)
+        attack_codes = np.where(present, self.attack_codes[positions], -1)
+        return present, role_codes, attack_codes
+
+
+    def decode(self, codes, categories):
+        """
+        Turns codes back into names (NaN for -1) with one take.
+        """
+        return np.array(list(categories) + [np.nan], dtype=object)[codes]
+
+
+    def to_frame(self):
+        """
+        Returns the dimension as a hero info dataframe (id, name, attack_type, role).
+        """
+        rows = self.rows()
+        return pd.DataFrame({
+            'id': [row[0] for row in rows],
+            'name': [row[1] for row in rows],
+            'attack_type': self.decode(np.array([row[3] for row in rows], dtype=np.int64), self.attack_types),
+            'role': self.decode(np.array([row[2] for row in rows], dtype=np.int64), self.roles)
+        })
+
+
+class MatchFlattener:
+
+    """
+    Flattens raw matches into the per hero and per player tables used by DataCleaner in a single pass.
+    Every match is walked once (match -> players -> heroes) and the column values are appended straight into lists,
+    instead of exploding and json_normalizing the players and heroes and merging them back together.
+    The player level columns are only stored once per player and repeated onto the hero rows with one numpy take.
+
+    The role and attack type of every hero row are looked up at once in a HeroDimension by array indexing.
+
+    The output keeps the exact layout of the previous explode/merge path: the hero level columns get an '_x' suffix
+    (hero_id_x, kills_x, ...) and the player level columns a '_y' suffix (hero_id_y, kills_y, ...). Which hero rows and
+    matches are kept is decided by a MatchValidator in one pass over the flattened rows: by default heroes that are not in
+    the dimension (the old inner merge, also counted in unknown_heroes), rows without playtime and 0 playtime rows are
+    dropped, and matches with a team of more than 6 players are quarantined.
+
+    Attributes:
+        heroes (HeroDimension): The hero dimension (a hero info dataframe is converted to one).
+        validator (MatchValidator): The data quality rules (defaults to MatchValidator()).
+        unknown_heroes (dict): hero id -> number of hero rows dropped because the id is not in the dimension (last flatten call).
+        quarantine (DataFrame): The matches rejected by the validator with their reason codes (last flatten call).
+        rule_counts (dict): rule -> number of failing hero rows / matches (last flatten call, see MatchValidator.validate).
+        hero_fields (list): (raw key, output column) for the hero level values.
+        player_fields (list): (raw key, output column) for the player level values.
+
+    Methods:
+        flatten(matches): Returns the per hero (combined) and per player (filtered) dataframes.
+    """
+
+    hero_fields = [
+        ('hero_id', 'hero_id_x'),
+        ('play_time', 'playtime.raw'),
+        ('kills', 'kills_x'),
+        ('deaths', 'deaths_x'),
+        ('assists', 'assists_x'),
+        ('session_hit_rate', 'hit_rate')
+    ]
+
+    player_fields = [
+        ('nick_name', 'name'),
+        ('cur_hero_id', 'hero_id_y'),
+        ('is_win', 'is_win'),
+        ('kills', 'kills_y'),
+        ('deaths', 'deaths_y'),
+        ('assists', 'assists_y'),
+        ('total_hero_damage', 'hero_damage'),
+        ('total_hero_heal', 'hero_healed'),
+        ('total_damage_taken', 'damage_taken')
+    ]
+
+    def __init__(self, heroes, validator=None):
+        self.heroes = heroes if isinstance(heroes, HeroDimension) else HeroDimension.from_frame(heroes)
+        self.validator = validator if validator is not None else MatchValidator()
+        self.unknown_heroes = {}
+        self.quarantine = None
+        self.rule_counts = {}
+
+
+    def flatten(self, matches):
+        """
+        Flattens raw matches into the per hero and per player tables.
+
+        matches (iterable): (match_uid, match_players) pairs, match_players being the list of player dicts from the match endpoint.
+
+        Returns:
+            tuple: (combined_df, filtered_df), one row per hero played and one row per player (the hero they ended the match on).
+        """
+        hero_keys = [key for key, _ in self.hero_fields]
+        player_keys = [key for key, _ in self.player_fields]
+
+        hero_columns = [[] for _ in self.hero_fields]
+        player_columns = [[] for _ in self.player_fields]
+        hero_player = []        # index of the player row each hero row belongs to
+        player_uids = []
+        match_uids = []
+
+        for match_uid, match_players in matches:
+            for player in match_players:
+                player_row = len(player_uids)
+                player_uids.append(player.get('player_uid'))
+                match_uids.append(match_uid)
+                for column, key in zip(player_columns, player_keys):
+                    column.append(player.get(key))
+
+                for hero in player.get('player_heroes') or []:
+                    # older API responses nest the playtime and call the hit rate 'hit_rate'
+                    if 'play_time' not in hero and isinstance(hero.get('playtime'), dict):
+                        hero = dict(hero, play_time=hero['playtime'].get('raw'))
+                    if 'session_hit_rate' not in hero and 'hit_rate' in hero:
+                        hero = dict(hero, session_hit_rate=hero['hit_rate'])
+
+                    for column, key in zip(hero_columns, hero_keys):
+                        column.append(hero.get(key))
+                    hero_player.append(player_row)
+
+        hero_player = np.asarray(hero_player, dtype=np.int64)
+        playtime = np.round(np.asarray(hero_columns[1], dtype=np.float64))
+
+        # role/attack type of every hero row in one lookup, the rows of unknown heroes are dropped (and reported)
+        hero_ids = pd.to_numeric(pd.Series(hero_columns[0], dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        present, role_codes, attack_codes = self.heroes.lookup(hero_ids)
+        unknown_ids, unknown_counts = np.unique(hero_ids[~present & ~np.isnan(hero_ids)], return_counts=True)
+        self.unknown_heroes = {int(hero_id): int(count) for hero_id, count in zip(unknown_ids, unknown_counts)}
+
+        data = {
+            'hero_id_x': pd.array(hero_columns[0], dtype='Int64'),
+            'playtime.raw': playtime,
+            'kills_x': pd.array(hero_columns[2], dtype='Int64'),
+            'deaths_x': pd.array(hero_columns[3], dtype='Int64'),
+            'assists_x': pd.array(hero_columns[4], dtype='Int64'),
+            'hit_rate': np.asarray(hero_columns[5], dtype=np.float64),
+            'player_uid': pd.array(player_uids, dtype='Int64')[hero_player],
+            'match_uid': pd.Series(match_uids, dtype='str').to_numpy()[hero_player],
+            'attack_type': self.heroes.decode(attack_codes, self.heroes.attack_types),
+            'role': self.heroes.decode(role_codes, self.heroes.roles)
+        }
+
+        for column, (_, name) in zip(player_columns, self.player_fields):
+            data[name] = pd.Series(column).to_numpy()[hero_player]
+
+        # every data quality rule in one pass: unknown heroes, rows without/with 0 playtime and the rejected matches
+        players = pd.DataFrame({'match_uid': match_uids, 'player_uid': pd.array(player_uids, dtype='Int64'), 'is_win': player_columns[2]})
+        current_hero = (data['hero_id_x'] == data['hero_id_y']).fillna(False).to_numpy(dtype=bool)
+        keep, self.quarantine, self.rule_counts = self.validator.validate(players, hero_player, playtime, present, current_hero)
+
+        combined_df = pd.DataFrame(data)
+        if not keep.all():
+            combined_df = combined_df[keep].reset_index(drop=True)
+        combined_df['match_uid'] = combined_df['match_uid'].astype('str')
+        combined_df['is_win'] = combined_df['is_win'].astype(int)
+        combined_df = combined_df.astype({'playtime.raw': 'Int64'})
+
+        # now output the same data but without breaking it down by unique hero_id played by a player
+        filtered_df = combined_df[combined_df['hero_id_x'] == combined_df['hero_id_y']]     # this will be the original data row entery for the player
+
+        return combined_df, filtered_df
+
+
+class MatchValidator:
+
+    """
+    The data quality rules of the cleaner, declared in one place (rules) and evaluated together with vectorized masks over
+    the flattened rows of a chunk (see MatchFlattener), instead of filters spread through the cleaning steps.
+
+    Row rules drop the failing hero rows and keep the match. Match rules reject the whole match: none of its rows reach
+    the cleaned outputs, and it goes to the quarantine output with the codes of every enabled match rule it failed.
+    Every rule is evaluated and counted even when it is not enabled, so the quality of a corpus can be audited without
+    changing what is cleaned. The enabled rules are the filters the cleaner always applied (a match with an oversized team
+    used to be dropped from the team stats only and is now quarantined from every output), the leaver and surrendered
+    rules (the README wants those matches out of the sample) are opt-in, e.g. MatchValidator(enable=['leaver', 'surrendered']).
+
+    The match length is the longest total playtime of a player in the match (the match endpoint has no duration), a
+    surrendered / early FF match is a match shorter than min_match_seconds, and a leaver played less than leaver_ratio of it.
+    The team size of oversized_team counts the same rows as the team stats' players_on_team: players with a uid whose
+    row for the hero they ended the match on passes the enabled row rules (a 0 playtime leaver or an unknown hero is not counted).
+
+    Attributes:
+        enabled (set): The rules that drop rows / reject matches.
+        max_players (int): Most players a team may have.
+        leaver_ratio (float): Share of the match length below which a player counts as a leaver.
+        min_match_seconds (float): Matches shorter than this count as surrendered.
+
+    Methods:
+        validate(players, hero_player, playtime, known_hero, current_hero): Returns the hero rows to keep, the quarantined matches and the rule counts.
+    """
+
+    rules = {
+        'unknown_hero': {'level': 'row', 'enabled': True, 'description': 'hero id missing from the hero dimension'},
+        'missing_playtime': {'level': 'row', 'enabled': True, 'description': 'hero row without a playtime'},
+        'zero_playtime': {'level': 'row', 'enabled': True, 'description': 'hero played for 0 seconds (rounded)'},
+        'oversized_team': {'level': 'match', 'enabled': True, 'description': 'a team has more than max_players players'},
+        'leaver': {'level': 'match', 'enabled': False, 'description': 'a player played less than leaver_ratio of the match'},
+        'surrendered': {'level': 'match', 'enabled': False, 'description': 'the match is shorter than min_match_seconds'}
+    }
+
+    quarantine_columns = ['match_uid', 'reasons', 'players', 'match_seconds']
+
+    def __init__(self, enable=None, disable=None, max_players=6, leaver_ratio=0.5, min_match_seconds=300):
+        unknown = set(enable or []) | set(disable or [])
+        unknown -= set(self.rules)
+        if unknown:
+            raise ValueError(f"Unknown rules {sorted(unknown)}. Use one of the following: {list(self.rules)}.")
+
+        self.enabled = {rule for rule, config in self.rules.items() if config['enabled']}
+        self.enabled |= set(enable or [])
+        self.enabled -= set(disable or [])
+        self.max_players = max_players
+        self.leaver_ratio = leaver_ratio
+        self.min_match_seconds = min_match_seconds
+
+
+    def validate(self, players, hero_player, playtime, known_hero, current_hero):
+        """
+        Evaluates every rule over one chunk of flattened rows.
+
+        players (DataFrame): One row per player with match_uid, player_uid and is_win.
+        hero_player (ndarray): For every hero row, the index of its player row.
+        playtime (ndarray): The (rounded) playtime of every hero row, NaN when missing.
+        known_hero (ndarray): For every hero row, whether the hero id is in the hero dimension.
+        current_hero (ndarray): For every hero row, whether it is the hero the player ended the match on (their per player row).
+
+        Returns:
+            tuple: (keep, quarantine, counts): a boolean mask of the hero rows to keep, one row per rejected match
+            (match_uid, reasons, players, match_seconds) and rule -> number of failing hero rows (row rules) or matches (match rules).
+        """
+        row_masks = {
+            'unknown_hero': ~known_hero,
+            'missing_playtime': np.isnan(playtime),
+            'zero_playtime': playtime == 0
+        }
+
+        row_keep = np.ones(len(hero_player), dtype=bool)
+        for rule, mask in row_masks.items():
+            if rule in self.enabled:
+                row_keep &= ~mask
+
+        match_codes, match_uids = pd.factorize(players['match_uid'])
+        n_matches = len(match_uids)
+
+        # match length = longest total playtime of a player in the match
+        player_seconds = np.bincount(hero_player, weights=np.nan_to_num(playtime), minlength=len(players))
+        match_seconds = np.zeros(n_matches)
+        np.maximum.at(match_seconds, match_codes, player_seconds)
+
+        # per player rows that reach the team stats, per (match, is_win) team
+        win_codes, win_values = pd.factorize(players['is_win'], use_na_sentinel=False)
+        team_codes, team_keys = pd.factorize(match_codes.astype(np.int64) * max(len(win_values), 1) + win_codes)
+        counted = current_hero & row_keep & players['player_uid'].notna().to_numpy()[hero_player]
+        team_sizes = np.bincount(team_codes[hero_player[counted]], minlength=len(team_keys))
+        team_match = np.asarray(team_keys) // max(len(win_values), 1)
+
+        leavers = player_seconds < self.leaver_ratio * match_seconds[match_codes]
+        match_masks = {
+            'oversized_team': np.isin(np.arange(n_matches), team_match[team_sizes > self.max_players]),
+            'leaver': np.bincount(match_codes[leavers], minlength=n_matches) > 0,
+            'surrendered': match_seconds < self.min_match_seconds
+        }
+
+        counts = {rule: int(mask.sum()) for rule, mask in {**row_masks, **match_masks}.items()}
+
+        rejected = np.zeros(n_matches, dtype=bool)
+        reasons = np.full(n_matches, '', dtype=object)
+        for rule, mask in match_masks.items():
+            if rule in self.enabled:
+                rejected |= mask
+                reasons = np.where(mask, reasons + rule + '|', reasons)
+
+        keep = row_keep & ~rejected[match_codes[hero_player]]
+
+        quarantine = pd.DataFrame({
+            'match_uid': pd.Series(np.asarray(match_uids)[rejected], dtype='str'),
+            'reasons': pd.Series(reasons[rejected], dtype='str').str.rstrip('|'),
+            'players': np.bincount(match_codes, minlength=n_matches)[rejected],
+            'match_seconds': match_seconds[rejected]
+        }, columns=self.quarantine_columns)
+        return keep, quarantine, counts
+
+
+class TeamAggregator:
+
+    """
+    Aggregates the per player rows of DataCleaner into one row per team (match_uid, is_win) with vectorized reductions.
+    The team keys, roles and attack types are encoded to integer codes once, then every count and sum is a single
+    np.bincount over the team codes (role/attack type counts are a bincount over team * n_categories + category code),
+    instead of a groupby calling a python lambda per team.
+
+    The output matches the previous groupby/agg step: the rows are sorted by match_uid then is_win, the counters ignore
+    missing values like the pandas aggregations did, primary_attack_type is the first of melee/projectile/hitscan with
+    the highest count. Matches with an oversized team are not dropped here any more: the MatchValidator quarantines them
+    before the rows are aggregated (its oversized_team rule counts the same rows as players_on_team).
+
+    Attributes:
+        roles (dict): role -> output column.
+        attack_types (dict): attack type -> output column.
+        sums (dict): output column -> (input column, dtype) for the team totals.
+
+    Methods:
+        aggregate(filtered_df): Returns the team stats dataframe.
+    """
+
+    roles = {'VANGUARD': 'num_vang', 'STRATEGIST': 'num_strat', 'DUELIST': 'num_duel'}
+
+    attack_types = {'Melee': 'num_melee', 'Hitscan': 'num_hitscan', 'Projectile': 'num_projectile'}
+
+    sums = {
+        'total_damage': ('hero_damage', 'float64'),
+        'total_healing': ('hero_healed', 'float64'),
+        'total_damage_taken': ('damage_taken', 'float64'),
+        'total_deaths': ('deaths_x', 'Int64'),
+        'total_assists': ('assists_x', 'Int64'),
+        'total_kills': ('kills_x', 'Int64')
+    }
+
+    columns = ['match_uid', 'is_win', 'num_vang', 'num_strat', 'num_duel', 'players_on_team', 'avg_hitrate',
+               'num_melee', 'num_hitscan', 'num_projectile', 'total_damage', 'total_healing', 'total_damage_taken',
+               'total_deaths', 'total_assists', 'total_kills', 'primary_attack_type']
+
+    def category_counts(self, team, n_teams, values, categories):
+        """
+        Counts the rows of each category per team, returns an (n_teams, n_categories) array.
+        """
+        codes = pd.Categorical(values, categories=list(categories)).codes
+        known = codes >= 0
+        n_categories = len(categories)
+        counts = np.bincount(team[known] * n_categories + codes[known], minlength=n_teams * n_categories)
+        return counts.reshape(n_teams, n_categories)
+
+
+    def column_sum(self, team, n_teams, values):
+        """
+        Sums a column per team, skipping missing values. Returns the sums and the number of non-missing values.
+        """
+        values = pd.Series(values).to_numpy(dtype=np.float64, na_value=np.nan)
+        present = ~np.isnan(values)
+        sums = np.bincount(team[present], weights=values[present], minlength=n_teams)
+        counts = np.bincount(team[present], minlength=n_teams)
+        return sums, counts
+
+
+    def aggregate(self, filtered_df):
+        """
+        Aggregates the per player rows into the team stats.
+
+        filtered_df (DataFrame): The per player rows returned by MatchFlattener.flatten.
+
+        Returns:
+            DataFrame: One row per (match_uid, is_win), sorted by match_uid then is_win.
+        """
+        if len(filtered_df) == 0:
+            return pd.DataFrame(columns=self.columns)
+
+        # encode the (match_uid, is_win) keys, sorted so the team codes come out in groupby order
+        match_codes, match_uids = pd.factorize(filtered_df['match_uid'], sort=True)
+        win_codes, win_values = pd.factorize(filtered_df['is_win'], sort=True)
+        team_keys = match_codes.astype(np.int64) * len(win_values) + win_codes
+        team_keys, team = np.unique(team_keys, return_inverse=True)
+        n_teams = len(team_keys)
+        team_match = team_keys // len(win_values)
+
+        grouped = {
+            'match_uid': np.asarray(match_uids)[team_match],
+            'is_win': np.asarray(win_values)[team_keys % len(win_values)]
+        }
+
+        role_counts = self.category_counts(team, n_teams, filtered_df['role'], self.roles)
+        for i, column in enumerate(self.roles.values()):
+            grouped[column] = role_counts[:, i]
+
+        grouped['players_on_team'] = pd.array(np.bincount(team[filtered_df['player_uid'].notna().to_numpy()], minlength=n_teams), dtype='Int64')
+
+        hitrate_sum, hitrate_count = self.column_sum(team, n_teams, filtered_df['hit_rate'])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            grouped['avg_hitrate'] = np.where(hitrate_count > 0, hitrate_sum / hitrate_count, np.nan)
+
+        attack_counts = self.category_counts(team, n_teams, filtered_df['attack_type'], self.attack_types)
+        for i, column in enumerate(self.attack_types.values()):
+            grouped[column] = attack_counts[:, i]
+
+        for column, (source, dtype) in self.sums.items():
+            total, _ = self.column_sum(team, n_teams, filtered_df[source])
+            grouped[column] = pd.array(np.round(total).astype(np.int64), dtype='Int64') if dtype == 'Int64' else total
+
+        # Add primary_attack_type column (first of melee, projectile, hitscan with the highest count, like idxmax)
+        primary = np.stack([grouped['num_melee'], grouped['num_projectile'], grouped['num_hitscan']], axis=1)
+        grouped['primary_attack_type'] = np.array(['melee', 'projectile', 'hitscan'], dtype=object)[primary.argmax(axis=1)]
+
+        grouped_df = pd.DataFrame(grouped)[self.columns]
+        grouped_df['match_uid'] = grouped_df['match_uid'].astype('str')
+        return grouped_df
+
+
+def clean_chunk(matches, heroes, validator=None):
+    """
+    Cleans one chunk of raw matches into the per hero, per player and per team dataframes.
+    This is a module level function so DataCleaner can run it in a process pool.
+
+    matches (DataFrame | iterable): Raw match rows (as read from a 'match_data_*.csv' file) or (match_uid, match_players) pairs.
+    heroes (HeroDimension | DataFrame): The hero dimension, or a hero info dataframe (id, name, attack_type, role).
+    validator (MatchValidator): The data quality rules (optional, defaults to MatchValidator()).
+
+    Returns:
+        tuple: (combined_df, filtered_df, grouped_df, unknown_heroes, quarantine_df, rule_counts), unknown_heroes being
+        hero id -> number of dropped hero rows, quarantine_df the rejected matches and rule_counts the failures per rule.
+    """
+    if isinstance(matches, pd.DataFrame):
+        matches = DataCleaner.iter_dataframe_matches(matches)
+
+    # Flatten every match into the per hero rows (and the per player rows, where the hero is the one the player ended on)
+    flattener = MatchFlattener(heroes, validator)
+    combined_df, filtered_df = flattener.flatten(matches)
+    grouped_df = TeamAggregator().aggregate(filtered_df)
+    return combined_df, filtered_df, grouped_df, flattener.unknown_heroes, flattener.quarantine, flattener.rule_counts
+
+
+class StatsStore:
+
+    """
+    Materialized per hero, per role and per team composition aggregates of the cleaned data, kept up to date by DataCleaner.
+    For every group key and metric the store keeps the running count, mean, sum of squared deviations (Welford's M2),
+    min and max, so the winrates, means/max and the mean/std baselines of the z-scores in the analysis notebooks are
+    constant time reads instead of a groupby over every cleaned file.
+
+    A batch of new cleaned rows is reduced to per key count/mean/M2 with one vectorized groupby and merged into the
+    running values with the parallel form of Welford's update (Chan et al.), so an update costs the size of the new rows
+    only and gives the same result as recomputing everything. The sources (DataCleaner output suffixes) already absorbed
+    are recorded so cleaning the same input again does not count its rows twice.
+
+    Groups (see groups):
+        hero: per hero_id_x, from the per hero rows (cleaned_match_data_individual_stats).
+        role: per role, from the per player rows (cleaned_match_data), with the player's match totals (kills_y, ...) like
+            the notebooks' per player table.
+        composition: per 'num_vang-num_duel-num_strat', from the per team rows (cleaned_match_data_team_stats).
+
+    Attributes:
+        path (str): Path of the JSON file holding the aggregates.
+        aggregates (dict): {group: {key: {metric: [count, mean, m2, min, max]}}}.
+        sources (set): The sources already absorbed.
+
+    Methods:
+        update(individual_df=None, player_df=None, team_df=None): Merges a batch of new cleaned rows into the aggregates.
+        stats(group, key=None): Count, mean, std, min and max of every metric of a key (all keys merged when key is None).
+        winrate(group, key=None): The winrate of a key.
+        baseline(group, metrics=None): Mean and std per key as a DataFrame, e.g. the role baselines of the z-scores.
+        to_frame(group): Every aggregate of a group as a DataFrame, one row per key.
+        save(): Writes the aggregates to disk.
+    """
+
+    groups = {
+        'hero': {
+            'frame': 'individual',
+            'by': ['hero_id_x'],
+            'metrics': ['is_win', 'kills_x', 'deaths_x', 'assists_x', 'hit_rate', 'playtime.raw']
+        },
+        'role': {
+            'frame': 'player',
+            'by': ['role'],
+            'metrics': ['is_win', 'kills_y', 'deaths_y', 'assists_y', 'hero_damage', 'hero_healed', 'damage_taken']
+        },
+        'composition': {
+            'frame': 'team',
+            'by': ['num_vang', 'num_duel', 'num_strat'],
+            'metrics': ['is_win', 'total_kills', 'total_deaths', 'total_assists', 'total_damage', 'total_healing', 'total_damage_taken', 'avg_hitrate']
+        }
+    }
+
+    def __init__(self, path=os.path.join(DATA_FOLDER, 'stats_store.json')):
+        self.path = path
+        self.aggregates = {group: {} for group in self.groups}
+        self.sources = set()
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                store = json.load(f)
+            self.aggregates.update(store.get('aggregates', {}))
+            self.sources = set(store.get('sources', []))
+
+
+    def group_keys(self, df, by):
+        """
+        Builds the string key of every row, e.g. '1023' for a hero or '2-2-2' for a composition (the notebooks' composition_id).
+        """
+        parts = []
+        for column in by:
+            values = df[column]
+            if pd.api.types.is_numeric_dtype(values):
+                values = values.astype('Int64')
+            parts.append(values.astype(str))
+        return parts[0].str.cat(parts[1:], sep='-') if len(parts) > 1 else parts[0]
+
+
+    def merge(self, running, batch):
+        """
+        Merges two [count, mean, m2, min, max] aggregates (Chan et al. parallel variance).
+        """
+        count_a, mean_a, m2_a, min_a, max_a = running
+        count_b, mean_b, m2_b, min_b, max_b = batch
+        if count_a == 0:
+            return list(batch)
+        if count_b == 0:
+            return list(running)
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        mean = mean_a + delta * count_b / count
+        m2 = m2_a + m2_b + delta * delta * count_a * count_b / count
+        return [count, mean, m2, min(min_a, min_b), max(max_a, max_b)]
+
+
+    def update_group(self, group, df):
+        config = self.groups[group]
+        if df is None or df.empty or not set(config['by']).issubset(df.columns):
+            return
+
+        # rows without a key (e.g. a missing role) are left out instead of being stored under 'nan'
+        df = df[df[config['by']].notna().all(axis=1)]
+        if df.empty:
+            return
+
+        metrics = [metric for metric in config['metrics'] if metric in df.columns]
+        values = df[metrics].apply(pd.to_numeric, errors='coerce').astype('float64')
+        values['key'] = self.group_keys(df, config['by']).to_numpy()
+
+        grouped = values.groupby('key', sort=False)[metrics]
+        batch = {
+            'count': grouped.count(),
+            'mean': grouped.mean(),
+            'm2': grouped.var(ddof=0) * grouped.count(),
+            'min': grouped.min(),
+            'max': grouped.max()
+        }
+
+        aggregates = self.aggregates.setdefault(group, {})
+        for key in batch['count'].index:
+            running = aggregates.setdefault(key, {})
+            for metric in metrics:
+                count = int(batch['count'].at[key, metric])
+                if count == 0:
+                    continue
+                new = [count] + [float(batch[name].at[key, metric]) for name in ['mean', 'm2', 'min', 'max']]
+                running[metric] = self.merge(running.get(metric, [0, 0.0, 0.0, None, None]), new)
+
+
+    def update(self, individual_df=None, player_df=None, team_df=None):
+        """
+        Merges a batch of new cleaned rows into the aggregates (the dataframes returned by clean_chunk).
+
+        individual_df (DataFrame): New per hero rows (optional).
+        player_df (DataFrame): New per player rows (optional).
+        team_df (DataFrame): New per team rows (optional).
+        """
+        frames = {'individual': individual_df, 'player': player_df, 'team': team_df}
+        for group, config in self.groups.items():
+            self.update_group(group, frames[config['frame']])
+
+
+    def stats(self, group, key=None):
+        """
+        Returns {metric: {'count', 'mean', 'std', 'min', 'max'}} for a key, the std is the sample std like pandas.
+        With key None every key of the group is merged, e.g. the overall std of the role z-scores.
+
+        group (str): 'hero', 'role' or 'composition'.
+        key (str | int | tuple): The hero id, role or (num_vang, num_duel, num_strat) (optional).
+        """
+        aggregates = self.aggregates.get(group, {})
+        if key is None:
+            merged = {}
+            for running in aggregates.values():
+                for metric, values in running.items():
+                    merged[metric] = self.merge(merged.get(metric, [0, 0.0, 0.0, None, None]), values)
+        else:
+            if isinstance(key, (tuple, list)):
+                key = '-'.join(str(part) for part in key)
+            merged = aggregates.get(str(key), {})
+
+        result = {}
+        for metric, (count, mean, m2, minimum, maximum) in merged.items():
+            std = (m2 / (count - 1)) ** 0.5 if count > 1 else np.nan
+            result[metric] = {'count': count, 'mean': mean, 'std': std, 'min': minimum, 'max': maximum}
+        return result
+
+
+    def winrate(self, group, key=None):
+        """
+        Returns the winrate of a key (of the whole group when key is None), NaN if nothing was collected.
+        """
+        is_win = self.stats(group, key).get('is_win')
+        return is_win['mean'] if is_win else np.nan
+
+
+    def baseline(self, group, metrics=None):
+        """
+        Returns the mean and std of every key as a DataFrame indexed by key, with '{metric}_mean' / '{metric}_std' columns.
+        For the role z-scores of analysis_3: store.baseline('role') and store.stats('role') for the overall std.
+        """
+        rows = {}
+        for key in self.aggregates.get(group, {}):
+            row = {}
+            for metric, values in self.stats(group, key).items():
+                if metrics is None or metric in metrics:
+                    row[f'{metric}_mean'] = values['mean']
+                    row[f'{metric}_std'] = values['std']
+            rows[key] = row
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+
+    def to_frame(self, group):
+        """
+        Returns every aggregate of a group as a DataFrame indexed by key, with '{metric}_{count|mean|std|min|max}' columns
+        and a 'win_rate' column (e.g. the hero_stats table of analysis_3v2).
+        """
+        rows = {}
+        for key in self.aggregates.get(group, {}):
+            row = {}
+            for metric, values in self.stats(group, key).items():
+                for name, value in values.items():
+                    row[f'{metric}_{name}'] = value
+            row['win_rate'] = row.get('is_win_mean', np.nan)
+            rows[key] = row
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+
+    def save(self):
+        """
+        Writes the aggregates to disk, through a temporary file so a crash never leaves a half written store.
+        """
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'aggregates': self.aggregates, 'sources': sorted(self.sources)}, f)
+        os.replace(tmp_path, self.path)
 
 
 class DataCleaner:
@@ -369,13 +3889,14 @@ class DataCleaner:
     A class for cleaning MRAPI dataframes.
     This class provides methods to clean the API dataframes by removing unnecessary columns and rows.
     This class also assumes you have the 'hero_info.csv' file in the same directory. The 'hero_info.csv' file contains information about the heroes in the game.
+    It is only read once to build the compact hero dimension (see HeroDimension), which can be refreshed from the API afterwards.
 
     Note: A lot of the data cleaning is a process I already had programmed in a notebook that I did NOT feel like going through
     and fixing. I'd honestly just rather create a new function to open the files and fix the column headers as the API outputs data
     in a weird way. I will fix this in the future (maybe), but for now, this is a quick and dirty way to get the data cleaned up.
 
     """
-    def __init__(self):
+    def __init__(self, output_format='csv', store=None, heroes=None, metrics=None, stats=None, data_folder=DATA_FOLDER, validator=None):
         self.df_column_heads = [
             'match_uid', 
             'player_uid', 
@@ -398,162 +3919,446 @@ class DataCleaner:
         
         self.filename_prefix = 'match_data_'  # Prefix for the CSV files to be cleaned
         self.filename_suffix = None
+        self.data_folder = data_folder  # Folder of the raw CSV files and the cleaned outputs
+
+        # cleaned output format ('csv', 'parquet' or 'both') and the parquet dataset it goes to
+        if output_format not in ['csv', 'parquet', 'both']:
+            raise ValueError("Invalid output format. Use 'csv', 'parquet' or 'both'.")
+        self.output_format = output_format
+        self.store = store if store is not None or output_format == 'csv' else ParquetStore(os.path.join(data_folder, 'parquet'))
+
+        # parquet table names of the three cleaned outputs
+        self.output_tables = ['cleaned_individual_stats', 'cleaned_match_data', 'cleaned_team_stats']
+
+        # hero dimension used for the role/attack type lookup, loaded on first use when not given
+        self.heroes = heroes
+
+        # stage timings (see Metrics), pass the client's metrics to export a single summary for the run
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # materialized hero/role/composition aggregates updated with every cleaned chunk (see StatsStore, None = off)
+        self.stats = stats
+
+        # compact dtypes of the loaded outputs (see CompactSchema and load_outputs)
+        self.schema = CompactSchema()
+
+        # data quality rules, rejected matches go to the 'quarantined_matches' output (see MatchValidator)
+        self.validator = validator if validator is not None else MatchValidator()
+        self.quarantine_table = 'quarantined_matches'
+
+        pass
+
+    def read_journal(self, journal, batch_size=1000):
+        """
+        Builds the raw match dataframe (the same columns as a 'match_data_*.csv' file) from the 'match' records of a journal.
+        The records are read lazily and normalized batch by batch.
+
+        journal (ResponseJournal | str): The journal, or the path to it.
+        batch_size (int): Number of match records normalized at a time.
+
+        Returns:
+            DataFrame: One row per match.
+        """
+        if isinstance(journal, str):
+            journal = ResponseJournal(journal, mode='r')
+
+        frames = []
+        batch = []
+        for record in journal.read("match"):
+            batch.append(record['response'])
+            if len(batch) >= batch_size:
+                frames.append(json_normalize(batch))
+                batch = []
+        if batch:
+            frames.append(json_normalize(batch))
+
+        if not frames:
+            raise ValueError(f"No match records found in the journal {journal.path}.")
+        return pd.concat(frames, ignore_index=True)
+
+
+    def clean(self, csv_file=None, journal=None, chunksize=None, workers=1, from_parquet=False, season=None):
+        """
+        Cleans the given dataframe by removing unnecessary columns and rows.
+        This method assumes you have a saved hero dimension or the 'hero_info.csv' file in the same directory.
+        Hero ids missing from the hero dimension are dropped, and reported per input in the summary and in the output.
+
+        Every input file gets its own three cleaned CSV files (suffixed with the input's unique identifier), exactly like
+        cleaning the files one by one. With a chunksize the matches are read, cleaned and appended to the outputs chunk by
+        chunk, so memory stays flat no matter how big the input is, and with workers > 1 the chunks are cleaned in a process pool.
+        Each match is a single row of the input, so a chunk always holds whole matches and the cleaned rows are the same;
+        only the team stats are sorted by match_uid within each chunk instead of across the whole file.
+
+        csv_file (str | list): The CSV file(s) to be cleaned, a glob pattern (e.g. '../data/match_data_*.csv') or a list of paths.
+            Otherwise, it will load the most recent CSV file from the data folder.
+        journal (ResponseJournal | str): Clean the matches in a response journal instead of a CSV file (optional).
+        chunksize (int): Number of matches cleaned at a time (optional, defaults to the whole file at once).
+        workers (int): Number of processes cleaning chunks in parallel (optional, defaults to 1 = in this process).
+        from_parquet (bool): Clean the raw 'match_data' table of the parquet store instead of a CSV file (optional).
+        season (int): Only clean this season's partition of the parquet store (optional).
+
+        Returns:
+            list: One summary dict per input (suffix, number of matches, hero rows, player rows and teams written and unknown hero ids).
+        """
+        with self.metrics.stage('load_heroes'):
+            heroes = self.load_heroes()
+
+        if journal is not None:
+            logger.info('Loading journal...')
+            journal_path = journal if isinstance(journal, str) else journal.path
+            self.filename_suffix = os.path.basename(journal_path).split('.')[0]
+            logger.info('Extracted unique identifier: %s', self.filename_suffix)
+            sources = [(self.filename_suffix, self.iter_chunks(self.iter_journal_matches(journal), chunksize))]
+            return self.clean_sources(sources, heroes, workers)
+
+        if from_parquet:
+            logger.info('Loading parquet dataset...')
+            store = self.store if self.store is not None else ParquetStore(os.path.join(self.data_folder, 'parquet'))
+            current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            self.filename_suffix = f"{'all' if season is None else season}_parquet_{current_date}"
+            logger.info('Extracted unique identifier: %s', self.filename_suffix)
+            sources = [(self.filename_suffix, self.iter_chunks(self.iter_parquet_matches(store, season), chunksize))]
+            return self.clean_sources(sources, heroes, workers)
+
+        # Load the CSV File
+        logger.info('Loading CSV file...')
+        csv_files = self.find_csv_files(csv_file)
+
+        sources = []
+        for csv_file in csv_files:
+            # Extract the unique identifier from the file name
+            unique_identifier = os.path.basename(csv_file).split('match_data', 1)[1].lstrip('_').split('.')[0]
+            logger.info('Extracted unique identifier: %s', unique_identifier)
+            chunks = pd.read_csv(csv_file, chunksize=chunksize) if chunksize else iter([pd.read_csv(csv_file)])
+            sources.append((unique_identifier, chunks))
+
+        return self.clean_sources(sources, heroes, workers)
+
+
+    def find_csv_files(self, csv_file=None):
+        """
+        Resolves the CSV file argument of clean into a list of paths.
+
+        csv_file (str | list): A path, a glob pattern or a list of them. None returns the most recent 'match_data*.csv' in the data folder.
+        """
+        if csv_file is None:
+            # Get the most recent CSV file from the data folder
+            csv_files = glob.glob(os.path.join(self.data_folder, 'match_data*.csv'))
+            if not csv_files:
+                raise FileNotFoundError("No CSV files with 'match_data' in the name found in the data folder.")
+            latest_csv_file = max(csv_files, key=os.path.getmtime)
+            logger.info('Loading the most recent CSV file: %s', latest_csv_file)
+            return [latest_csv_file]
+
+        patterns = list(csv_file) if isinstance(csv_file, (list, tuple)) else [csv_file]
+
+        csv_files = []
+        for pattern in patterns:
+            if not glob.has_magic(pattern):
+                csv_files.append(pattern)
+                continue
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError(f"No CSV files match {pattern}.")
+            logger.info('Found %s CSV files matching %s', len(matches), pattern)
+            csv_files.extend(matches)
+        return csv_files
+
+
+    def iter_chunks(self, matches, chunksize=None):
+        """
+        Groups an iterable of matches into lists of at most chunksize matches (everything in one list if chunksize is None).
+        """
+        matches = iter(matches)
+        while True:
+            chunk = list(itertools.islice(matches, chunksize)) if chunksize else list(matches)
+            if not chunk:
+                return
+            yield chunk
+
+
+    def clean_sources(self, sources, heroes, workers=1):
+        """
+        Cleans every chunk of every source and appends the results to the source's cleaned CSV files, in input order.
+        With workers > 1 the chunks are cleaned in a process pool, with at most two chunks per worker in flight so only
+        a bounded number of chunks is ever held in memory.
+
+        sources (list): (suffix, chunks) pairs, chunks being raw match dataframes or lists of (match_uid, match_players).
+        heroes (HeroDimension): The hero dimension.
+        workers (int): Number of processes cleaning chunks in parallel.
+        """
+        summaries = {}
+        tasks = ((suffix, index, chunk) for suffix, chunks in sources for index, chunk in enumerate(chunks))
+
+        # sources absorbed by the stats store in an earlier run are not counted twice
+        absorbed = set(self.stats.sources) if self.stats is not None else set()
+
+        def write(suffix, index, frames):
+            self.filename_suffix = suffix
+            with self.metrics.stage('write_outputs'):
+                self.write_outputs(frames[:3], append=index > 0)
+                self.write_quarantine(frames[4], append=index > 0)
+            if self.stats is not None and suffix not in absorbed:
+                with self.metrics.stage('update_stats'):
+                    self.stats.update(*frames[:3])
+            self.metrics.increment('cleaned_hero_rows', suffix, len(frames[0]))
+            for rule, count in frames[5].items():
+                self.metrics.increment('validation', rule, count)
+            summary = summaries.setdefault(suffix, {'suffix': suffix, 'matches': 0, 'hero_rows': 0, 'player_rows': 0, 'teams': 0, 'unknown_heroes': {}, 'quarantined': 0, 'rules': {}})
+            summary['matches'] += frames[0]['match_uid'].nunique()
+            summary['hero_rows'] += len(frames[0])
+            summary['player_rows'] += len(frames[1])
+            summary['teams'] += len(frames[2])
+            for hero_id, count in frames[3].items():
+                summary['unknown_heroes'][hero_id] = summary['unknown_heroes'].get(hero_id, 0) + count
+            summary['quarantined'] += len(frames[4])
+            for rule, count in frames[5].items():
+                summary['rules'][rule] = summary['rules'].get(rule, 0) + count
+            logger.info('Cleaned chunk %s of %s...', index + 1, suffix)
+
+        if workers <= 1:
+            for suffix, index, chunk in tasks:
+                with self.metrics.stage('clean_chunk'):
+                    frames = clean_chunk(chunk, heroes, self.validator)
+                write(suffix, index, frames)
+            return self.finish_sources(list(summaries.values()))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for suffix, index, chunk in tasks:
+                pending.append((suffix, index, executor.submit(clean_chunk, chunk, heroes, self.validator)))
+                if len(pending) >= workers * 2:
+                    suffix, index, future = pending.popleft()
+                    with self.metrics.stage('clean_wait'):
+                        frames = future.result()
+                    write(suffix, index, frames)
+            while pending:
+                suffix, index, future = pending.popleft()
+                with self.metrics.stage('clean_wait'):
+                    frames = future.result()
+                write(suffix, index, frames)
+
+        return self.finish_sources(list(summaries.values()))
+
+
+    def finish_sources(self, summaries):
+        """
+        Saves the stats store once every chunk of the sources is written and reports the unknown hero ids.
+        A source without a suffix (matches cleaned in memory without a filename) is counted but not remembered.
+        """
+        if self.stats is not None:
+            skipped = [summary['suffix'] for summary in summaries if summary['suffix'] in self.stats.sources]
+            if skipped:
+                logger.info('Already in the stats store, not counted again: %s', ", ".join(skipped))
+            self.stats.sources.update(summary['suffix'] for summary in summaries if summary['suffix'] is not None)
+            self.stats.save()
+        self.report_validation(summaries)
+        return self.report_unknown_heroes(summaries)
+
+
+    def load_heroes(self):
+        """
+        Returns the hero dimension, loading the one saved in the data folder (or building it from 'hero_info.csv') the first time.
+        """
+        if self.heroes is None:
+            self.heroes = HeroDimension(os.path.join(self.data_folder, 'hero_dimension.json')).load()
+        return self.heroes
+
+
+    def report_unknown_heroes(self, summaries):
+        """
+        Prints the hero ids that were missing from the hero dimension, their rows are not in the cleaned outputs.
+        """
+        for summary in summaries:
+            if summary['unknown_heroes']:
+                unknown = ', '.join(f'{hero_id} ({count} rows)' for hero_id, count in sorted(summary['unknown_heroes'].items()))
+                logger.warning('Unknown hero ids in %s, dropped: %s. Refresh the hero dimension (HeroDimension.refresh).', summary["suffix"], unknown)
+        return summaries
+
+
+    def report_validation(self, summaries):
+        """
+        Logs the failures per data quality rule and the number of quarantined matches of every input (see MatchValidator).
+        Rules that are not enabled are reported too, they were counted but did not drop anything.
+        """
+        for summary in summaries:
+            rules = summary.get('rules') or {}
+            failures = ', '.join(f"{rule}{'' if rule in self.validator.enabled else ' (off)'}: {count}" for rule, count in rules.items() if count)
+            if failures or summary.get('quarantined'):
+                logger.info('Validation of %s: %s matches quarantined, %s', summary['suffix'], summary.get('quarantined', 0), failures)
+        return summaries
+
+
+    def write_quarantine(self, quarantine_df, append=False):
+        """
+        Writes (or appends) the matches rejected by the validator to 'quarantined_matches_{suffix}.csv' and/or the
+        'quarantined_matches' table of the parquet store, one row per match with its reason codes.
+
+        quarantine_df (DataFrame): The rejected matches (match_uid, reasons, players, match_seconds).
+        append (bool): Append to the existing output instead of overwriting it.
+        """
+        if self.output_format in ['csv', 'both']:
+            quarantine_df.to_csv(os.path.join(self.data_folder, f'{self.quarantine_table}_{self.filename_suffix}.csv'), index=False, mode='a' if append else 'w', header=not append)
+
+        if self.output_format in ['parquet', 'both'] and len(quarantine_df):
+            season, collected = self.suffix_partition(self.filename_suffix)
+            self.store.write(self.quarantine_table, quarantine_df, self.filename_suffix, season=season, collected=collected, append=append)
+
+
+    def write_outputs(self, frames, append=False):
+        """
+        Writes (or appends) the per hero, per player and per team dataframes to the cleaned CSV files for self.filename_suffix.
 
-        pass
+        frames (tuple): The (combined_df, filtered_df, grouped_df) dataframes.
+        append (bool): Append to the existing files instead of overwriting them (the header is only written when not appending).
+        """
+        combined_df, filtered_df, grouped_df = frames
+        mode = 'a' if append else 'w'
+
+        if self.output_format in ['csv', 'both']:
+            # output the cleaned dataframe to a csv file
+            combined_df.to_csv(os.path.join(self.data_folder, f'cleaned_match_data_individual_stats_{self.filename_suffix}.csv'), index=False, mode=mode, header=not append)
+            filtered_df.to_csv(os.path.join(self.data_folder, f'cleaned_match_data_{self.filename_suffix}.csv'), index=False, mode=mode, header=not append)
+            grouped_df.to_csv(os.path.join(self.data_folder, f'cleaned_match_data_team_stats_{self.filename_suffix}.csv'), index=False, mode=mode, header=not append)
 
-    def clean(self, csv_file=None):
+        if self.output_format in ['parquet', 'both']:
+            season, collected = self.suffix_partition(self.filename_suffix)
+            for table, df in zip(self.output_tables, frames):
+                self.store.write(table, df, self.filename_suffix, season=season, collected=collected, append=append)
+
+
+    def load_outputs(self, table='match_data', suffix='*', season=None, columns=None, data_folder=None):
         """
-        Cleans the given dataframe by removing unnecessary columns and rows.
-        This method assumes you have the 'hero_info.csv' file in the same directory.
+        Loads cleaned outputs in the compact schema (see CompactSchema): match_uid split into integers, repeated text as
+        categoricals and downcast integers, about a third of the memory of a plain read_csv.
+        CSV files are read chunk by chunk, the parquet tables are read when output_format is 'parquet'.
 
-        csv_file (str): The path to the CSV file to be cleaned. Otherwise, it will load the most recent CSV file from the data folder.
+        table (str): 'individual_stats' (per hero), 'match_data' (per player) or 'team_stats' (per team).
+        suffix (str): Unique identifier of the run(s) to load, glob patterns allowed (optional, defaults to every run).
+        season (int): Only load this season's partition of the parquet store (optional).
+        columns (list): Only load these columns (optional).
+        data_folder (str): Folder of the cleaned CSV files (optional, defaults to self.data_folder).
 
         Returns:
-            csv file: The cleaned dataframe.
+            DataFrame: The outputs of every matching run, concatenated.
         """
-        # Load the CSV File
-        print('\n\nLoading CSV file...')
-        # Get the most recent CSV file from the data folder
-     
-        if csv_file is None:
-            data_folder = '../data'
-            csv_files = glob.glob(os.path.join(data_folder, 'match_data*.csv'))
-            if not csv_files:
-                raise FileNotFoundError("No CSV files with 'match_data' in the name found in the data folder.")
-            latest_csv_file = max(csv_files, key=os.path.getmtime)
-            print(f'Loading the most recent CSV file: {latest_csv_file}')
-            csv_file = latest_csv_file
+        tables = {'individual_stats': 'cleaned_individual_stats', 'match_data': 'cleaned_match_data', 'team_stats': 'cleaned_team_stats'}
+        if table not in tables:
+            raise ValueError(f"Invalid table. Use one of the following: {list(tables)}.")
 
-        # Extract the unique identifier from the file name
-        unique_identifier = os.path.basename(csv_file).split('match_data', 1)[1].lstrip('_').split('.')[0]
-        print(f'Extracted unique identifier: {unique_identifier}')
-        self.filename_suffix = unique_identifier
+        if self.output_format == 'parquet':
+            store = self.store if self.store is not None else ParquetStore(os.path.join(self.data_folder, 'parquet'))
+            return self.schema.compact(store.read(tables[table], columns=columns, season=season))
 
-        df = pd.read_csv(latest_csv_file)
-        hero_id = pd.read_csv('hero_info.csv')
+        data_folder = data_folder or self.data_folder
+        prefix = {'individual_stats': 'cleaned_match_data_individual_stats_', 'match_data': 'cleaned_match_data_', 'team_stats': 'cleaned_match_data_team_stats_'}[table]
+        csv_files = sorted(glob.glob(os.path.join(data_folder, f'{prefix}{suffix}.csv')))
+        if table == 'match_data':
+            csv_files = [f for f in csv_files if not os.path.basename(f).startswith(('cleaned_match_data_individual_stats_', 'cleaned_match_data_team_stats_'))]
+        if not csv_files:
+            raise FileNotFoundError(f"No cleaned {table} files matching {prefix}{suffix}.csv in {data_folder}.")
 
+        logger.info('Loading %s cleaned %s files...', len(csv_files), table)
+        return self.schema.concat(self.schema.read_csv(csv_file, usecols=columns) for csv_file in csv_files)
 
-        # Ensure the 'match_details.match_players' column is properly converted to a list of dictionaries
-        df['match_details.match_players'] = df['match_details.match_players'].apply(
-            lambda x: ast.literal_eval(x) if isinstance(x, str) else x
-        )
 
-        # Convert the 'match_details.match_players' column to a DataFrame
-        match_players_df = pd.json_normalize(df['match_details.match_players'].explode(), max_level=0)
+    def suffix_partition(self, suffix):
+        """
+        Returns the (season, collection date) partition of an output from its unique identifier, e.g.
+        '2_1306734986_2025-04-20' -> (2, '2025-04-20'). Missing parts fall back to None (season) and today (date).
+        """
+        season = re.match(r'^(\d+)_', suffix or '')
+        collected = re.search(r'\d{4}-\d{2}-\d{2}', suffix or '')
+        return (int(season.group(1)) if season else None), (collected.group(0) if collected else None)
 
-        # Add the match_uid to each player by repeating the 'match_details.match_uid' for each exploded row
-        match_players_df['match_uid'] = df.loc[df.index.repeat(df['match_details.match_players'].apply(len)), 'match_details.match_uid'].values
 
-        df_output = pd.DataFrame(columns=self.df_column_heads)
-        
-        df_output['match_uid'] = match_players_df['match_uid']
-        df_output['player_uid'] = match_players_df['player_uid']
-        df_output['name'] = match_players_df['nick_name']
-        df_output['hero_id']  = match_players_df['cur_hero_id']
-        df_output['is_win'] = match_players_df['is_win']
-        df_output['kills'] = match_players_df['kills']
-        df_output['deaths'] = match_players_df['deaths']
-        df_output['assists'] = match_players_df['assists']
-        df_output['hero_damage'] = match_players_df['total_hero_damage']
-        df_output['hero_healed'] = match_players_df['total_hero_heal']
-        df_output['damage_taken'] = match_players_df['total_damage_taken']
-        df_output['heroes'] = match_players_df['player_heroes']
-        df_output['is_win'] = df_output['is_win'].astype(int)
-        
-        hero_info_df = hero_id[self.hero_column_heads]
+    @staticmethod
+    def iter_dataframe_matches(df):
+        """
+        Yields (match_uid, match_players) for every row of a raw match dataframe.
+        The players are stored as python-repr strings in the CSV files, they are parsed here one match at a time.
+        It needs no cleaner state, so clean_chunk workers call it on the class.
 
-        # Explode the 'heroes' column to create individual rows for each hero
-        exploded_heroes = df_output['heroes'].explode()
+        df (DataFrame): One row per match, with the 'match_details.match_uid' and 'match_details.match_players' columns.
+        """
+        for match_uid, match_players in zip(df['match_details.match_uid'], df['match_details.match_players']):
+            if isinstance(match_players, str):
+                match_players = parse_repr(match_players)
+            yield match_uid, match_players
 
-        # Ensure the exploded data is a list of dictionaries
-        exploded_heroes = exploded_heroes.dropna().apply(
-            lambda x: ast.literal_eval(x) if isinstance(x, str) else x
-        )
 
-        # Normalize the exploded data
-        normalized_df = pd.json_normalize(exploded_heroes)
-        normalized_df = normalized_df.rename(columns={'play_time':'playtime.raw','session_hit_rate':'hit_rate'})
+    def iter_journal_matches(self, journal):
+        """
+        Yields (match_uid, match_players) for every 'match' record of a journal, the records are read lazily.
 
-        # Explode the 'heroes' column to create individual rows for each hero
-        exploded_heroes = df_output.explode('heroes').reset_index(drop=True)
+        journal (ResponseJournal | str): The journal, or the path to it.
+        """
+        if isinstance(journal, str):
+            journal = ResponseJournal(journal, mode='r')
 
-        # Ensure the exploded data is a list of dictionaries
-        exploded_heroes['heroes'] = exploded_heroes['heroes'].dropna().apply(
-            lambda x: ast.literal_eval(x) if isinstance(x, str) else x
-        )
+        for record in journal.read("match"):
+            match_details = record['response'].get('match_details', {})
+            yield match_details.get('match_uid'), match_details.get('match_players') or []
 
-        # Normalize the exploded data
-        normalized_heroes = pd.json_normalize(exploded_heroes['heroes'])
 
-        # Add the player_uid and match_uid columns back to the normalized data
-        normalized_heroes['player_uid'] = exploded_heroes['player_uid'].reset_index(drop=True)
-        normalized_heroes['match_uid'] = exploded_heroes['match_uid'].reset_index(drop=True)
-        normalized_heroes = normalized_heroes.rename(columns={'play_time':'playtime.raw','session_hit_rate':'hit_rate'}) 
-        normalized_heroes['playtime.raw'] = round(normalized_heroes['playtime.raw'])
+    def iter_parquet_matches(self, store, season=None, batch_size=1000):
+        """
+        Yields (match_uid, match_players) from the raw 'match_data' table of a parquet store, one record batch at a time.
+        The players are stored as native lists there, so nothing has to be parsed.
 
-        # Convert whole number value columns to integers
-        columns_to_convert = ['hero_id', 'playtime.raw','kills', 'deaths', 'assists', 'player_uid']
-        normalized_heroes[columns_to_convert] = normalized_heroes[columns_to_convert].astype('Int64')
+        store (ParquetStore): The parquet dataset.
+        season (int): Only read this season's partition (optional).
+        batch_size (int): Number of matches read at a time.
+        """
+        columns = ['match_details.match_uid', 'match_details.match_players']
+        for batch in store.iter_batches('match_data', columns=columns, season=season, batch_size=batch_size):
+            match_uids = batch.column(0).to_pylist()
+            match_players = batch.column(1).to_pylist()
+            for match_uid, players in zip(match_uids, match_players):
+                yield match_uid, players or []
 
-        # Merge exploded_df with hero_info_df on the hero_id column
-        merged_df = normalized_heroes.merge(hero_info_df[['id', 'attack_type', 'role']], left_on='hero_id', right_on='id', how='inner')
 
-        # Drop the redundant 'id' column after the merge
-        merged_df = merged_df.drop(columns=['id'])
+    def clean_dataframe(self, df):
+        """
+        Cleans a raw match dataframe (as loaded from a 'match_data_*.csv' file) and saves the cleaned CSV files.
 
-        # Edit the data and remove heros to make other processes later easier
-        merged_df['attack_type'] = merged_df['attack_type'].str.replace(' Heroes', '', regex=False)
+        df (DataFrame): One row per match, with the 'match_details.*' columns from the match endpoint.
+        """
+        return self.clean_matches(self.iter_dataframe_matches(df))
 
-        # Merge exploded_df with df on the appropriate columns
-        combined_df = merged_df.merge(df_output, on=['player_uid', 'match_uid'], how='inner')
 
-        # Drop columns if they exist
-        columns_to_drop = ['playtime.minutes', 'playtime.seconds', 'heroes', 'hero_icon']
-        combined_df = combined_df.drop(columns=[col for col in columns_to_drop if col in combined_df.columns])
-        
-        # Remove the null (0) enteries and round the playtime.raw value to the nearest whole number
-        combined_df = combined_df[combined_df['playtime.raw'] == round(combined_df['playtime.raw'])]
-        combined_df['playtime.raw'] = combined_df['playtime.raw'].astype('Int64')
-        combined_df = combined_df[combined_df['playtime.raw'] != 0] # these are leavers
-        
-        # now output the same data but without breaking it down by unique hero_id played by a player
-        filtered_df = combined_df[combined_df['hero_id_x'] == combined_df['hero_id_y']]     # this will be the original data row entery for the player
-        
-        # Group by match_uid and is_win
-        grouped_df = filtered_df.groupby(['match_uid', 'is_win']).agg(
-            num_vang=('role', lambda x: (x == 'VANGUARD').sum()),
-            num_strat=('role', lambda x: (x == 'STRATEGIST').sum()),
-            num_duel=('role', lambda x: (x == 'DUELIST').sum()),
-            players_on_team=('player_uid', 'count'),
-            avg_hitrate=('hit_rate', 'mean'),
-            num_melee=('attack_type', lambda x: (x == 'Melee').sum()),
-            num_hitscan=('attack_type', lambda x: (x == 'Hitscan').sum()),
-            num_projectile=('attack_type', lambda x: (x == 'Projectile').sum()),
-            total_damage=('hero_damage', 'sum'),
-            total_healing=('hero_healed', 'sum'),
-            total_damage_taken=('damage_taken', 'sum'),
-            total_deaths=('deaths_x', 'sum'),
-            total_assists=('assists_x', 'sum'),
-            total_kills=('kills_x', 'sum')
-        ).reset_index()
-
-        # Add primary_attack_type column
-        grouped_df['primary_attack_type'] = grouped_df[['num_melee', 'num_projectile', 'num_hitscan']].idxmax(axis=1).str.replace('num_', '')
-
-        # Identify match_uids where players_on_team is greater than 6
-        invalid_matches = grouped_df[grouped_df['players_on_team'] > 6]['match_uid'].unique()
-
-        # Remove entries with these match_uids
-        grouped_df = grouped_df[~grouped_df['match_uid'].isin(invalid_matches)]
-
-        #----------------------------------------------------------------------------------------
-        
-        # output the cleaned dataframe to a csv file
-        combined_df.to_csv(f'../data/cleaned_match_data_individual_stats_{self.filename_suffix}.csv', index=False)
-        filtered_df.to_csv(f'../data/cleaned_match_data_{self.filename_suffix}.csv', index=False)
-        grouped_df.to_csv(f'../data/cleaned_match_data_team_stats_{self.filename_suffix}.csv', index=False)
+    def clean_matches(self, matches):
+        """
+        Cleans raw matches in memory and saves the three cleaned CSV files (per hero, per player and per team).
+
+        matches (iterable): (match_uid, match_players) pairs, see iter_dataframe_matches and iter_journal_matches.
+
+        Returns:
+            tuple: The per hero, per player and per team dataframes.
+        """
+        frames = clean_chunk(matches, self.load_heroes(), self.validator)
+        unknown_heroes, quarantine, rules = frames[3:]
+        frames = frames[:3]
+        self.write_outputs(frames)
+        self.write_quarantine(quarantine)
+        if self.stats is not None and self.filename_suffix not in self.stats.sources:
+            self.stats.update(*frames)
+        self.finish_sources([{'suffix': self.filename_suffix, 'unknown_heroes': unknown_heroes, 'quarantined': len(quarantine), 'rules': rules}])
+
+        return frames
+
 
-        self.fix_file_headers
+    def aggregate_teams(self, filtered_df):
+        """
+        Aggregates the per player rows into one row per team (match_uid, is_win).
+        Matches with an oversized team are already quarantined by the validator.
+
+        filtered_df (DataFrame): The per player rows returned by MatchFlattener.flatten.
+
+        Returns:
+            DataFrame: The team stats.
+        """
+        return TeamAggregator().aggregate(filtered_df)
 
 
     def fix_file_headers(self):
@@ -563,7 +4368,7 @@ class DataCleaner:
         """
         # Load the CSV files
 
-        data_folder = '../data'
+        data_folder = self.data_folder
 
         cmdis_file = glob.glob(os.path.join(data_folder, 'cleaned_match_data_individual_stats*.csv'))
         cmdis_newest = max(cmdis_file, key=os.path.getmtime)
@@ -572,16 +4377,16 @@ class DataCleaner:
         cmdts_file = glob.glob(os.path.join(data_folder, 'cleaned_match_data_team_stats*.csv'))
         cmdts_newest = max(cmdts_file, key=os.path.getmtime)
         
-        print(f'Loading the most recent CSV files... {cmd_newest}')
+        logger.info('Loading the most recent CSV files... %s', cmd_newest)
         cmd_df = pd.read_csv(cmd_newest)
-        print(f'Loading the most recent CSV files... {cmdts_newest}')
+        logger.info('Loading the most recent CSV files... %s', cmdts_newest)
         cmdts_df = pd.read_csv(cmdts_newest)
-        print(f'Loading the most recent CSV files... {cmdis_newest}')
+        logger.info('Loading the most recent CSV files... %s', cmdis_newest)
         cmdis_df = pd.read_csv(cmdis_newest)
         
         
 
-        print('Removing suffixes...')
+        logger.info('Removing suffixes...')
         # remove the suffix from the columns if they exist
         cmdis_df.columns = cmdis_df.columns.str.replace('_x', '', regex=False)
         cmdis_df.columns = cmdis_df.columns.str.replace('_y', '', regex=False)
@@ -595,13 +4400,784 @@ class DataCleaner:
         # Drop all duplicate columns from the cleaned_match_data_individual_stats.csv file if it exists
         # e.g. hero_id_x, hero_id_y, deaths_x, deaths_y, etc.
         
-        print(f'Dropping duplicate columns...')
+        logger.info('Dropping duplicate columns...')
         cmdis_df = cmdis_df.loc[:, ~cmdis_df.columns.duplicated(keep='first')]
         cmd_df = cmd_df.loc[:, ~cmd_df.columns.duplicated(keep='last')]
         cmdts_df = cmdts_df.loc[:, ~cmdts_df.columns.duplicated(keep='last')]
 
-        print('Overwriting and saving CSVs...')
+        logger.info('Overwriting and saving CSVs...')
         # Overwrite the CSV files with the updated headers
         cmdis_df.to_csv(cmdis_newest, index=False)
         cmd_df.to_csv(cmd_newest, index=False)
-        cmdts_df.to_csv(cmdts_newest, index=False)
\ No newline at end of file
+        cmdts_df.to_csv(cmdts_newest, index=False)
+
+
+class DatasetCompactor:
+
+    """
+    Consolidates the per run outputs of DataCleaner into single, de-duplicated datasets for the analysis notebooks:
+        cleaned_match_data_individual_stats_*.csv -> individual_hero_stats_combined.csv  (one row per match_uid, player_uid, hero_id_x)
+        cleaned_match_data_*.csv                  -> output_cleaned_combined.csv         (one row per match_uid, player_uid)
+        cleaned_match_data_team_stats_*.csv       -> team_hero_stats_combined.csv        (one row per match_uid, is_win)
+
+    Compaction is incremental: a small JSON index records every source file already absorbed (with its size, mtime and
+    content hash), so each run only reads the files added or changed since the last one, and a file with the same content
+    as one already absorbed (e.g. a copied run) is skipped without being read. New rows are appended to the combined
+    files, only the key columns of the combined files are read to de-duplicate against, and the first copy of a key wins.
+
+    Files whose headers were rewritten by DataCleaner.fix_file_headers (no _x/_y suffixes) are mapped back to the
+    current column names: the per hero columns (kept 'first') become the _x columns, the per player columns (kept 'last')
+    become the _y columns.
+
+    Attributes:
+        data_folder (str): Folder holding the per run cleaned CSV files.
+        output_folder (str): Folder the combined files are written to.
+        index_path (str): Path of the JSON index of absorbed source files.
+        chunksize (int): Number of rows read at a time from a source file.
+        index (dict): The absorbed source files.
+
+    Methods:
+        compact(): Absorbs every new source file into the combined datasets and returns a summary.
+        load(output, columns=None): Loads a combined dataset in the compact schema (see CompactSchema).
+    """
+
+    hero_columns = [name for _, name in MatchFlattener.hero_fields] + ['player_uid', 'match_uid', 'attack_type', 'role'] + [name for _, name in MatchFlattener.player_fields]
+
+    outputs = {
+        'individual_stats': {
+            'pattern': 'cleaned_match_data_individual_stats_*.csv',
+            'output': 'individual_hero_stats_combined.csv',
+            'keys': ['match_uid', 'player_uid', 'hero_id_x'],
+            'columns': hero_columns,
+            'fixed_headers': 'first'
+        },
+        'match_data': {
+            'pattern': 'cleaned_match_data_*.csv',
+            'output': 'output_cleaned_combined.csv',
+            'keys': ['match_uid', 'player_uid'],
+            'columns': hero_columns,
+            'fixed_headers': 'last'
+        },
+        'team_stats': {
+            'pattern': 'cleaned_match_data_team_stats_*.csv',
+            'output': 'team_hero_stats_combined.csv',
+            'keys': ['match_uid', 'is_win'],
+            'columns': TeamAggregator.columns,
+            'fixed_headers': None
+        }
+    }
+
+    def __init__(self, data_folder=DATA_FOLDER, output_folder=None, index_path=None, chunksize=100000):
+        self.data_folder = data_folder
+        self.output_folder = output_folder or data_folder
+        self.index_path = index_path or os.path.join(self.output_folder, 'compaction_index.json')
+        self.chunksize = chunksize
+        self.index = {}
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+
+
+    def find_sources(self, output):
+        """
+        Returns the cleaned CSV files of one output kind, sorted by name.
+        'cleaned_match_data_*' also matches the individual/team stats files, those are excluded for the per player output.
+        """
+        pattern = self.outputs[output]['pattern']
+        files = sorted(glob.glob(os.path.join(self.data_folder, pattern)))
+        if output == 'match_data':
+            files = [f for f in files if not os.path.basename(f).startswith(('cleaned_match_data_individual_stats_', 'cleaned_match_data_team_stats_'))]
+        return files
+
+
+    def file_hash(self, path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+
+    def key_strings(self, df, keys):
+        """
+        Builds one string key per row from the key columns, numbers are normalized so 1023, 1023.0 and '1023' match.
+        """
+        parts = []
+        for key in keys:
+            if key == 'match_uid':
+                parts.append(df[key].astype(str))
+            else:
+                parts.append(pd.to_numeric(df[key], errors='coerce').round().astype('Int64').astype(str))
+        return parts[0].str.cat(parts[1:], sep='|') if len(parts) > 1 else parts[0]
+
+
+    def normalize(self, df, output):
+        """
+        Maps fix_file_headers style columns back to the current names and orders the columns like the combined file.
+        """
+        config = self.outputs[output]
+        if config['fixed_headers'] and 'hero_id_x' not in df.columns and 'hero_id' in df.columns:
+            suffix = '_x' if config['fixed_headers'] == 'first' else '_y'
+            df = df.rename(columns={column: f'{column}{suffix}' for column in ['kills', 'deaths', 'assists']})
+            df['hero_id_x'] = df['hero_id']
+            df['hero_id_y'] = df['hero_id']
+        return df.reindex(columns=config['columns'])
+
+
+    def compact(self):
+        """
+        Absorbs every new source file into the combined datasets.
+
+        Returns:
+            dict: Per output, the number of files absorbed and skipped and the number of rows added and dropped as duplicates.
+        """
+        summary = {}
+        os.makedirs(self.output_folder, exist_ok=True)
+        absorbed_hashes = {entry['sha1'] for entry in self.index.values()}
+
+        for output, config in self.outputs.items():
+            stats = summary.setdefault(output, {'files': 0, 'skipped': 0, 'rows_added': 0, 'duplicates': 0})
+            output_path = os.path.join(self.output_folder, config['output'])
+            seen = None
+
+            for path in self.find_sources(output):
+                name = os.path.basename(path)
+                entry = self.index.get(name)
+                size, mtime = os.path.getsize(path), os.path.getmtime(path)
+                if entry is not None and entry['size'] == size and entry['mtime'] == mtime:
+                    continue
+
+                sha1 = self.file_hash(path)
+                if sha1 in absorbed_hashes:
+                    logger.info('Skipping %s, same content as an absorbed file...', name)
+                    stats['skipped'] += 1
+                else:
+                    # only the key columns of the combined file are needed to de-duplicate
+                    if seen is None:
+                        seen = set()
+                        if os.path.exists(output_path):
+                            for chunk in pd.read_csv(output_path, usecols=config['keys'], chunksize=self.chunksize):
+                                seen.update(self.key_strings(chunk, config['keys']))
+
+                    logger.info('Absorbing %s into %s...', name, config["output"])
+                    for chunk in pd.read_csv(path, chunksize=self.chunksize):
+                        chunk = self.normalize(chunk, output)
+                        keys = self.key_strings(chunk, config['keys'])
+                        new_rows = ~keys.isin(seen) & ~keys.duplicated()
+                        seen.update(keys[new_rows])
+
+                        chunk[new_rows.to_numpy()].to_csv(output_path, index=False, mode='a', header=not os.path.exists(output_path))
+                        stats['rows_added'] += int(new_rows.sum())
+                        stats['duplicates'] += int((~new_rows).sum())
+                    stats['files'] += 1
+                    absorbed_hashes.add(sha1)
+
+                # record the file right away so an interrupted compaction does not absorb it again
+                self.index[name] = {'size': size, 'mtime': mtime, 'sha1': sha1, 'output': output}
+                self.save_index()
+
+        logger.info('Compaction finished: %s', summary)
+        return summary
+
+
+    def load(self, output, columns=None):
+        """
+        Loads a combined dataset in the compact schema (see CompactSchema), chunk by chunk.
+
+        output (str): 'individual_stats', 'match_data' or 'team_stats'.
+        columns (list): Only load these columns (optional).
+        """
+        path = os.path.join(self.output_folder, self.outputs[output]['output'])
+        return CompactSchema().read_csv(path, chunksize=self.chunksize, usecols=columns)
+
+
+    def save_index(self):
+        """
+        Writes the index of absorbed source files (through a temporary file so it is never half written).
+        """
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+
+
+class CompositionIndex:
+
+    """
+    A bitmap index over the (match, team) rows of the collected matches, for draft and team composition queries without
+    a groupby over the per hero tables. Match m of the index owns rows 2m (camp 0) and 2m + 1 (camp 1), and every
+    bitmap is a python int with one bit per row, so a query is a few bitwise ANDs and a popcount (int.bit_count).
+
+    Bitmaps (keys):
+        hero:{hero_id}: The team played the hero (any of its players, at any point of the match).
+        role:{role}:{n}: The team had exactly n players on the role (by the hero they ended the match on).
+        ban:{hero_id} / pick:{hero_id}: The team banned/picked the hero (match_details.dynamic_fields.ban_pick_info,
+            the battle_side of an entry is the camp).
+        mode:{game_mode_id}: The game mode of the match (both rows).
+        win: The team won.
+
+    The index is built from raw matches ('match_data_*.csv' files, a ResponseJournal or match responses) and grows
+    incrementally: new matches are appended batch by batch (one packbits per bitmap and batch), match_uids already in the
+    index are skipped and scan() only reads the 'match_data*.csv' files it has not seen yet.
+
+    Example, win rate of the teams running Rocket Raccoon with Punisher, and the matches where both teams ran triple strategist:
+        index = CompositionIndex().load()
+        index.scan()
+        index.win_rate(index.teams(heroes=[1023, 1014]))
+        index.match_uids(index.both_teams(index.teams(roles={'STRATEGIST': 3})))
+
+    Attributes:
+        path (str): Path of the JSON file holding the index (defaults to 'composition_index.json' in data_folder).
+        heroes (HeroDimension): Hero roles, for the role bitmaps (defaults to the dimension saved in data_folder).
+        data_folder (str): Folder of the 'match_data*.csv' files and of the index.
+        matches (list): The indexed match_uids, match m owns rows 2m and 2m + 1.
+        bitmaps (dict): key -> int bitmap.
+        scanned_files (set): The 'match_data*.csv' files already indexed.
+
+    Methods:
+        add_matches(matches): Appends match responses (or their match_details) to the index.
+        add_frame(df): Appends the matches of a raw match dataframe.
+        add_journal(journal): Appends the match records of a ResponseJournal.
+        scan(data_folder=None): Appends the matches of the 'match_data*.csv' files not indexed yet.
+        teams(heroes=(), roles=None, bans=(), picks=(), mode=None): Bitmap of the team rows matching every condition.
+        count(bitmap), win_rate(bitmap): Popcount and win rate of a bitmap.
+        opponents(bitmap), both_teams(bitmap): The opposing rows of a bitmap, and the rows whose opponents match as well.
+        co_occurrence(kind='hero', min_teams=1): Teams, wins and win rate of every pair of heroes (or bans/picks).
+        match_uids(bitmap), to_frame(bitmap): The (match_uid, camp) rows of a bitmap.
+        save(): Writes the index to disk.
+    """
+
+    def __init__(self, path=None, heroes=None, data_folder=DATA_FOLDER):
+        self.data_folder = data_folder
+        self.path = path if path is not None else os.path.join(data_folder, 'composition_index.json')
+        self.heroes = heroes
+        self.matches = []
+        self.match_positions = {}
+        self.bitmaps = {}
+        self.scanned_files = set()
+
+
+    def load(self):
+        """
+        Loads the saved index (if there is one) and returns self.
+        """
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                index = json.load(f)
+            self.matches = index['matches']
+            self.match_positions = {match_uid: position for position, match_uid in enumerate(self.matches)}
+            self.bitmaps = {key: int.from_bytes(base64.b64decode(value), 'little') for key, value in index['bitmaps'].items()}
+            self.scanned_files = set(index.get('scanned_files', []))
+        return self
+
+
+    @property
+    def rows(self):
+        return 2 * len(self.matches)
+
+
+    def bitmap(self, key):
+        """
+        Returns the bitmap of a key (0 when nothing has it).
+        """
+        return self.bitmaps.get(key, 0)
+
+
+    def add_matches(self, matches):
+        """
+        Appends matches to the index, the match_uids already indexed (or repeated in matches) are skipped.
+
+        matches (iterable): Match responses ({'match_details': {...}}) or their match_details dicts, with match_players
+            (and ban_pick_info) as lists or as the python-repr strings of the CSV files.
+
+        Returns:
+            int: The number of matches added.
+        """
+        if self.heroes is None:
+            self.heroes = HeroDimension(os.path.join(self.data_folder, 'hero_dimension.json')).load()
+
+        start = self.rows
+        rows = {}
+        player_heroes = []
+        added = 0
+        for match in matches:
+            details = match.get('match_details', match)
+            match_uid = details.get('match_uid')
+            if match_uid is None or match_uid in self.match_positions:
+                continue
+            self.match_positions[match_uid] = len(self.matches)
+            self.matches.append(match_uid)
+            row = 2 * (len(self.matches) - 1)
+            added += 1
+
+            game_mode_id = (details.get('game_mode') or {}).get('game_mode_id')
+            if game_mode_id is not None:
+                rows.setdefault(f'mode:{game_mode_id}', []).extend([row, row + 1])
+
+            players = details.get('match_players') or []
+            if isinstance(players, str):
+                players = parse_repr(players)
+            for player in players:
+                camp = player.get('camp')
+                if camp not in (0, 1):
+                    continue
+                team_row = row + camp
+                if player.get('is_win') == 1:
+                    rows.setdefault('win', []).append(team_row)
+                if player.get('cur_hero_id') is not None:
+                    player_heroes.append((team_row, player['cur_hero_id']))
+                for hero in player.get('player_heroes') or []:
+                    if hero.get('hero_id') is not None:
+                        rows.setdefault(f"hero:{hero['hero_id']}", []).append(team_row)
+
+            ban_pick_info = (details.get('dynamic_fields') or {}).get('ban_pick_info', details.get('ban_pick_info'))
+            if isinstance(ban_pick_info, str):
+                ban_pick_info = parse_repr(ban_pick_info)
+            for entry in ban_pick_info or []:
+                if entry.get('battle_side') in (0, 1) and entry.get('hero_id') is not None:
+                    kind = 'pick' if entry.get('is_pick') else 'ban'
+                    rows.setdefault(f"{kind}:{entry['hero_id']}", []).append(row + entry['battle_side'])
+
+        if not added:
+            return 0
+
+        # role counts per team from the heroes the players ended the match on
+        if player_heroes:
+            team_rows = np.array([team_row for team_row, _ in player_heroes], dtype=np.int64)
+            present, role_codes, _ = self.heroes.lookup(np.array([hero_id for _, hero_id in player_heroes], dtype=np.int64))
+            for code, role in enumerate(self.heroes.roles):
+                counts = np.bincount(team_rows[present & (role_codes == code)] - start, minlength=self.rows - start)
+                for n in np.unique(counts):
+                    rows.setdefault(f'role:{role}:{n}', []).extend((np.flatnonzero(counts == n) + start).tolist())
+
+        # hero:{id} is set once per player that played it, a set bit is a set bit
+        for key, key_rows in rows.items():
+            mask = np.zeros(self.rows - start, dtype=bool)
+            mask[np.asarray(key_rows, dtype=np.int64) - start] = True
+            bits = int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+            self.bitmaps[key] = self.bitmap(key) | (bits << start)
+
+        logger.info('Indexed %s matches, %s in the composition index...', added, len(self.matches))
+        return added
+
+
+    def add_frame(self, df):
+        """
+        Appends the matches of a raw match dataframe (the columns of a 'match_data_*.csv' file).
+        """
+        columns = {
+            'match_details.match_uid': 'match_uid',
+            'match_details.match_players': 'match_players',
+            'match_details.dynamic_fields.ban_pick_info': 'ban_pick_info',
+            'match_details.game_mode.game_mode_id': 'game_mode_id'
+        }
+        df = df[[column for column in columns if column in df.columns]].rename(columns=columns)
+        matches = []
+        for record in df.to_dict('records'):
+            if 'game_mode_id' in record:
+                game_mode_id = record.pop('game_mode_id')
+                record['game_mode'] = {'game_mode_id': None if pd.isna(game_mode_id) else int(game_mode_id)}
+            if not isinstance(record.get('ban_pick_info'), (str, list)):
+                record['ban_pick_info'] = None
+            matches.append(record)
+        return self.add_matches(matches)
+
+
+    def add_journal(self, journal):
+        """
+        Appends the 'match' records of a ResponseJournal (or the path to one).
+        """
+        if isinstance(journal, str):
+            journal = ResponseJournal(journal, mode='r')
+        return self.add_matches(record['response'] for record in journal.read("match"))
+
+
+    def scan(self, data_folder=None, chunksize=10000):
+        """
+        Appends the matches of every 'match_data*.csv' file of the data folder (defaults to self.data_folder) that was not indexed yet.
+
+        Returns:
+            int: The number of matches added.
+        """
+        data_folder = data_folder if data_folder is not None else self.data_folder
+        added = 0
+        columns = ['match_details.match_uid', 'match_details.match_players', 'match_details.dynamic_fields.ban_pick_info', 'match_details.game_mode.game_mode_id']
+        for csv_file in sorted(glob.glob(os.path.join(data_folder, 'match_data*.csv'))):
+            name = os.path.basename(csv_file)
+            if name in self.scanned_files:
+                continue
+            logger.info('Indexing %s...', name)
+            for chunk in pd.read_csv(csv_file, chunksize=chunksize, usecols=lambda column: column in columns):
+                added += self.add_frame(chunk)
+            self.scanned_files.add(name)
+        return added
+
+
+    def all_rows(self):
+        return (1 << self.rows) - 1
+
+
+    def even_rows(self):
+        # 0x55 = 01010101, the camp 0 row of every match
+        return int.from_bytes(b'\x55' * ((self.rows + 7) // 8), 'little') & self.all_rows()
+
+
+    def teams(self, heroes=(), roles=None, bans=(), picks=(), mode=None):
+        """
+        Returns the bitmap of the team rows matching every condition.
+
+        heroes (list): Hero ids the team played (optional).
+        roles (dict): Exact number of players per role, e.g. {'STRATEGIST': 3} (optional).
+        bans (list): Hero ids the team banned (optional).
+        picks (list): Hero ids the team picked (optional).
+        mode (int): Game mode id (optional).
+        """
+        bitmap = self.all_rows()
+        for hero_id in heroes:
+            bitmap &= self.bitmap(f'hero:{hero_id}')
+        for role, n in (roles or {}).items():
+            bitmap &= self.bitmap(f'role:{role}:{n}')
+        for hero_id in bans:
+            bitmap &= self.bitmap(f'ban:{hero_id}')
+        for hero_id in picks:
+            bitmap &= self.bitmap(f'pick:{hero_id}')
+        if mode is not None:
+            bitmap &= self.bitmap(f'mode:{mode}')
+        return bitmap
+
+
+    def count(self, bitmap):
+        return bitmap.bit_count()
+
+
+    def win_rate(self, bitmap):
+        """
+        Returns the win rate of the team rows of a bitmap (NaN for an empty bitmap).
+        """
+        teams = bitmap.bit_count()
+        return (bitmap & self.bitmap('win')).bit_count() / teams if teams else np.nan
+
+
+    def opponents(self, bitmap):
+        """
+        Returns the rows of the teams facing the rows of a bitmap, e.g. the win rate of X against Y is
+        win_rate(teams(heroes=[X]) & opponents(teams(heroes=[Y]))).
+        """
+        even = self.even_rows()
+        return ((bitmap & even) << 1) | ((bitmap >> 1) & even)
+
+
+    def both_teams(self, bitmap):
+        """
+        Returns the rows of a bitmap whose opponents are in the bitmap as well (both rows of every such match).
+        """
+        return bitmap & self.opponents(bitmap)
+
+
+    def row_bits(self, bitmap):
+        """
+        Unpacks a bitmap into one 0/1 value per row.
+        """
+        data = np.frombuffer(bitmap.to_bytes((self.rows + 7) // 8, 'little'), dtype=np.uint8)
+        return np.unpackbits(data, bitorder='little')[:self.rows]
+
+
+    def row_ids(self, bitmap):
+        return np.flatnonzero(self.row_bits(bitmap))
+
+
+    def match_uids(self, bitmap):
+        """
+        Returns the match_uids with at least one row in the bitmap, in index order.
+        """
+        return [self.matches[match] for match in np.unique(self.row_ids(bitmap) // 2)]
+
+
+    def to_frame(self, bitmap):
+        """
+        Returns the rows of a bitmap as a dataframe of (match_uid, camp, is_win).
+        """
+        rows = self.row_ids(bitmap)
+        return pd.DataFrame({
+            'match_uid': np.asarray(self.matches, dtype=object)[rows // 2],
+            'camp': rows % 2,
+            'is_win': self.row_bits(self.bitmap('win'))[rows].astype(np.int64)
+        })
+
+
+    def co_occurrence(self, kind='hero', min_teams=1):
+        """
+        Returns the number of teams, wins and the win rate of every pair of keys of a kind ('hero', 'ban' or 'pick'),
+        e.g. the best hero duos. Pairs with fewer than min_teams teams are left out.
+        """
+        wins = self.bitmap('win')
+        # indexes built before missing hero ids were skipped can still hold e.g. 'hero:None', those keys are left out
+        ids = {}
+        for key in self.bitmaps:
+            prefix, _, value = key.partition(':')
+            if prefix == kind and value.lstrip('-').isdigit():
+                ids[key] = int(value)
+        keys = sorted(ids, key=ids.get)
+        pairs = []
+        for position, key_a in enumerate(keys):
+            bitmap_a = self.bitmaps[key_a]
+            for key_b in keys[position + 1:]:
+                both = bitmap_a & self.bitmaps[key_b]
+                teams = both.bit_count()
+                if teams >= min_teams:
+                    won = (both & wins).bit_count()
+                    pairs.append((ids[key_a], ids[key_b], teams, won, won / teams))
+        return pd.DataFrame(pairs, columns=[f'{kind}_a', f'{kind}_b', 'teams', 'wins', 'win_rate'])
+
+
+    def save(self):
+        """
+        Writes the index to disk (bitmaps as base64 little endian bytes), through a temporary file.
+        """
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        size = (self.rows + 7) // 8
+        index = {
+            'matches': self.matches,
+            'scanned_files': sorted(self.scanned_files),
+            'bitmaps': {key: base64.b64encode(bitmap.to_bytes(size, 'little')).decode('ascii') for key, bitmap in self.bitmaps.items()}
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.path)
+
+# design matrix and splits of a ModelEvaluator, set once per process pool worker by init_evaluation_worker
+evaluation_data = {}
+
+
+def init_evaluation_worker(X, y, splits):
+    """
+    Process pool initializer of ModelEvaluator.evaluate: the design matrix is sent to each worker once, not with every task.
+    """
+    evaluation_data.update(X=X, y=y, splits=splits)
+
+
+def evaluate_subsets(tasks):
+    """
+    Fits and scores a batch of (model name, (module, class name, params), column indices) tasks on the worker's design matrix.
+    Regressors are scored with r2/mse and with the accuracy of their predictions rounded at 0.5, classifiers with accuracy.
+    With several splits the scores and the coefficients/importances are averaged over the splits.
+
+    Returns:
+        list: One dict per task with the model, the column indices, the scores, the weights and the fit time.
+    """
+    import importlib
+    from sklearn.base import is_classifier
+
+    X, y, splits = evaluation_data['X'], evaluation_data['y'], evaluation_data['splits']
+    results = []
+    for model_name, (module, class_name, params), columns in tasks:
+        model_class = getattr(importlib.import_module(module), class_name)
+        columns = list(columns)
+        scores = {'accuracy': [], 'r2': [], 'mse': []}
+        weights = []
+
+        start = time.perf_counter()
+        for train, test in splits:
+            model = model_class(**params).fit(X[np.ix_(train, columns)], y[train])
+            predicted = model.predict(X[np.ix_(test, columns)])
+            actual = y[test]
+
+            if is_classifier(model):
+                scores['accuracy'].append(np.mean(predicted == actual))
+            else:
+                residual = np.sum((actual - predicted) ** 2)
+                total = np.sum((actual - actual.mean()) ** 2)
+                scores['r2'].append(1 - residual / total if total else np.nan)
+                scores['mse'].append(residual / len(actual))
+                scores['accuracy'].append(np.mean((predicted >= 0.5) == actual))
+
+            if hasattr(model, 'coef_'):
+                weights.append(np.ravel(model.coef_)[-len(columns):])
+            elif hasattr(model, 'feature_importances_'):
+                weights.append(model.feature_importances_)
+
+        results.append({
+            'model': model_name,
+            'columns': columns,
+            'accuracy': np.mean(scores['accuracy']),
+            'r2': np.mean(scores['r2']) if scores['r2'] else np.nan,
+            'mse': np.mean(scores['mse']) if scores['mse'] else np.nan,
+            'weights': np.mean(weights, axis=0) if weights else None,
+            'fit_seconds': time.perf_counter() - start
+        })
+    return results
+
+
+class ModelEvaluator:
+
+    """
+    Evaluates many feature subsets and model types on one cleaned table in a single batched run, i.e. the
+    train_test_split + fit + score cells of analysis_1 (LinearRegression) and analysis_3 (RandomForestClassifier).
+    The design matrix (float64, text columns label encoded like LabelEncoder) and the train/test splits are built once.
+    Each process pool worker receives them once and then only gets batches of (model, feature subset) tasks, so hundreds
+    of subsets cost one fit each, spread over the cores. The holdout split is the notebooks' train_test_split with the
+    same test_size and random_state, so a subset scores exactly like its notebook cell.
+
+    The result is one comparison table: one row per model and subset with its scores and the coefficient (linear models)
+    or importance (forests) of every feature in the subset.
+
+    Needs scikit-learn ('pip install scikit-learn').
+
+    Attributes:
+        features (list): The columns of the design matrix (by default every numeric column except the target and id_columns).
+        target (str): The target column (is_win by default).
+        X (ndarray): The design matrix, one row per sample.
+        y (ndarray): The target.
+        splits (list): (train indices, test indices) pairs, one holdout split or the folds of a KFold.
+        models (dict): The model types by name: (module, class name, params). Others can be added, e.g.
+            evaluator.models['ridge'] = ('sklearn.linear_model', 'Ridge', {'alpha': 1.0}).
+
+    Methods:
+        from_table(table, data_folder=DATA_FOLDER, features=None, **kwargs): Builds the evaluator from a combined table of DatasetCompactor.
+        subsets(features=None, min_size=1, max_size=None): Every combination of the features, as subsets to evaluate.
+        evaluate(subsets=None, models=('linear',), workers=None, batch_size=None): Fits every model on every subset and returns the comparison table.
+    """
+
+    models = {
+        'linear': ('sklearn.linear_model', 'LinearRegression', {}),
+        'logistic': ('sklearn.linear_model', 'LogisticRegression', {'max_iter': 1000, 'solver': 'newton-cholesky'}),  # unscaled features, a second order solver converges
+        'random_forest': ('sklearn.ensemble', 'RandomForestClassifier', {'random_state': 42, 'n_jobs': 1})
+    }
+
+    # the features used in the analysis notebooks, per combined table of DatasetCompactor
+    feature_sets = {
+        'match_data': ['kills_x', 'deaths_x', 'assists_x', 'hero_damage', 'hero_healed', 'damage_taken', 'attack_type', 'role'],
+        'individual_stats': ['kills_x', 'deaths_x', 'assists_x', 'hit_rate', 'playtime.raw', 'hero_damage', 'hero_healed', 'damage_taken', 'attack_type', 'role'],
+        'team_stats': ['total_kills', 'total_assists', 'total_deaths', 'total_damage', 'total_healing', 'total_damage_taken',
+                       'num_vang', 'num_duel', 'num_strat', 'avg_hitrate', 'primary_attack_type']
+    }
+
+    # identity columns (and the integer parts of a compact match_uid) are never default features, they would leak the match
+    id_columns = ['match_uid', 'player_uid', 'hero_id', 'hero_id_x', 'hero_id_y', 'cur_hero_id'] + CompactSchema.match_uid_parts
+
+    def __init__(self, df, features=None, target='is_win', test_size=0.2, random_state=42, folds=None):
+        try:
+            from sklearn.model_selection import KFold, train_test_split
+        except ImportError as e:
+            raise ImportError("The model evaluation needs scikit-learn, install it with 'pip install scikit-learn'.") from e
+
+        self.models = dict(self.models)
+        self.target = target
+        if features is None:
+            features = [column for column in df.select_dtypes('number').columns
+                        if column != target and column not in self.id_columns and not column.endswith('_uid')]
+        self.features = list(features)
+
+        data = df[self.features + [target]].copy()
+        for column in self.features:
+            if not pd.api.types.is_numeric_dtype(data[column]):
+                # sorted categories give the same codes as LabelEncoder
+                data[column] = pd.Categorical(data[column], categories=sorted(data[column].dropna().unique())).codes
+                data[column] = data[column].where(data[column] >= 0)
+
+        data = data.apply(pd.to_numeric, errors='coerce').astype('float64')
+        complete = data.notna().all(axis=1)
+        if not complete.all():
+            logger.info('Dropping %s rows with missing values out of %s...', int((~complete).sum()), len(data))
+            data = data[complete]
+
+        self.X = np.ascontiguousarray(data[self.features].to_numpy())
+        self.y = data[target].to_numpy()
+
+        indices = np.arange(len(self.y))
+        if folds:
+            self.splits = list(KFold(n_splits=folds, shuffle=True, random_state=random_state).split(indices))
+        else:
+            self.splits = [tuple(train_test_split(indices, test_size=test_size, random_state=random_state))]
+
+
+    @classmethod
+    def from_table(cls, table, data_folder=DATA_FOLDER, features=None, **kwargs):
+        """
+        Builds the evaluator from one of the combined tables of DatasetCompactor, only the needed columns are read.
+
+        table (str): 'match_data' (per player, output_cleaned_combined.csv), 'individual_stats' (per hero) or 'team_stats' (per team).
+        data_folder (str): Folder holding the combined tables.
+        features (list): The feature columns (optional, defaults to the notebook features of the table, see feature_sets).
+        kwargs: Passed on to ModelEvaluator (target, test_size, random_state, folds).
+        """
+        features = list(features) if features is not None else cls.feature_sets[table]
+        target = kwargs.get('target', 'is_win')
+        df = DatasetCompactor(data_folder).load(table, columns=features + [target])
+        logger.info('Loaded %s rows of %s...', len(df), table)
+        return cls(df, features=features, **kwargs)
+
+
+    def subsets(self, features=None, min_size=1, max_size=None):
+        """
+        Returns every combination of the features with min_size to max_size features (2^n - 1 subsets for all of them).
+
+        features (list): The features to combine (optional, defaults to every feature).
+        min_size (int): The smallest subset size.
+        max_size (int): The largest subset size (optional, defaults to all the features).
+        """
+        features = list(features) if features is not None else self.features
+        max_size = max_size or len(features)
+        return [subset for size in range(min_size, max_size + 1) for subset in itertools.combinations(features, size)]
+
+
+    def evaluate(self, subsets=None, models=('linear',), workers=None, batch_size=None):
+        """
+        Fits every model type on every feature subset and returns the comparison table.
+        With workers > 1 the tasks run on a process pool in batches of batch_size, otherwise in this process.
+
+        subsets (list): The feature subsets, lists of column names (optional, defaults to all the features as one subset).
+        models (list): The model type names, see models (optional, defaults to 'linear').
+        workers (int): Number of processes (optional, defaults to the number of cores).
+        batch_size (int): Tasks sent to a worker at a time (optional, defaults to about 4 batches per worker).
+
+        Returns:
+            DataFrame: One row per model and subset: model, features, n_features, accuracy, r2, mse (regressors only),
+            fit_seconds and a 'coef_{feature}' column per feature (coefficient or importance, NaN when not in the subset),
+            sorted by accuracy.
+        """
+        subsets = [list(subset) for subset in (subsets if subsets is not None else [self.features])]
+        position = {feature: index for index, feature in enumerate(self.features)}
+        for subset in subsets:
+            missing = [feature for feature in subset if feature not in position]
+            if missing:
+                raise ValueError(f"Unknown features {missing}, the design matrix has: {self.features}.")
+
+        tasks = [(model, self.models[model], tuple(position[feature] for feature in subset)) for model in models for subset in subsets]
+        workers = workers or os.cpu_count() or 1
+        workers = max(min(workers, len(tasks)), 1)
+        batch_size = batch_size or max(len(tasks) // (workers * 4), 1)
+        batches = [tasks[start:start + batch_size] for start in range(0, len(tasks), batch_size)]
+
+        logger.info('Evaluating %s model/subset pairs on %s rows with %s workers...', len(tasks), len(self.y), workers)
+        if workers <= 1:
+            init_evaluation_worker(self.X, self.y, self.splits)
+            results = [result for batch in batches for result in evaluate_subsets(batch)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_evaluation_worker, initargs=(self.X, self.y, self.splits)) as executor:
+                results = [result for batch_results in executor.map(evaluate_subsets, batches) for result in batch_results]
+
+        rows = []
+        for result in results:
+            names = [self.features[column] for column in result['columns']]
+            row = {
+                'model': result['model'],
+                'features': ', '.join(names),
+                'n_features': len(names),
+                'accuracy': result['accuracy'],
+                'r2': result['r2'],
+                'mse': result['mse'],
+                'fit_seconds': result['fit_seconds']
+            }
+            if result['weights'] is not None:
+                row.update({f'coef_{name}': weight for name, weight in zip(names, result['weights'])})
+            rows.append(row)
+
+        columns = ['model', 'features', 'n_features', 'accuracy', 'r2', 'mse', 'fit_seconds'] + [f'coef_{feature}' for feature in self.features]
+        table = pd.DataFrame(rows).reindex(columns=columns)
+        return table.sort_values('accuracy', ascending=False, kind='stable').reset_index(drop=True)
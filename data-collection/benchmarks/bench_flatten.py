@@ -0,0 +1,135 @@
+"""
+Benchmark for the DataCleaner flattening step.
+
+Compares the previous explode/json_normalize/merge path (kept here as legacy_flatten) with MatchFlattener on the same
+synthetic input: the sample 'match_data.csv' rows repeated with new match_uids until the requested number of matches.
+Both paths start from the raw CSV dataframe (python-repr strings), and their outputs are checked to be identical.
+
+Usage (from the data-collection folder):
+    python benchmarks/bench_flatten.py --matches 1000 5000 --repeat 3
+"""
+import argparse
+import ast
+import os
+import sys
+import time
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from MRAPI import DataCleaner, MatchFlattener, MatchValidator  # noqa: E402
+
+SAMPLE_MATCHES = os.path.join(HERE, '..', '..', 'data', 'match_data.csv')
+HERO_INFO = os.path.join(HERE, '..', 'hero_info.csv')
+
+
+def synthetic_matches(n_matches):
+    """
+    Repeats the sample matches with new (unique) match_uids until there are n_matches rows.
+    """
+    sample = pd.read_csv(SAMPLE_MATCHES)
+    repeats = -(-n_matches // len(sample))
+    df = pd.concat([sample] * repeats, ignore_index=True).iloc[:n_matches].copy()
+    df['match_details.match_uid'] = [f'{uid}_{i}' for i, uid in enumerate(df['match_details.match_uid'])]
+    return df
+
+
+def legacy_flatten(df, hero_info_df):
+    """
+    The previous DataCleaner.clean flattening path, kept as the reference for the benchmark and the output check.
+    """
+    df = df.copy()
+    df['match_details.match_players'] = df['match_details.match_players'].apply(
+        lambda x: ast.literal_eval(x) if isinstance(x, str) else x
+    )
+    match_players_df = pd.json_normalize(df['match_details.match_players'].explode(), max_level=0)
+    match_players_df['match_uid'] = df.loc[df.index.repeat(df['match_details.match_players'].apply(len)), 'match_details.match_uid'].values
+
+    df_output = pd.DataFrame()
+    df_output['match_uid'] = match_players_df['match_uid']
+    df_output['player_uid'] = match_players_df['player_uid']
+    df_output['name'] = match_players_df['nick_name']
+    df_output['hero_id'] = match_players_df['cur_hero_id']
+    df_output['is_win'] = match_players_df['is_win'].astype(int)
+    df_output['kills'] = match_players_df['kills']
+    df_output['deaths'] = match_players_df['deaths']
+    df_output['assists'] = match_players_df['assists']
+    df_output['hero_damage'] = match_players_df['total_hero_damage']
+    df_output['hero_healed'] = match_players_df['total_hero_heal']
+    df_output['damage_taken'] = match_players_df['total_damage_taken']
+    df_output['heroes'] = match_players_df['player_heroes']
+
+    # the legacy path normalized the heroes twice, the first result was never used
+    exploded_heroes = df_output['heroes'].explode()
+    exploded_heroes = exploded_heroes.dropna().apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
+    normalized_df = pd.json_normalize(exploded_heroes)  # noqa: F841
+
+    exploded_heroes = df_output.explode('heroes').reset_index(drop=True)
+    exploded_heroes['heroes'] = exploded_heroes['heroes'].dropna().apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
+    normalized_heroes = pd.json_normalize(exploded_heroes['heroes'])
+    normalized_heroes['player_uid'] = exploded_heroes['player_uid'].reset_index(drop=True)
+    normalized_heroes['match_uid'] = exploded_heroes['match_uid'].reset_index(drop=True)
+    normalized_heroes = normalized_heroes.rename(columns={'play_time': 'playtime.raw', 'session_hit_rate': 'hit_rate'})
+    normalized_heroes['playtime.raw'] = round(normalized_heroes['playtime.raw'])
+    columns_to_convert = ['hero_id', 'playtime.raw', 'kills', 'deaths', 'assists', 'player_uid']
+    normalized_heroes[columns_to_convert] = normalized_heroes[columns_to_convert].astype('Int64')
+
+    merged_df = normalized_heroes.merge(hero_info_df[['id', 'attack_type', 'role']], left_on='hero_id', right_on='id', how='inner')
+    merged_df = merged_df.drop(columns=['id'])
+    merged_df['attack_type'] = merged_df['attack_type'].str.replace(' Heroes', '', regex=False)
+    combined_df = merged_df.merge(df_output, on=['player_uid', 'match_uid'], how='inner')
+
+    columns_to_drop = ['playtime.minutes', 'playtime.seconds', 'heroes', 'hero_icon']
+    combined_df = combined_df.drop(columns=[col for col in columns_to_drop if col in combined_df.columns])
+    combined_df = combined_df[combined_df['playtime.raw'] == round(combined_df['playtime.raw'])]
+    combined_df['playtime.raw'] = combined_df['playtime.raw'].astype('Int64')
+    combined_df = combined_df[combined_df['playtime.raw'] != 0]
+    filtered_df = combined_df[combined_df['hero_id_x'] == combined_df['hero_id_y']]
+    return combined_df, filtered_df
+
+
+def new_flatten(df, hero_info_df):
+    # the legacy path had no match level rules, oversized teams were only dropped from the team stats
+    return MatchFlattener(hero_info_df, MatchValidator(disable=['oversized_team'])).flatten(DataCleaner.iter_dataframe_matches(df))
+
+
+def check_same(legacy, new):
+    for legacy_df, new_df in zip(legacy, new):
+        # the hero dict key order decides the legacy column order, compare on the new (fixed) order
+        pd.testing.assert_frame_equal(
+            legacy_df[new_df.columns].reset_index(drop=True),
+            new_df.reset_index(drop=True),
+            check_dtype=False
+        )
+
+
+def best_time(func, args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--matches', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    hero_info_df = pd.read_csv(HERO_INFO)[['id', 'name', 'attack_type', 'role']]
+
+    print(f"{'matches':>8} {'hero rows':>10} {'legacy (s)':>11} {'single pass (s)':>16} {'speedup':>8}")
+    for n_matches in args.matches:
+        df = synthetic_matches(n_matches)
+        legacy_time, legacy = best_time(legacy_flatten, (df, hero_info_df), args.repeat)
+        new_time, new = best_time(new_flatten, (df, hero_info_df), args.repeat)
+        check_same(legacy, new)
+        print(f'{n_matches:>8} {len(new[0]):>10} {legacy_time:>11.3f} {new_time:>16.3f} {legacy_time / new_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
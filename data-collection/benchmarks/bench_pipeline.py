@@ -0,0 +1,198 @@
+"""
+End-to-end benchmark of the collector and the cleaner against the local MRAPI stand-in (see mock_mrapi.py).
+
+collect: MRAPIClient.get_total_data for one player whose history holds --matches synthetic matches, once per --workers
+         value, reporting wall time, requests/sec and the request latency percentiles from the client metrics.
+clean:   DataCleaner.clean on a synthetic raw 'match_data_*.csv' of each --sizes number of matches, each in a fresh
+         process, reporting wall time, matches/sec, cleaned rows/sec and the peak memory (RSS high water mark above
+         the baseline after imports).
+
+Everything runs in a temporary folder. With --json the results are saved, and with --baseline they are compared to a
+previous results file: any throughput more than --tolerance below the baseline is reported and the exit code is 1.
+
+Usage (from the data-collection folder):
+    python benchmarks/bench_pipeline.py --matches 500 --workers 1 8 --latency 0.02 --sizes 1000 10000 100000
+    python benchmarks/bench_pipeline.py --only clean --sizes 1000 --json results.json --baseline previous.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from mock_mrapi import HERO_INFO, Fixtures, MockMRAPI  # noqa: E402
+from MRAPI import DataCleaner, MRAPIClient  # noqa: E402
+
+
+def max_rss_mb():
+    """
+    Peak resident memory of this process in MB (ru_maxrss is KB on linux and bytes on macOS).
+    """
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_workdir(root):
+    """
+    Creates the 'dc' (working directory) and 'data' folders, the client and the cleaner are given the 'data' folder.
+    """
+    workdir = os.path.join(root, 'dc')
+    os.makedirs(workdir, exist_ok=True)
+    os.makedirs(os.path.join(root, 'data'), exist_ok=True)
+    shutil.copy(HERO_INFO, workdir)
+    return workdir
+
+
+def bench_collect(args, fixtures, root):
+    results = []
+    for workers in args.workers:
+        workdir = make_workdir(os.path.join(root, f'collect_{workers}'))
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with MockMRAPI(fixtures=fixtures, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, rate_limit=args.rate_limit, page_size=args.page_size) as api:
+                client = MRAPIClient('bench', max_workers=workers, data_folder=os.path.join(workdir, '..', 'data'))
+                client.base_url = api.base_url
+                client.set_request_uid(api.player_uid)
+
+                error = None
+                start = time.perf_counter()
+                try:
+                    client.get_total_data()
+                except Exception as e:
+                    error = str(e)[:80]
+                seconds = time.perf_counter() - start
+                latency = client.metrics.summary()['histograms'].get('latency_ms', {}).get('match', {})
+        finally:
+            os.chdir(cwd)
+
+        results.append({
+            'kind': 'collect',
+            'key': f'workers={workers}',
+            'matches': args.matches,
+            'requests': client.request_count,
+            'seconds': round(seconds, 3),
+            'requests_per_sec': round(client.request_count / seconds, 1),
+            'p50_ms': latency.get('p50'),
+            'p95_ms': latency.get('p95'),
+            'server': api.stats(),
+            'error': error
+        })
+    return results
+
+
+def run_clean(workdir, csv_path, chunksize, workers):
+    """
+    Runs DataCleaner.clean in this (fresh) process and returns the timings and memory.
+    """
+    os.chdir(workdir)
+    baseline = max_rss_mb()
+    start = time.perf_counter()
+    # the outputs and the hero dimension go to the temporary data folder, not to the checkout's data/
+    summaries = DataCleaner(data_folder=os.path.join(workdir, '..', 'data')).clean(csv_path, chunksize=chunksize, workers=workers)
+    seconds = time.perf_counter() - start
+    return seconds, summaries, baseline, max_rss_mb()
+
+
+def bench_clean(args, fixtures, root):
+    results = []
+    workdir = make_workdir(os.path.join(root, 'clean'))
+    for size in args.sizes:
+        csv_path = os.path.join(root, 'clean', 'data', f'match_data_bench_{size}.csv')
+        fixtures.write_match_csv(csv_path, size)
+
+        # a fresh process per size so the memory high water mark belongs to this run only
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            seconds, summaries, baseline, peak = executor.submit(run_clean, workdir, csv_path, args.chunksize, args.clean_workers).result()
+
+        hero_rows = sum(summary['hero_rows'] for summary in summaries)
+        results.append({
+            'kind': 'clean',
+            'key': f'matches={size}',
+            'matches': size,
+            'hero_rows': hero_rows,
+            'seconds': round(seconds, 3),
+            'matches_per_sec': round(size / seconds, 1),
+            'rows_per_sec': round(hero_rows / seconds, 1),
+            'peak_memory_mb': round(peak - baseline, 1),
+            'csv_mb': round(os.path.getsize(csv_path) / 1024 / 1024, 1)
+        })
+        os.remove(csv_path)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the results whose throughput dropped more than tolerance below the baseline results.
+    """
+    previous = {(result['kind'], result['key']): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result['kind'], result['key']))
+        metric = 'requests_per_sec' if result['kind'] == 'collect' else 'rows_per_sec'
+        if old and old.get(metric) and result.get(metric) is not None and result[metric] < old[metric] * (1 - tolerance):
+            regressions.append(f"{result['kind']} {result['key']}: {metric} {old[metric]} -> {result[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', choices=['collect', 'clean'], help='Only run one of the benchmarks.')
+    parser.add_argument('--matches', type=int, default=500, help='Matches in the player history for the collect benchmark.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8], help='max_workers values for the collect benchmark.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds of latency added by the stand-in server.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra seconds of latency.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 500.')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Fraction of requests answered with a 429.')
+    parser.add_argument('--page-size', type=int, default=20, help='Match-history page size of the stand-in server.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of matches for the clean benchmark.')
+    parser.add_argument('--chunksize', type=int, default=5000, help='DataCleaner.clean chunksize.')
+    parser.add_argument('--clean-workers', type=int, default=1, help='DataCleaner.clean workers.')
+    parser.add_argument('--json', help='Save the results to this file.')
+    parser.add_argument('--baseline', help='Compare with the results saved by a previous run.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed throughput drop against the baseline (0.2 = 20%%).')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        if args.only in (None, 'collect'):
+            results += bench_collect(args, Fixtures(args.matches), root)
+        if args.only in (None, 'clean'):
+            results += bench_clean(args, Fixtures(max(args.sizes)), root)
+
+    collect = [result for result in results if result['kind'] == 'collect']
+    if collect:
+        print(f"{'collect':>16} {'requests':>9} {'wall (s)':>9} {'req/s':>8} {'p50 ms':>7} {'p95 ms':>7}")
+        for result in collect:
+            print(f"{result['key']:>16} {result['requests']:>9} {result['seconds']:>9.3f} {result['requests_per_sec']:>8.1f} {result['p50_ms'] or '-':>7} {result['p95_ms'] or '-':>7}" + (f"  failed: {result['error']}" if result['error'] else ''))
+
+    clean = [result for result in results if result['kind'] == 'clean']
+    if clean:
+        print(f"{'clean':>16} {'hero rows':>9} {'wall (s)':>9} {'matches/s':>10} {'rows/s':>10} {'peak MB':>8} {'csv MB':>7}")
+        for result in clean:
+            print(f"{result['key']:>16} {result['hero_rows']:>9} {result['seconds']:>9.3f} {result['matches_per_sec']:>10.1f} {result['rows_per_sec']:>10.1f} {result['peak_memory_mb']:>8.1f} {result['csv_mb']:>7.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
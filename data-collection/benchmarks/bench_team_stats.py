@@ -0,0 +1,94 @@
+"""
+Benchmark for the DataCleaner team aggregation step.
+
+Compares the previous groupby/agg with python lambdas (kept here as legacy_aggregate) with TeamAggregator on the same
+synthetic input: the per player rows of the sample 'match_data.csv' repeated with new match_uids until the requested
+number of rows. The outputs are checked to be identical.
+
+Usage (from the data-collection folder):
+    python benchmarks/bench_team_stats.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from MRAPI import DataCleaner, MatchFlattener, TeamAggregator  # noqa: E402
+
+SAMPLE_MATCHES = os.path.join(HERE, '..', '..', 'data', 'match_data.csv')
+HERO_INFO = os.path.join(HERE, '..', 'hero_info.csv')
+
+
+def synthetic_players(n_rows):
+    """
+    Repeats the sample per player rows with new (unique) match_uids until there are n_rows rows.
+    """
+    hero_info_df = pd.read_csv(HERO_INFO)[['id', 'name', 'attack_type', 'role']]
+    sample = pd.read_csv(SAMPLE_MATCHES)
+    # the matches with an oversized team are quarantined here, like in DataCleaner, so the legacy filter has nothing to drop
+    _, filtered_df = MatchFlattener(hero_info_df).flatten(DataCleaner.iter_dataframe_matches(sample))
+
+    repeats = -(-n_rows // len(filtered_df))
+    df = pd.concat([filtered_df] * repeats, ignore_index=True).iloc[:n_rows].copy()
+    copy_number = np.repeat(np.arange(repeats), len(filtered_df))[:n_rows].astype(str)
+    df['match_uid'] = df['match_uid'].str.cat(copy_number, sep='_')
+    return df
+
+
+def legacy_aggregate(filtered_df):
+    """
+    The previous DataCleaner.clean team aggregation, kept as the reference for the benchmark and the output check.
+    """
+    grouped_df = filtered_df.groupby(['match_uid', 'is_win']).agg(
+        num_vang=('role', lambda x: (x == 'VANGUARD').sum()),
+        num_strat=('role', lambda x: (x == 'STRATEGIST').sum()),
+        num_duel=('role', lambda x: (x == 'DUELIST').sum()),
+        players_on_team=('player_uid', 'count'),
+        avg_hitrate=('hit_rate', 'mean'),
+        num_melee=('attack_type', lambda x: (x == 'Melee').sum()),
+        num_hitscan=('attack_type', lambda x: (x == 'Hitscan').sum()),
+        num_projectile=('attack_type', lambda x: (x == 'Projectile').sum()),
+        total_damage=('hero_damage', 'sum'),
+        total_healing=('hero_healed', 'sum'),
+        total_damage_taken=('damage_taken', 'sum'),
+        total_deaths=('deaths_x', 'sum'),
+        total_assists=('assists_x', 'sum'),
+        total_kills=('kills_x', 'sum')
+    ).reset_index()
+    grouped_df['primary_attack_type'] = grouped_df[['num_melee', 'num_projectile', 'num_hitscan']].idxmax(axis=1).str.replace('num_', '')
+    invalid_matches = grouped_df[grouped_df['players_on_team'] > 6]['match_uid'].unique()
+    return grouped_df[~grouped_df['match_uid'].isin(invalid_matches)]
+
+
+def best_time(func, args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'teams':>8} {'legacy (s)':>11} {'vectorized (s)':>15} {'speedup':>8}")
+    for n_rows in args.rows:
+        filtered_df = synthetic_players(n_rows)
+        legacy_time, legacy = best_time(legacy_aggregate, (filtered_df,), args.repeat)
+        new_time, new = best_time(TeamAggregator().aggregate, (filtered_df,), args.repeat)
+        pd.testing.assert_frame_equal(legacy.reset_index(drop=True), new.reset_index(drop=True), check_dtype=False)
+        print(f'{n_rows:>9} {len(new):>8} {legacy_time:>11.3f} {new_time:>15.3f} {legacy_time / new_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
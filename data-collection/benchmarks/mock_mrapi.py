@@ -0,0 +1,354 @@
+"""
+Local stand-in for the MRAPI endpoints used by the collector: match, match-history, player and heroes.
+
+The payloads are replayed from recorded fixtures: the sample 'match_data.csv' / 'match_history.csv' in data/ (or the
+match records of a ResponseJournal) and 'hero_info.csv'. They are replicated with new match_uids and timestamps to any
+number of synthetic matches, so the collector and the cleaner can be measured without an API key or network access.
+Latency, jitter, server errors and 429 responses (random, or from a requests/sec limit) are configurable.
+
+Usage:
+    from mock_mrapi import MockMRAPI
+
+    with MockMRAPI(matches=1000, latency=0.02, rate_limit=0.01) as api:
+        client = MRAPIClient('any key', max_workers=8)
+        client.base_url = api.base_url
+        client.set_request_uid(api.player_uid)
+        client.get_total_data()
+        print(api.stats())
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from MRAPI import ResponseJournal, parse_repr  # noqa: E402
+
+SAMPLE_MATCHES = os.path.join(HERE, '..', '..', 'data', 'match_data.csv')
+SAMPLE_HISTORY = os.path.join(HERE, '..', '..', 'data', 'match_history.csv')
+HERO_INFO = os.path.join(HERE, '..', 'hero_info.csv')
+
+
+def unflatten(row):
+    """
+    Turns a json_normalize'd row ({'a.b': 1}) back into the nested response ({'a': {'b': 1}}).
+    Missing values become None and the python-repr strings of nested lists/dicts are parsed back.
+    """
+    nested = {}
+    for key, value in row.items():
+        if isinstance(value, float) and pd.isna(value):
+            value = None
+        elif isinstance(value, str) and value[:1] in '[{':
+            value = parse_repr(value)
+        elif hasattr(value, 'item'):
+            value = value.item()
+
+        target = nested
+        parts = key.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return nested
+
+
+class Fixtures:
+
+    """
+    Recorded payloads replicated into any number of synthetic matches.
+    Synthetic match i reuses template i % len(templates) with the match_uid '{9000000 + i}_{timestamp}_{...}', the
+    timestamps go back 15 minutes per match so match i = 0 is the newest, like the match-history order.
+
+    Attributes:
+        count (int): Number of synthetic matches.
+        templates (list): The recorded match responses.
+        history_templates (list): The recorded match-history entries.
+        heroes (list): The hero dicts served by the heroes endpoint.
+    """
+
+    def __init__(self, matches=100, match_data=SAMPLE_MATCHES, match_history=SAMPLE_HISTORY, hero_info=HERO_INFO, journal=None, start_time=1745000000):
+        self.count = matches
+        self.start_time = start_time
+
+        if journal is not None:
+            self.templates = [record['response'] for record in ResponseJournal(journal, mode='r').read('match')]
+        else:
+            self.templates = [unflatten(row) for row in pd.read_csv(match_data).to_dict('records')]
+        if not self.templates:
+            raise ValueError('No recorded matches to build the fixtures from.')
+
+        self.history_templates = [unflatten(row) for row in pd.read_csv(match_history).to_dict('records')]
+        self.heroes = [unflatten(row) for row in pd.read_csv(hero_info).to_dict('records')]
+
+        # every template is serialized once, split around its match_uid so a payload is a join and not a json.dumps
+        self.encoded = []
+        for template in self.templates:
+            match_uid = template['match_details']['match_uid']
+            self.encoded.append(json.dumps(template).split(match_uid))
+        self.heroes_body = json.dumps(self.heroes).encode('utf-8')
+
+
+    def timestamp(self, index):
+        return self.start_time - index * 900
+
+
+    def match_uid(self, index):
+        template_uid = self.templates[index % len(self.templates)]['match_details']['match_uid']
+        parts = template_uid.split('_')
+        return '_'.join([str(9000000 + index), str(self.timestamp(index))] + parts[2:])
+
+
+    def match_index(self, match_uid):
+        """
+        Returns the synthetic index of a match_uid (None if it is not one of the fixtures).
+        """
+        try:
+            index = int(match_uid.split('_')[0]) - 9000000
+        except ValueError:
+            return None
+        if 0 <= index < self.count and self.match_uid(index) == match_uid:
+            return index
+        return None
+
+
+    def match_body(self, index):
+        return self.match_uid(index).join(self.encoded[index % len(self.encoded)]).encode('utf-8')
+
+
+    def history_entry(self, index, player_uid, season):
+        entry = json.loads(json.dumps(self.history_templates[index % len(self.history_templates)]))
+        entry['match_uid'] = self.match_uid(index)
+        entry['match_time_stamp'] = self.timestamp(index)
+        entry['match_season'] = season
+        entry.setdefault('match_player', {})['player_uid'] = player_uid
+        return entry
+
+
+    def history(self, player_uid, page=1, limit=20, skip=0, timestamp=0, season=2):
+        """
+        One page of the match history, newest first, only the matches after the timestamp.
+        """
+        end = self.count
+        if timestamp:
+            end = min(end, max(0, (self.start_time - timestamp + 899) // 900))
+        start = (page - 1) * limit + skip
+        return {'match_history': [self.history_entry(index, player_uid, season) for index in range(start, min(start + limit, end))]}
+
+
+    def player(self, player_uid, ranked_matches=20):
+        """
+        A player profile whose rank_history holds the newest ranked_matches fixture matches, each entry stamped 10
+        minutes after the match start (the end of the match) with a seeded SR change.
+        """
+        rng = random.Random(player_uid)
+        level = rng.randint(1, 23)
+        score = level * 100.0
+        rank_history = []
+        for index in range(min(ranked_matches, self.count)):
+            add_score = round(rng.uniform(-30, 30), 2)
+            rank_history.append({
+                'match_time_stamp': self.timestamp(index) + 600,
+                'level_progression': {'from': level, 'to': level},
+                'score_progression': {'add_score': add_score, 'total_score': score}
+            })
+            score = round(score - add_score, 2)
+        return {'uid': player_uid, 'name': f'player_{player_uid}', 'player': {'uid': player_uid, 'level': rng.randint(1, 500), 'rank': {'level': level, 'score': level * 100.0}}, 'rank_history': rank_history}
+
+
+    def write_match_csv(self, path, matches, chunk=5000):
+        """
+        Writes the synthetic matches as a raw 'match_data_*.csv' file (the layout get_total_data saves), chunk by chunk.
+        """
+        from pandas import json_normalize
+
+        template_df = json_normalize(self.templates)
+        with open(path, 'w', newline='') as f:
+            for start in range(0, matches, chunk):
+                indices = list(range(start, min(start + chunk, matches)))
+                df = template_df.iloc[[index % len(self.templates) for index in indices]].copy()
+                df['match_details.match_uid'] = [self.match_uid(index) for index in indices]
+                df.to_csv(f, index=False, header=start == 0)
+        return path
+
+
+class MockMRAPI:
+
+    """
+    A threaded HTTP server answering like the MRAPI from Fixtures.
+
+    Attributes:
+        fixtures (Fixtures): The payloads.
+        latency (float): Seconds added to every response.
+        jitter (float): Up to this many extra seconds (uniform) added to every response.
+        error_rate (float): Fraction of requests answered with a 500.
+        rate_limit (float): Fraction of requests answered with a 429.
+        max_rps (float): Requests/sec above which requests are answered with a 429 (token bucket, None = no limit).
+        retry_after (int): Retry-After header of the 429 responses.
+        page_size (int): Match-history page size when the request has no limit.
+        player_uid (str): A player uid whose history is the whole fixture set (any uid works).
+    """
+
+    def __init__(self, fixtures=None, matches=100, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0.0, max_rps=None, retry_after=1, page_size=20, seed=0, host='127.0.0.1', port=0):
+        self.fixtures = fixtures if fixtures is not None else Fixtures(matches)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.player_uid = '1306734986'
+        self.host = host
+        self.port = port
+
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = max_rps or 0
+        self.refilled = time.monotonic()
+        self.counts = {}
+        self.server = None
+        self.thread = None
+
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.server.server_address[1]}/api/'
+
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # headers and body are separate writes, do not wait for the delayed ACK
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                endpoint, status, body, headers = mock.respond(self.path, self.headers)
+                mock.count(endpoint, status)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+    def count(self, endpoint, status):
+        with self.lock:
+            key = f'{endpoint}:{status}'
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+    def stats(self):
+        """
+        Returns the number of responses per endpoint and status, e.g. {'match:200': 120, 'match:429': 3}.
+        """
+        with self.lock:
+            return dict(self.counts)
+
+
+    def throttled(self):
+        """
+        Token bucket for max_rps (burst of one second) plus the random 429s.
+        """
+        with self.lock:
+            if self.rate_limit and self.rng.random() < self.rate_limit:
+                return True
+            if not self.max_rps:
+                return False
+            now = time.monotonic()
+            self.tokens = min(self.max_rps, self.tokens + (now - self.refilled) * self.max_rps)
+            self.refilled = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+
+    def respond(self, path, headers):
+        """
+        Returns (endpoint, status, body, extra headers) for a request path.
+        """
+        url = urlparse(path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        route = re.match(r'/api/v\d/(.*)$', url.path)
+        route = route.group(1) if route else ''
+
+        if route == 'heroes':
+            endpoint = 'heroes'
+        elif route.startswith('match/'):
+            endpoint = 'match'
+        elif route.startswith('player/') and route.endswith('/match-history'):
+            endpoint = 'match-history'
+        elif route.startswith('player/'):
+            endpoint = 'player'
+        else:
+            return 'unknown', 404, b'{"error": "Not found"}', {}
+
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        if not headers.get('x-api-key'):
+            return endpoint, 401, b'{"error": "Missing API key"}', {}
+        if self.throttled():
+            return endpoint, 429, b'{"error": "Too many requests"}', {'Retry-After': str(self.retry_after)}
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return endpoint, 500, b'{"error": "Internal server error"}', {}
+
+        if endpoint == 'heroes':
+            return endpoint, 200, self.fixtures.heroes_body, {}
+
+        if endpoint == 'match':
+            index = self.fixtures.match_index(route.split('/', 1)[1])
+            if index is None:
+                return endpoint, 404, b'{"error": "Match not found"}', {}
+            return endpoint, 200, self.fixtures.match_body(index), {}
+
+        player_uid = route.split('/')[1]
+        if endpoint == 'player':
+            return endpoint, 200, json.dumps(self.fixtures.player(player_uid)).encode('utf-8'), {}
+
+        history = self.fixtures.history(
+            player_uid,
+            page=int(query.get('page', 1)),
+            limit=int(query.get('limit', self.page_size)),
+            skip=int(query.get('skip', 0)),
+            timestamp=int(query.get('timestamp', 0)),
+            season=int(query.get('season', 2))
+        )
+        return endpoint, 200, json.dumps(history).encode('utf-8'), {}
@@ -0,0 +1,411 @@
+"""
+Command line entry point for the MRAPI collector and cleaner, so runs do not need the 'Data Collection' notebook.
+
+collect: Collects one or more players (get_total_data / collect_many), optionally incrementally.
+clean:   Cleans raw 'match_data_*.csv' files (DataCleaner.clean), the most recent one by default.
+compact: Absorbs the new cleaned files into the combined datasets (DatasetCompactor.compact).
+status:  Shows the data folder, manifest, daemon and sampling plan state from the JSON files only.
+daemon:  Polls the tracked players every --interval seconds: incremental collection, then cleaning (and compaction)
+         of what it collected. SIGINT/SIGTERM or the 'stop' command end it after the current step, its state is saved
+         in 'daemon_state.json' so a restarted daemon picks up where it stopped (players already collected are only
+         asked for newer games, raw files already cleaned are not cleaned again).
+stop:    Asks a running daemon to stop.
+
+MRAPI (and with it pandas, numpy and requests) is only imported by the commands that need it, status and stop only use
+the standard library and start instantly. Every path is relative to --data-folder (defaults to $MRAPI_DATA_FOLDER or
+the repository 'data' folder) instead of the working directory, the API key comes from --api-key or $MRAPI_API_KEY.
+
+Usage (from any folder):
+    python data-collection/mrapi_cli.py collect 1306734986 --incremental --workers 8
+    python data-collection/mrapi_cli.py clean --chunksize 5000
+    python data-collection/mrapi_cli.py compact
+    python data-collection/mrapi_cli.py daemon 1306734986 1775749756 --interval 3600 --compact
+    python data-collection/mrapi_cli.py status
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import signal
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_FOLDER = os.environ.get('MRAPI_DATA_FOLDER', os.path.join(HERE, '..', 'data'))
+HERO_INFO = os.path.join(HERE, 'hero_info.csv')
+
+DAEMON_STATE = 'daemon_state.json'
+DAEMON_STOP = 'daemon.stop'
+
+
+def load_mrapi(args):
+    """
+    Imports MRAPI (pandas, numpy and requests with it) and turns its logs on, only called by the commands that need it.
+    """
+    sys.path.insert(0, HERE)
+    import MRAPI
+
+    MRAPI.configure_logging(args.log_level, as_json=args.log_json)
+    return MRAPI
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    """
+    Writes a JSON file through a temporary file so it is never half written.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def build_client(MRAPI, args):
+    api_key = args.api_key or os.environ.get('MRAPI_API_KEY')
+    if not api_key:
+        raise SystemExit('No API key, use --api-key or set MRAPI_API_KEY.')
+    client = MRAPI.MRAPIClient(api_key, max_workers=args.workers, output_format=args.format, data_folder=args.data_folder)
+    if args.base_url:
+        client.base_url = args.base_url
+    return client
+
+
+def build_cleaner(MRAPI, args, metrics=None):
+    heroes = MRAPI.HeroDimension(os.path.join(args.data_folder, 'hero_dimension.json'), hero_info_path=HERO_INFO).load()
+    stats = MRAPI.StatsStore(os.path.join(args.data_folder, 'stats_store.json')) if args.stats else None
+    validator = MRAPI.MatchValidator(enable=args.enable_rules, disable=args.disable_rules)
+    return MRAPI.DataCleaner(output_format=args.format, heroes=heroes, metrics=metrics, stats=stats, data_folder=args.data_folder, validator=validator)
+
+
+def build_manifest(MRAPI, args):
+    return MRAPI.CollectionManifest(os.path.join(args.data_folder, 'manifest.json'), args.data_folder)
+
+
+def cmd_collect(args):
+    MRAPI = load_mrapi(args)
+    client = build_client(MRAPI, args)
+    manifest = build_manifest(MRAPI, args) if args.incremental else None
+
+    if len(args.player_uids) == 1:
+        client.get_total_data(incremental=args.incremental, manifest=manifest, page_limit=args.page_limit, player_uid=args.player_uids[0])
+    else:
+        result = client.collect_many(args.player_uids, player_workers=args.player_workers, page_limit=args.page_limit, incremental=args.incremental, manifest=manifest)
+        print(f"Collected {len(result['match_uids'])} matches for {len(result['players'])} players.")
+
+    if args.metrics:
+        client.metrics.export(args.metrics)
+
+
+def cmd_clean(args):
+    MRAPI = load_mrapi(args)
+    cleaner = build_cleaner(MRAPI, args)
+    csv_file = args.files if args.files else None
+    summaries = cleaner.clean(csv_file, chunksize=args.chunksize, workers=args.clean_workers)
+    for summary in summaries:
+        print(f"{summary['suffix']}: {summary['matches']} matches, {summary['hero_rows']} hero rows, {summary['teams']} teams, {summary['quarantined']} quarantined")
+
+    if args.metrics:
+        cleaner.metrics.export(args.metrics)
+
+
+def cmd_compact(args):
+    MRAPI = load_mrapi(args)
+    summary = MRAPI.DatasetCompactor(args.data_folder, chunksize=args.chunksize or 100000).compact()
+    for output, stats in summary.items():
+        print(f"{output}: {stats['files']} files, {stats['rows_added']} rows added, {stats['duplicates']} duplicates, {stats['skipped']} skipped")
+
+
+def format_time(timestamp):
+    if not timestamp:
+        return '-'
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def daemon_running(state):
+    """
+    True if the process recorded in the daemon state is still alive.
+    """
+    pid = (state or {}).get('pid')
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except (OSError, ProcessLookupError):
+        return False
+    return True
+
+
+def cmd_status(args):
+    data_folder = args.data_folder
+    raw_files = [path for path in glob.glob(os.path.join(data_folder, 'match_data*.csv'))]
+    cleaned_files = glob.glob(os.path.join(data_folder, 'cleaned_match_data_individual_stats_*.csv'))
+    manifest = read_json(os.path.join(data_folder, 'manifest.json'), {})
+    state = read_json(os.path.join(data_folder, DAEMON_STATE))
+    plan = read_json(os.path.join(data_folder, 'sampling_plan.json'))
+    compact_index = read_json(os.path.join(data_folder, 'compaction_index.json'), {})
+
+    status = {
+        'data_folder': os.path.abspath(data_folder),
+        'raw_files': len(raw_files),
+        'raw_mb': round(sum(os.path.getsize(path) for path in raw_files) / 1024 / 1024, 1),
+        'cleaned_runs': len(cleaned_files),
+        'manifest_matches': len(manifest.get('matches', [])),
+        'manifest_players': len(manifest.get('watermarks', {})),
+        'newest_watermark': max(manifest.get('watermarks', {}).values(), default=0),
+        'compacted_files': len(compact_index),
+        'daemon': None,
+        'sampling': None
+    }
+    if state is not None:
+        status['daemon'] = {
+            'running': daemon_running(state),
+            'stop_requested': os.path.exists(os.path.join(data_folder, DAEMON_STOP)),
+            'players': len(state['players']),
+            'runs': state['runs'],
+            'last_run': state['last_run'],
+            'next_run': state['next_run'],
+            'pending_clean': [suffix for suffix in state['collected'] if suffix not in state['cleaned']],
+            'last_error': state.get('last_error')
+        }
+    if plan is not None:
+        status['sampling'] = {key: {'quota': quota, 'fetched': plan['strata'][key]['fetched'], 'pending': len(plan['strata'][key]['pending'])} for key, quota in plan['quotas'].items()}
+
+    if args.json:
+        print(json.dumps(status, indent=1))
+        return
+
+    print(f"data folder:  {status['data_folder']}")
+    print(f"raw files:    {status['raw_files']} ({status['raw_mb']} MB), cleaned runs: {status['cleaned_runs']}, compacted files: {status['compacted_files']}")
+    print(f"manifest:     {status['manifest_matches']} matches, {status['manifest_players']} players, newest game {format_time(status['newest_watermark'])}")
+    daemon = status['daemon']
+    if daemon is None:
+        print('daemon:       never started')
+    else:
+        print(f"daemon:       {'running' if daemon['running'] else 'stopped'}{' (stop requested)' if daemon['stop_requested'] else ''}, "
+              f"{daemon['players']} players, {daemon['runs']} runs, last {format_time(daemon['last_run'])}, next {format_time(daemon['next_run'])}")
+        if daemon['pending_clean']:
+            print(f"              not cleaned yet: {', '.join(daemon['pending_clean'])}")
+        if daemon['last_error']:
+            print(f"              last error: {daemon['last_error']}")
+    for key, stratum in (status['sampling'] or {}).items():
+        print(f"sampling:     {key} {stratum['fetched']}/{stratum['quota']} fetched, {stratum['pending']} planned")
+
+
+def cmd_stop(args):
+    state = read_json(os.path.join(args.data_folder, DAEMON_STATE))
+    if not daemon_running(state):
+        print('No daemon is running.')
+        return
+    with open(os.path.join(args.data_folder, DAEMON_STOP), 'w') as f:
+        f.write(str(time.time()))
+    print(f"Stop requested, daemon {state['pid']} stops after its current step.")
+
+
+class Daemon:
+
+    """
+    The long running collection loop of the daemon command.
+    Every cycle collects the tracked players incrementally (one raw file per cycle), then cleans every raw file it
+    collected that is not cleaned yet, then optionally compacts. Each finished step is recorded in the state file right
+    away, so a daemon stopped (or killed) in the middle of a cycle only redoes the unfinished step when it is restarted.
+    The suffix of a raw file is recorded before it is collected, so a file written just before a kill is still cleaned,
+    and a recorded suffix without a raw file (nothing new was collected) is dropped by the clean step.
+
+    Attributes:
+        args (Namespace): The parsed command line.
+        state_path (str): Path of the daemon state file.
+        stop_path (str): File whose presence asks the daemon to stop (see the stop command).
+        state (dict): players, collected and cleaned raw file suffixes, runs, last_run, next_run, pid and last_error.
+        stopping (bool): Set by SIGINT/SIGTERM or the stop file, the loop ends after the current step.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.state_path = os.path.join(args.data_folder, DAEMON_STATE)
+        self.stop_path = os.path.join(args.data_folder, DAEMON_STOP)
+        self.state = read_json(self.state_path, {'players': [], 'collected': [], 'cleaned': [], 'runs': 0, 'last_run': 0, 'next_run': 0})
+        self.stopping = False
+
+
+    def save(self):
+        write_json(self.state_path, self.state)
+
+
+    def request_stop(self, signum=None, frame=None):
+        self.stopping = True
+
+
+    def stop_requested(self):
+        if os.path.exists(self.stop_path):
+            self.stopping = True
+        return self.stopping
+
+
+    def run(self):
+        if daemon_running(self.state) and self.state['pid'] != os.getpid():
+            raise SystemExit(f"A daemon is already running (pid {self.state['pid']}).")
+        for player_uid in self.args.player_uids:
+            if player_uid not in self.state['players']:
+                self.state['players'].append(player_uid)
+        if not self.state['players']:
+            raise SystemExit('No players to track, pass player uids to the daemon command.')
+
+        if os.path.exists(self.stop_path):
+            os.remove(self.stop_path)
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+
+        self.state['pid'] = os.getpid()
+        if self.args.now:
+            self.state['next_run'] = 0
+        self.save()
+
+        MRAPI = load_mrapi(self.args)
+        MRAPI.logger.info('Daemon started for %s players, every %ss...', len(self.state['players']), self.args.interval)
+        try:
+            while not self.stop_requested():
+                if time.time() >= self.state['next_run']:
+                    self.cycle(MRAPI)
+                    if self.args.once:
+                        break
+                # sleep in short steps so a stop request is picked up quickly
+                time.sleep(min(1.0, max(self.state['next_run'] - time.time(), 0.01)))
+        finally:
+            self.state['pid'] = None
+            self.save()
+            if os.path.exists(self.stop_path):
+                os.remove(self.stop_path)
+            MRAPI.logger.info('Daemon stopped.')
+
+
+    def cycle(self, MRAPI):
+        """
+        One collect -> clean -> compact cycle. A failed step is logged and recorded, the next cycle tries again.
+        """
+        self.state['last_run'] = time.time()
+        self.state['next_run'] = self.state['last_run'] + self.args.interval
+        self.state['last_error'] = None
+        try:
+            self.collect(MRAPI)
+            if not self.stop_requested():
+                self.clean(MRAPI)
+            if self.args.compact and not self.stop_requested():
+                MRAPI.DatasetCompactor(self.args.data_folder).compact()
+        except Exception as e:
+            MRAPI.logger.exception('Daemon cycle failed...')
+            self.state['last_error'] = f'{type(e).__name__}: {e}'
+        self.state['runs'] += 1
+        self.save()
+
+
+    def collect(self, MRAPI):
+        client = build_client(MRAPI, self.args)
+        current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+        suffix = f"{client.request_params['season']}_daemon_{self.state['runs'] + 1:05d}_{current_date}"
+
+        if suffix not in self.state['collected']:
+            self.state['collected'].append(suffix)
+            self.save()
+
+        client.collect_many(self.state['players'], player_workers=self.args.player_workers, page_limit=self.args.page_limit,
+                            incremental=True, manifest=build_manifest(MRAPI, self.args), suffix=suffix)
+
+
+    def clean(self, MRAPI):
+        pending = [suffix for suffix in self.state['collected'] if suffix not in self.state['cleaned']]
+        if not pending:
+            return
+        cleaner = build_cleaner(MRAPI, self.args)
+        for suffix in pending:
+            csv_file = os.path.join(self.args.data_folder, f'match_data_{suffix}.csv')
+            if not os.path.exists(csv_file):
+                # no new matches, or the collection stopped before the raw file was written (it is collected again)
+                self.state['collected'].remove(suffix)
+                self.save()
+                continue
+            cleaner.clean(csv_file, chunksize=self.args.chunksize, workers=self.args.clean_workers)
+            self.state['cleaned'].append(suffix)
+            self.save()
+            if self.stop_requested():
+                return
+
+
+def cmd_daemon(args):
+    Daemon(args).run()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-folder', default=DATA_FOLDER, help='Folder of the raw/cleaned files and the state files.')
+    parser.add_argument('--log-level', default='INFO', help='MRAPI log level.')
+    parser.add_argument('--log-json', action='store_true', help='Write the logs as JSON lines.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_client_arguments(command):
+        command.add_argument('--api-key', help='MRAPI key (defaults to $MRAPI_API_KEY).')
+        command.add_argument('--base-url', help='Use another API base url (e.g. the mock server).')
+        command.add_argument('--workers', type=int, default=4, help='Concurrent match requests.')
+        command.add_argument('--player-workers', type=int, help='Player histories paged through at once.')
+        command.add_argument('--page-limit', type=int, help='Matches per match-history page.')
+
+    def add_cleaner_arguments(command):
+        command.add_argument('--chunksize', type=int, help='Matches cleaned at a time.')
+        command.add_argument('--clean-workers', type=int, default=1, help='Processes cleaning chunks in parallel.')
+        command.add_argument('--stats', action='store_true', help='Update the stats store with the cleaned rows.')
+        command.add_argument('--enable-rules', nargs='+', help='Validation rules to turn on (e.g. leaver surrendered).')
+        command.add_argument('--disable-rules', nargs='+', help='Validation rules to turn off.')
+
+    collect = commands.add_parser('collect', help='Collect the matches of one or more players.')
+    collect.add_argument('player_uids', nargs='+')
+    collect.add_argument('--incremental', action='store_true', help='Only collect games newer than the manifest watermarks.')
+    collect.add_argument('--format', default='csv', choices=['csv', 'parquet', 'both'])
+    collect.add_argument('--metrics', help='Export the run metrics to this JSON file.')
+    add_client_arguments(collect)
+    collect.set_defaults(handler=cmd_collect)
+
+    clean = commands.add_parser('clean', help='Clean raw match_data files (the most recent one by default).')
+    clean.add_argument('files', nargs='*', help='Files or glob patterns.')
+    clean.add_argument('--format', default='csv', choices=['csv', 'parquet', 'both'])
+    clean.add_argument('--metrics', help='Export the run metrics to this JSON file.')
+    add_cleaner_arguments(clean)
+    clean.set_defaults(handler=cmd_clean)
+
+    compact = commands.add_parser('compact', help='Absorb new cleaned files into the combined datasets.')
+    compact.add_argument('--chunksize', type=int, help='Rows read at a time.')
+    compact.set_defaults(handler=cmd_compact)
+
+    status = commands.add_parser('status', help='Show the collection state (no heavy imports).')
+    status.add_argument('--json', action='store_true', help='Print the status as JSON.')
+    status.set_defaults(handler=cmd_status)
+
+    daemon = commands.add_parser('daemon', help='Poll the tracked players on a schedule.')
+    daemon.add_argument('player_uids', nargs='*', help='Players to add to the tracked players.')
+    daemon.add_argument('--interval', type=float, default=3600, help='Seconds between two cycles.')
+    daemon.add_argument('--now', action='store_true', help='Start with a cycle instead of waiting for the scheduled one.')
+    daemon.add_argument('--once', action='store_true', help='Run a single cycle and exit.')
+    daemon.add_argument('--compact', action='store_true', help='Compact after cleaning.')
+    daemon.add_argument('--format', default='csv', choices=['csv'], help='The daemon cleans the raw CSV files it collects.')
+    add_client_arguments(daemon)
+    add_cleaner_arguments(daemon)
+    daemon.set_defaults(handler=cmd_daemon)
+
+    stop = commands.add_parser('stop', help='Ask a running daemon to stop after its current step.')
+    stop.set_defaults(handler=cmd_stop)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
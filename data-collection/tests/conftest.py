@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+SAMPLE_MATCHES = os.path.join(HERE, '..', '..', 'data', 'match_data.csv')
+HERO_INFO = os.path.join(HERE, '..', 'hero_info.csv')
+
+
+@pytest.fixture(scope='session')
+def raw_matches():
+    return pd.read_csv(SAMPLE_MATCHES)
+
+
+@pytest.fixture(scope='session')
+def heroes():
+    import MRAPI
+    return MRAPI.HeroDimension.from_frame(pd.read_csv(HERO_INFO))
@@ -0,0 +1,19 @@
+import pytest
+
+import MRAPI
+
+pytest.importorskip('sklearn')
+
+
+def test_compact_frame_does_not_leak_match_identity(raw_matches, heroes):
+    _, filtered_df, _ = MRAPI.clean_chunk(raw_matches, heroes)[:3]
+    compact = MRAPI.CompactSchema().compact(filtered_df.reset_index(drop=True))
+    assert set(MRAPI.CompactSchema.match_uid_parts) <= set(compact.columns)
+
+    evaluator = MRAPI.ModelEvaluator(compact)
+    leaked = [feature for feature in evaluator.features if feature in evaluator.id_columns or feature.endswith('_uid')]
+    assert leaked == []
+    assert 'kills_x' in evaluator.features
+
+    results = evaluator.evaluate(workers=1)
+    assert len(results) == 1
@@ -0,0 +1,35 @@
+import glob
+import os
+
+import pandas as pd
+
+import MRAPI
+from mock_mrapi import Fixtures, MockMRAPI
+
+
+def test_budget_pauses_the_crawl_without_losing_matches(tmp_path):
+    fixtures = Fixtures(30)
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+
+    with MockMRAPI(fixtures=fixtures, page_size=20) as api:
+        client = MRAPI.MRAPIClient('any key', data_folder=str(tmp_path))
+        client.base_url = api.base_url
+
+        # only the seed is crawled, every budget cut has to be picked up again by a resumed crawl
+        budget = 0
+        seeds = ['1306734986']
+        while True:
+            budget += 7
+            crawler = MRAPI.PlayerCrawler(client, max_matches=budget, history_pages=2, players_per_match=0,
+                                          checkpoint_path=checkpoint_path, data_folder=str(tmp_path))
+            collected = crawler.crawl(seeds)
+            if not crawler.frontier:
+                break
+            assert collected == budget
+
+    expected = {fixtures.match_uid(index) for index in range(fixtures.count)}
+    assert crawler.visited_matches == expected
+
+    match_files = glob.glob(os.path.join(str(tmp_path), 'match_data_*.csv'))
+    match_uids = pd.concat(pd.read_csv(path) for path in match_files)['match_details.match_uid']
+    assert sorted(match_uids) == sorted(expected)
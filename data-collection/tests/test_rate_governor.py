@@ -0,0 +1,31 @@
+import time
+
+import MRAPI
+from mock_mrapi import Fixtures, MockMRAPI
+
+
+def test_raising_the_ceiling_raises_the_limit():
+    governor = MRAPI.RateGovernor('key')
+    governor.set_max_concurrency(8)
+    assert governor.limit == 8
+
+    governor.release(governor.acquire(), 429, retry_after=0)
+    assert governor.limit == 4
+    governor.set_max_concurrency(8)
+    assert governor.limit == 4
+
+
+def test_first_batch_is_dispatched_in_parallel():
+    fixtures = Fixtures(16)
+    with MockMRAPI(fixtures=fixtures, latency=0.2) as api:
+        client = MRAPI.MRAPIClient('any key')
+        client.base_url = api.base_url
+
+        match_uids = [fixtures.match_uid(index) for index in range(8)]
+        start = time.perf_counter()
+        matches = client.get_many('v1', 'match', match_uids, max_workers=8)
+        seconds = time.perf_counter() - start
+
+    assert [match['match_details']['match_uid'] for match in matches] == match_uids
+    # 8 requests of 0.2s each, serialized they would take 1.6s
+    assert seconds < 0.8
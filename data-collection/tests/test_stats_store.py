@@ -0,0 +1,17 @@
+import numpy as np
+
+import MRAPI
+
+
+def test_role_stats_use_the_player_totals(tmp_path, raw_matches, heroes):
+    _, player_df, _ = MRAPI.clean_chunk(raw_matches, heroes)[:3]
+    player_df = player_df.reset_index(drop=True)
+    player_df.loc[0, 'role'] = None
+
+    store = MRAPI.StatsStore(str(tmp_path / 'stats_store.json'))
+    store.update(player_df=player_df)
+
+    assert set(store.aggregates['role']) == set(player_df['role'].dropna().unique())
+    expected = player_df.dropna(subset=['role']).groupby('role')['kills_y'].mean()
+    for role, mean in expected.items():
+        assert np.isclose(store.stats('role', role)['kills_y']['mean'], mean)